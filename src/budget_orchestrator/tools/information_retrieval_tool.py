@@ -9,6 +9,10 @@ from datetime import datetime
 # Add current directory to path for imports
 current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, current_dir)
+# Shared field ontology lives in src/
+sys.path.append(os.path.dirname(current_dir))
+
+from field_ontology import get_field_index
 
 try:
     from config import FIELD_CRITICALITY, CONTEXT_REWARDS
@@ -20,6 +24,9 @@ except ImportError:
     }
     CONTEXT_REWARDS = {'context_utilization': 0.3}
 
+# Field types whose ontology field is not named after the type
+FIELD_TYPE_FIELDS = {'date': 'dateOfBirth', 'insurance_id': 'subscriberId'}
+
 class InformationRetrievalTool:
     
     # Initialize tool with user context for retrieving known information
@@ -103,6 +110,14 @@ class InformationRetrievalTool:
                     'confidence': 0.85
                 }
         
+        # Differently named key for the same ontology field (e.g. "patientDOB" for "date_of_birth")
+        matched_key = get_field_index().find_key(field_id, self.user_info.keys())
+        if matched_key:
+            return {
+                'value': str(self.user_info[matched_key]),
+                'confidence': 0.85
+            }
+        
         return None
     
     # Retrieve field values from chat history
@@ -148,19 +163,10 @@ class InformationRetrievalTool:
         field_name = field_id.replace('_', ' ').replace('-', ' ')
         variations.extend([field_name, field_name.lower()])
         
-        # Add field-specific variations
-        field_specific = {
-            'name': ['name', 'full name'],
-            'ssn': ['ssn', 'social security number'],
-            'phone': ['phone', 'phone number'],
-            'email': ['email', 'email address'],
-            'date': ['date', 'birth date', 'dob'],
-            'address': ['address', 'home address'],
-            'insurance_id': ['insurance', 'insurance id']
-        }
-        
-        if field_type in field_specific:
-            variations.extend(field_specific[field_type])
+        # Add aliases of the field and of its type from the shared field ontology
+        field_index = get_field_index()
+        variations.extend(field_index.aliases_for(field_id))
+        variations.extend(field_index.aliases_for(FIELD_TYPE_FIELDS.get(field_type, field_type)))
         
         return list(set(variations))  # Remove duplicates
 
@@ -9,6 +9,11 @@ import ast
 from pdf2image import convert_from_path
 from find_label_coords import find_label_coords
 
+# Shared field ontology lives alongside this package in src/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from field_ontology import get_field_index
+from form_fingerprint import get_layout_index, layout_fingerprint
+
 """Example script usage: python3 src/document_creation/write_pdf.py SAMPLE_PNG_PATH SAMPLE_JSON"""
 SAMPLE_PNG_PATH = "./W-2.png"
 
@@ -161,11 +166,26 @@ def overlay_text(img_path, text_list, coordinates_list,
 
 
 def detect_form_type(img_path):
-    """Detect the type of form based on the image content."""
+    """Detect the type of form from its filename, or else from its layout fingerprint."""
     image = Image.open(img_path)
-    # For now, just check the filename
+    try:
+        fingerprint = layout_fingerprint(image)
+    except Exception as e:
+        logging.warning(f"Could not fingerprint {img_path}: {e}")
+        fingerprint = None
+
+    layout_index = get_layout_index()
     if "W-2" in img_path:
+        # Remember what a W-2 looks like so renamed scans and photos are recognised too
+        if fingerprint is not None and not any(f["formKey"] == "W-2" for f in layout_index.forms()):
+            layout_index.add("W-2", fingerprint, schema=list(FORM_TEMPLATES["W-2"]),
+                             coordinates=FORM_TEMPLATES["W-2"], size=image.size, kind="template")
         return "W-2"
+
+    if fingerprint is not None:
+        match = layout_index.nearest(fingerprint, kind="template")
+        if match and match.form_key in FORM_TEMPLATES:
+            return match.form_key
     return None
 
 
@@ -299,101 +319,8 @@ def normalize_and_match_fields(json_data, label_coords):
         dict: Matched fields with their values
     """
 
-    # Create a normalized mapping of common field variations
-    field_variations = {
-        # W-2 Form specific fields
-        "employeessocialsecuritynumber": ["a Employee social security number", "Employee's social security number", "social security number"],
-        "employeridentificationnumber": ["b Employer identification number", "Employer identification number (EIN)", "EIN"],
-        "employernameaddressandzipcode": ["c Employer name, address, and ZIP code", "Employer's name, address, and ZIP code"],
-        "controlnumber": ["d Control number", "Control number"],
-        "employeefirstnameandinitial": ["e Employee first name and initial", "Employee's first name and initial"],
-        "lastname": ["Last name", "Employee's last name"],
-        "employeeaddressandzipcode": ["f Employee address and ZIP code", "Employee's address and ZIP code"],
-        "wagestipsothercompensation": ["1 Wages, tips, other compensation", "Wages, tips, and other compensation"],
-        "federalincometaxwithheld": ["2 Federal income tax withheld"],
-        "socialsecuritywages": ["3 Social security wages"],
-        "socialsecuritytaxwithheld": ["4 Social security tax withheld"],
-        "medicarewagesandtips": ["5 Medicare wages and tips"],
-        "medicaretaxwithheld": ["6 Medicare tax withheld"],
-        "socialsecuritytips": ["7 Social security tips"],
-        "allocatedtips": ["8 Allocated tips"],
-        "dependentcarebenefits": ["10 Dependent care benefits"],
-        "nonqualifiedplans": ["11 Nonqualified plans"],
-        "state": ["15 State"],
-        "employerstateidnumber": ["Employer state ID number", "State employer ID"],
-        "statewages": ["16 State wages, tips, etc.", "State wages"],
-        "stateincome": ["17 State income tax"],
-        "localwages": ["18 Local wages, tips, etc.", "Local wages"],
-        "localincometax": ["19 Local income tax"],
-        "localityname": ["20 Locality name"],
-    }
-    
-    # Add the existing field variations
-    field_variations.update({
-        # Personal information
-        "patientfirstname": ["first name", "firstname", "fname", "patient first name", "patient name"],
-        "patientmiddleinitial": ["middle initial", "mi", "middle name", "patient middle initial"],
-        "patientlastname": ["last name", "lastname", "lname", "patient last name", "surname"],
-        "dateofbirth": ["dob", "birth date", "birthdate", "date of birth", "patient date of birth"],
-        "gender": ["sex", "patient gender", "patient sex"],
-        "race": ["ethnicity", "patient race", "patient ethnicity"],
-        "maritalstatus": ["marital status", "status", "patient marital status"],
-        "language": ["preferred language", "patient language", "language preference"],
-        "socialsecuritynumber": ["ssn", "social security no", "social security number", "social security"],
-        
-        # Contact information
-        "addressstreet": ["address", "street address", "street", "patient address", "patient address street"],
-        "addresscity": ["city", "town", "patient city", "patient address city"],
-        "addressstate": ["state", "province", "patient state", "patient address state"],
-        "addresszipcode": ["zip", "zipcode", "zip code", "postal code", "patient zip", "patient address zip code"],
-        "hometelephone": ["home phone", "telephone", "home tel", "home telephone"],
-        "worktelephone": ["work phone", "business phone", "office phone", "work tel", "work telephone"],
-        "celltelephone": ["cell phone", "mobile", "mobile phone", "cell", "cellular", "cell telephone"],
-        "email": ["email address", "e-mail", "patient email"],
-        
-        # Emergency contact
-        "emergencycontactname": ["emergency contact", "emergency name", "emergency contact person", "emergency contact name"],
-        "emergencycontactrelationship": ["emergency relationship", "emergency contact relation", "relation to patient", "emergency contact relationship"],
-        "emergencycontacttelephone": ["emergency phone", "emergency tel", "emergency contact phone", "emergency contact tel", "emergency contact telephone"],
-        
-        # Employment
-        "employmentstatus": ["employment", "employment type", "work status"],
-        "occupation": ["job", "position", "profession"],
-        "industry": ["sector", "field", "business sector"],
-        "companyname": ["employer", "company", "business name", "place of employment", "employer name"],
-        "companyaddressstreet": ["company street", "employer address", "business address", "company address", "company address street"],
-        "companyaddresscity": ["company city", "employer city", "business city", "company address city"],
-        "companyaddressstate": ["company state", "employer state", "business state", "company address state"],
-        "companyaddresszipcode": ["company zip", "employer zip", "business zip", "company address zip", "company address zip code"],
-        
-        # Insurance
-        "insuranceprovider": ["insurance company", "insurer", "insurance", "insurance carrier", "insurance provider"],
-        "patientgroupnumber": ["group number", "group no", "group", "insurance group", "patient group number"],
-        "policynumber": ["policy no", "policy", "insurance policy", "policy id", "policy number"],
-        "patientsubscriberid": ["subscriber id", "member id", "insurance id", "patient id", "patient subscriber id"],
-        "typeofinsurance": ["insurance type", "plan type", "coverage type", "type of insurance"],
-        "insurancetelephone": ["insurance phone", "insurer phone", "insurance tel", "insurance telephone"],
-        "subscribername": ["subscriber", "policy holder", "insurance holder", "subscriber name"],
-        
-        # Medical
-        "allergies": ["patient allergies", "known allergies", "allergy list", "allergic to"],
-        "reasonforvisit": ["chief complaint", "reason", "symptoms", "reason for visit"],
-        "primarycarephysicianname": ["pcp", "primary doctor", "doctor name", "physician", "primary care physician", "primary care physician name"],
-        "primarycarephysicianaddressstreet": ["doctor address", "physician address", "pcp address", "primary care physician address", "primary care physician address street"],
-        "primarycarephysicianaddresscity": ["doctor city", "physician city", "pcp city", "primary care physician address city"],
-        "primarycarephysicianaddressstate": ["doctor state", "physician state", "pcp state", "primary care physician address state"],
-        "primarycarephysicianaddresszipcode": ["doctor zip", "physician zip", "pcp zip", "primary care physician address zip", "primary care physician address zip code"],
-        
-        # Appointment
-        "desiredappointmentdate1": ["appointment date", "appt date", "preferred date", "desired appointment date"],
-        "desiredappointmenttime1": ["appointment time", "appt time", "preferred time", "desired appointment time"],
-        "desiredappointmentdate2": ["alternate date", "second date", "backup date", "desired appointment date 2"],
-        "desiredappointmenttime2": ["alternate time", "second time", "backup time", "desired appointment time 2"],
-        
-        # Signature fields
-        "date": ["signature date", "today's date", "form date"],
-        "signature": ["patient signature", "signature of patient", "signature"]
-    })
+    # Field name variations come from the shared field ontology
+    field_index = get_field_index()
     
     # Create normalized versions of label_coords keys
     normalized_labels = {}
@@ -433,30 +360,20 @@ def normalize_and_match_fields(json_data, label_coords):
             original_label = normalized_labels[json_key_norm]
             matched_fields[original_label] = value
     
-    # Then try finding variations
-    for standard_key, variations in field_variations.items():
-        # If we already have this field, skip
-        if any(standard_key == ''.join(e.lower() for e in k if e.isalnum()) for k in matched_fields):
+    # Then match through the field ontology: a form label and a JSON key that
+    # resolve to the same canonical field are the same field
+    json_by_field = {}
+    for key, value in flattened_json.items():
+        canonical = field_index.canonical(key)
+        if canonical and canonical not in json_by_field:
+            json_by_field[canonical] = value
+    
+    for label in label_coords:
+        if label in matched_fields:
             continue
-            
-        # Try to find a match using variations
-        for variation in variations:
-            variation_norm = ''.join(e.lower() for e in variation if e.isalnum())
-            
-            # Check if this variation exists in the form labels
-            if variation_norm in normalized_labels:
-                original_label = normalized_labels[variation_norm]
-                
-                # Find the value in the JSON data
-                if standard_key in json_mapping:
-                    matched_fields[original_label] = json_mapping[standard_key]
-                    break
-                    
-                # Try variations in the JSON too
-                for json_key_norm, value in json_mapping.items():
-                    if json_key_norm == standard_key or json_key_norm in variations:
-                        matched_fields[original_label] = value
-                        break
+        canonical = field_index.canonical(label)
+        if canonical in json_by_field:
+            matched_fields[label] = json_by_field[canonical]
     
     # Add any unmatched but recognized form fields with empty values
     for label in label_coords:
@@ -0,0 +1,22 @@
+# Shared field ontology for Quill
+# One alias table and matcher used by profile merging, EHR form processing and PDF filling
+
+from .aliases import FIELD_ALIASES, BROADER_FIELDS
+from .index import FieldAliasIndex, FieldMatch, get_field_index, normalize_key, key_words
+from .merge import MergeResult, merge_profiles
+from .patterns import PatternExtraction, PatternExtractor, extract_labelled_fields
+
+__all__ = [
+    "FIELD_ALIASES",
+    "BROADER_FIELDS",
+    "FieldAliasIndex",
+    "FieldMatch",
+    "get_field_index",
+    "normalize_key",
+    "key_words",
+    "MergeResult",
+    "merge_profiles",
+    "PatternExtraction",
+    "PatternExtractor",
+    "extract_labelled_fields",
+]
@@ -0,0 +1,136 @@
+"""
+Canonical form fields and their known aliases.
+
+This is the single alias table shared by the RAG server's profile merge,
+the EHR form processor, the PDF writer and the budget orchestrator tools.
+Aliases are matched after normalization (lower-cased, alphanumerics only),
+so "Date of Birth", "date_of_birth" and "dateOfBirth" are the same alias.
+"""
+
+FIELD_ALIASES = {
+    # Personal information
+    "name": ["name", "full name", "patient name", "patient full name", "user name", "username", "member name"],
+    "firstName": ["first name", "firstname", "fname", "given name", "patient first name", "employee first name and initial",
+                  "e Employee first name and initial", "Employee's first name and initial"],
+    "middleName": ["middle name", "middle initial", "mi", "patient middle initial", "patient middle name"],
+    "lastName": ["last name", "lastname", "lname", "surname", "family name", "patient last name", "Employee's last name"],
+    "dateOfBirth": ["date of birth", "dob", "birth date", "birthdate", "birthday", "patient date of birth", "patient dob"],
+    "gender": ["gender", "sex", "patient gender", "patient sex"],
+    "race": ["race", "patient race"],
+    "ethnicity": ["ethnicity", "patient ethnicity"],
+    "maritalStatus": ["marital status", "patient marital status"],
+    "language": ["language", "preferred language", "patient language", "language preference"],
+    "ssn": ["ssn", "social security number", "social security no", "social security", "socialsecuritynumber",
+            "taxpayer id", "patient ssn", "employee social security number", "a Employee social security number",
+            "Employee's social security number"],
+
+    # Contact information
+    "address": ["address", "home address", "residential address", "mailing address", "patient address"],
+    "addressStreet": ["street address", "street", "address street", "patient address street"],
+    "addressCity": ["city", "town", "address city", "patient city", "patient address city"],
+    "addressState": ["state", "province", "address state", "patient state", "patient address state", "15 State"],
+    "addressZipCode": ["zip", "zipcode", "zip code", "postal code", "address zip code", "patient zip", "patient address zip code"],
+    "phone": ["phone", "phone number", "telephone number", "contact number", "patient phone", "patient phone number"],
+    "homePhone": ["home phone", "home telephone", "home tel", "telephone", "home phone number", "patient home telephone"],
+    "workPhone": ["work phone", "work telephone", "business phone", "office phone", "work tel"],
+    "cellPhone": ["cell phone", "cell telephone", "mobile", "mobile phone", "mobile number", "cell", "cellular", "cell phone number"],
+    "email": ["email", "email address", "e-mail", "user email", "patient email"],
+
+    # Emergency contact
+    "emergencyContactName": ["emergency contact", "emergency contact name", "emergency name", "emergency contact person"],
+    "emergencyContactRelationship": ["emergency contact relationship", "emergency relationship", "emergency contact relation",
+                                     "relation to patient"],
+    "emergencyContactPhone": ["emergency contact phone", "emergency phone", "emergency tel", "emergency contact tel",
+                              "emergency contact telephone"],
+
+    # Employment
+    "employmentStatus": ["employment status", "employment", "employment type", "work status"],
+    "occupation": ["occupation", "job", "job title", "position", "profession"],
+    "industry": ["industry", "sector", "business sector"],
+    "companyName": ["company name", "employer", "employer name", "company", "business name", "place of employment"],
+    "companyAddressStreet": ["company address", "company address street", "company street", "employer address", "business address"],
+    "companyAddressCity": ["company address city", "company city", "employer city", "business city"],
+    "companyAddressState": ["company address state", "company state", "employer state", "business state"],
+    "companyAddressZipCode": ["company address zip code", "company address zip", "company zip", "employer zip", "business zip"],
+    "income": ["income", "salary", "wages", "earnings", "compensation", "annual income"],
+
+    # Insurance
+    "insuranceProvider": ["insurance provider", "insurance company", "insurer", "insurance", "insurance carrier"],
+    "groupNumber": ["group number", "group no", "group", "insurance group", "patient group number"],
+    "policyNumber": ["policy number", "policy no", "policy", "insurance policy", "policy id"],
+    "subscriberId": ["subscriber id", "member id", "insurance id", "patient subscriber id"],
+    "insuranceType": ["type of insurance", "insurance type", "plan type", "coverage type"],
+    "insurancePhone": ["insurance telephone", "insurance phone", "insurer phone", "insurance tel"],
+    "subscriberName": ["subscriber name", "subscriber", "policy holder", "insurance holder"],
+
+    # Medical
+    "allergies": ["allergies", "allergy", "patient allergies", "known allergies", "allergy list", "allergic to"],
+    "conditions": ["conditions", "diagnoses", "medical conditions", "medical history", "current conditions"],
+    "medications": ["medications", "current medications", "meds", "drugs", "medication list"],
+    "reasonForVisit": ["reason for visit", "chief complaint", "reason", "symptoms"],
+    "primaryCarePhysicianName": ["primary care physician name", "primary care physician", "pcp", "primary doctor",
+                                 "doctor name", "physician"],
+    "primaryCarePhysicianAddressStreet": ["primary care physician address street", "primary care physician address",
+                                          "doctor address", "physician address", "pcp address"],
+    "primaryCarePhysicianAddressCity": ["primary care physician address city", "doctor city", "physician city", "pcp city"],
+    "primaryCarePhysicianAddressState": ["primary care physician address state", "doctor state", "physician state", "pcp state"],
+    "primaryCarePhysicianAddressZipCode": ["primary care physician address zip code", "primary care physician address zip",
+                                           "doctor zip", "physician zip", "pcp zip"],
+
+    # Vital signs
+    "bloodPressure": ["blood pressure", "bp"],
+    "heartRate": ["heart rate", "pulse", "pulse rate"],
+    "temperature": ["temperature", "temp", "body temperature"],
+    "weight": ["weight", "body weight"],
+    "height": ["height"],
+    "bmi": ["bmi", "body mass index"],
+
+    # Appointment
+    "desiredAppointmentDate1": ["desired appointment date", "appointment date", "appt date", "preferred date"],
+    "desiredAppointmentTime1": ["desired appointment time", "appointment time", "appt time", "preferred time"],
+    "desiredAppointmentDate2": ["desired appointment date 2", "alternate date", "second date", "backup date"],
+    "desiredAppointmentTime2": ["desired appointment time 2", "alternate time", "second time", "backup time"],
+
+    # Signature
+    "signatureDate": ["date", "signature date", "today's date", "form date"],
+    "signature": ["signature", "patient signature", "signature of patient"],
+
+    # W-2 wage and tax statement
+    "employerIdentificationNumber": ["employer identification number", "b Employer identification number",
+                                     "Employer identification number (EIN)", "EIN"],
+    "employerNameAddressAndZipCode": ["employer name address and zip code", "c Employer name, address, and ZIP code",
+                                      "Employer's name, address, and ZIP code"],
+    "controlNumber": ["control number", "d Control number"],
+    "employeeAddressAndZipCode": ["employee address and zip code", "f Employee address and ZIP code",
+                                  "Employee's address and ZIP code"],
+    "wagesTipsOtherCompensation": ["wages tips other compensation", "1 Wages, tips, other compensation",
+                                   "Wages, tips, and other compensation"],
+    "federalIncomeTaxWithheld": ["federal income tax withheld", "2 Federal income tax withheld"],
+    "socialSecurityWages": ["social security wages", "3 Social security wages"],
+    "socialSecurityTaxWithheld": ["social security tax withheld", "4 Social security tax withheld"],
+    "medicareWagesAndTips": ["medicare wages and tips", "5 Medicare wages and tips"],
+    "medicareTaxWithheld": ["medicare tax withheld", "6 Medicare tax withheld"],
+    "socialSecurityTips": ["social security tips", "7 Social security tips"],
+    "allocatedTips": ["allocated tips", "8 Allocated tips"],
+    "dependentCareBenefits": ["dependent care benefits", "10 Dependent care benefits"],
+    "nonqualifiedPlans": ["nonqualified plans", "11 Nonqualified plans"],
+    "employerStateIdNumber": ["employer state id number", "Employer state ID number", "State employer ID"],
+    "stateWages": ["state wages", "16 State wages, tips, etc."],
+    "stateIncomeTax": ["state income tax", "state income", "17 State income tax"],
+    "localWages": ["local wages", "18 Local wages, tips, etc."],
+    "localIncomeTax": ["local income tax", "19 Local income tax"],
+    "localityName": ["locality name", "20 Locality name"],
+}
+
+# More specific fields that can stand in for a broader one (e.g. when a
+# consumer only stores a single "phone"). Name parts are deliberately not
+# listed: a first name is not a full name.
+BROADER_FIELDS = {
+    "homePhone": "phone",
+    "cellPhone": "phone",
+    "workPhone": "phone",
+    "addressStreet": "address",
+}
+
+# Leading words that qualify whose field it is without changing what it is
+SUBJECT_PREFIXES = ("patient", "user", "member", "my", "your", "the")
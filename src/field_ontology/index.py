@@ -0,0 +1,267 @@
+"""
+Alias index resolving arbitrary field keys and labels to canonical fields.
+
+Resolution is tried in order, cheapest first:
+
+1. exact normalized alias ("Date of Birth" -> "dateofbirth" -> dateOfBirth)
+2. the same after dropping subject prefixes ("patientHomeTelephone" -> "hometelephone")
+3. the same word set in any order ("zipCodeAddress" -> addressZipCode)
+4. similarity fallback: character-trigram vectors by default, or an
+   embedding function supplied by the caller
+
+Every result carries a score and the method that produced it, so callers can
+treat low-confidence or near-tie matches as ambiguous.
+"""
+
+import logging
+import math
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set
+
+from .aliases import BROADER_FIELDS, FIELD_ALIASES, SUBJECT_PREFIXES
+
+logger = logging.getLogger(__name__)
+
+# Similarity above which a fallback match is accepted outright
+MATCH_THRESHOLD = 0.82
+# Similarity above which a fallback match is worth asking about
+AMBIGUOUS_THRESHOLD = 0.6
+# Best and runner-up candidates closer than this are a tie
+TIE_MARGIN = 0.05
+# Methods that found the key in the alias table rather than by similarity
+ALIAS_METHODS = ("exact", "prefix", "words")
+MAX_CACHED_RESOLUTIONS = 4096
+
+_CAMEL_BOUNDARY = re.compile(r'(?<=[a-z])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])|(?<=[A-Za-z])(?=\d)|(?<=\d)(?=[A-Za-z])')
+_NON_ALNUM = re.compile(r'[^a-z0-9]+')
+
+
+def normalize_key(key: str) -> str:
+    """Lower-case and keep only letters and digits."""
+    return _NON_ALNUM.sub("", str(key).lower())
+
+
+def key_words(key: str) -> List[str]:
+    """Split camelCase, snake_case and spaced keys into lower-case words."""
+    return [w for w in _NON_ALNUM.split(_CAMEL_BOUNDARY.sub(" ", str(key)).lower()) if w]
+
+
+def strip_subject(key: str) -> str:
+    """Drop leading subject words such as "patient" from a key."""
+    words = key_words(key)
+    while len(words) > 1 and words[0] in SUBJECT_PREFIXES:
+        words = words[1:]
+    return "".join(words)
+
+
+def trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FieldMatch:
+    """The outcome of resolving one key."""
+
+    __slots__ = ("key", "canonical", "score", "method", "runner_up")
+
+    def __init__(self, key: str, canonical: Optional[str], score: float, method: str, runner_up: Optional[str] = None):
+        self.key = key
+        self.canonical = canonical
+        self.score = score
+        self.method = method
+        self.runner_up = runner_up
+
+    @property
+    def confident(self) -> bool:
+        return self.canonical is not None and self.score >= MATCH_THRESHOLD and self.runner_up is None
+
+    @property
+    def alias(self) -> bool:
+        """True when the key is a known alias, not merely similar to one."""
+        return self.canonical is not None and self.method in ALIAS_METHODS
+
+    @property
+    def ambiguous(self) -> bool:
+        return self.canonical is not None and not self.confident and self.score >= AMBIGUOUS_THRESHOLD
+
+    def __repr__(self) -> str:
+        return f"FieldMatch({self.key!r} -> {self.canonical!r}, {self.score:.2f}, {self.method})"
+
+
+class FieldAliasIndex:
+    """Precomputed lookups from normalized aliases to canonical field names."""
+
+    def __init__(
+        self,
+        aliases: Optional[Dict[str, Sequence[str]]] = None,
+        broader: Optional[Dict[str, str]] = None,
+        embed: Optional[Callable[[List[str]], List[List[float]]]] = None,
+    ):
+        self.aliases = aliases or FIELD_ALIASES
+        self.broader = broader if broader is not None else BROADER_FIELDS
+        self.embed = embed
+
+        self._exact: Dict[str, str] = {}
+        self._by_words: Dict[frozenset, str] = {}
+        for canonical, names in self.aliases.items():
+            for name in [canonical, *names]:
+                self._add(canonical, name)
+
+        self._alias_keys = list(self._exact)
+        self._alias_grams = {alias: trigrams(alias) for alias in self._alias_keys}
+        # Inverted index so the fallback only scores aliases sharing a trigram
+        self._gram_index: Dict[str, List[str]] = {}
+        for alias, grams in self._alias_grams.items():
+            for gram in grams:
+                self._gram_index.setdefault(gram, []).append(alias)
+
+        self._alias_vectors: Optional[Dict[str, List[float]]] = None
+        self._cache: "OrderedDict[str, FieldMatch]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _add(self, canonical: str, name: str) -> None:
+        normalized = normalize_key(name)
+        if not normalized:
+            return
+        existing = self._exact.get(normalized)
+        if existing and existing != canonical:
+            logger.debug(f"Alias '{name}' is claimed by both {existing} and {canonical}; keeping {existing}")
+            return
+        self._exact[normalized] = canonical
+        words = frozenset(key_words(name))
+        if len(words) > 1:
+            self._by_words.setdefault(words, canonical)
+
+    def resolve(self, key: str) -> FieldMatch:
+        """Resolve a key or label to its canonical field (cached)."""
+        with self._lock:
+            match = self._cache.get(key)
+            if match is not None:
+                self._cache.move_to_end(key)
+                return match
+
+        match = self._resolve(key)
+        with self._lock:
+            self._cache[key] = match
+            while len(self._cache) > MAX_CACHED_RESOLUTIONS:
+                self._cache.popitem(last=False)
+        return match
+
+    def _resolve(self, key: str) -> FieldMatch:
+        normalized = normalize_key(key)
+        if not normalized:
+            return FieldMatch(key, None, 0.0, "empty")
+        if normalized in self._exact:
+            return FieldMatch(key, self._exact[normalized], 1.0, "exact")
+
+        stripped = strip_subject(key)
+        if stripped in self._exact:
+            return FieldMatch(key, self._exact[stripped], 0.98, "prefix")
+
+        words = frozenset(key_words(key))
+        if words in self._by_words:
+            return FieldMatch(key, self._by_words[words], 0.95, "words")
+
+        if self.embed is not None:
+            return self._resolve_by_embedding(key)
+        return self._resolve_by_trigrams(key, stripped or normalized)
+
+    def _resolve_by_trigrams(self, key: str, normalized: str) -> FieldMatch:
+        grams = trigrams(normalized)
+        candidates: Set[str] = set()
+        for gram in grams:
+            candidates.update(self._gram_index.get(gram, ()))
+        scores: Dict[str, float] = {}
+        for alias in candidates:
+            alias_grams = self._alias_grams[alias]
+            # Cosine similarity of binary trigram vectors
+            score = len(grams & alias_grams) / math.sqrt(len(grams) * len(alias_grams))
+            canonical = self._exact[alias]
+            if score > scores.get(canonical, 0.0):
+                scores[canonical] = score
+        return self._best(key, scores, "trigram")
+
+    def _resolve_by_embedding(self, key: str) -> FieldMatch:
+        try:
+            if self._alias_vectors is None:
+                vectors = self.embed(self._alias_keys)
+                self._alias_vectors = dict(zip(self._alias_keys, vectors))
+            query = self.embed([" ".join(key_words(key))])[0]
+        except Exception as e:
+            logger.warning(f"Embedding lookup failed for '{key}', using trigram similarity: {e}")
+            return self._resolve_by_trigrams(key, normalize_key(key))
+
+        query_norm = math.sqrt(sum(x * x for x in query)) or 1.0
+        scores: Dict[str, float] = {}
+        for alias, vector in self._alias_vectors.items():
+            norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+            score = sum(a * b for a, b in zip(query, vector)) / (query_norm * norm)
+            canonical = self._exact[alias]
+            if score > scores.get(canonical, 0.0):
+                scores[canonical] = score
+        return self._best(key, scores, "embedding")
+
+    @staticmethod
+    def _best(key: str, scores: Dict[str, float], method: str) -> FieldMatch:
+        if not scores:
+            return FieldMatch(key, None, 0.0, method)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        canonical, score = ranked[0]
+        runner_up = None
+        if len(ranked) > 1 and score - ranked[1][1] < TIE_MARGIN:
+            runner_up = ranked[1][0]
+        if score < AMBIGUOUS_THRESHOLD:
+            return FieldMatch(key, None, score, method)
+        return FieldMatch(key, canonical, score, method, runner_up)
+
+    def canonical(self, key: str) -> Optional[str]:
+        """Canonical field for ``key`` when the match is confident, else None."""
+        match = self.resolve(key)
+        return match.canonical if match.confident else None
+
+    def aliases_for(self, key: str) -> List[str]:
+        """Known aliases of the field ``key`` resolves to (empty when unknown)."""
+        canonical = self.canonical(key)
+        if canonical is None:
+            return []
+        return [canonical, *self.aliases.get(canonical, [])]
+
+    def broaden(self, canonical: str, targets: Iterable[str]) -> Optional[str]:
+        """Walk from a canonical field to the first broader field in ``targets``."""
+        targets = set(targets)
+        current: Optional[str] = canonical
+        while current is not None:
+            if current in targets:
+                return current
+            current = self.broader.get(current)
+        return None
+
+    def find_key(self, key: str, candidates: Iterable[str]) -> Optional[str]:
+        """Return the candidate key naming the same field as ``key``, if any."""
+        normalized = normalize_key(key)
+        candidates = list(candidates)
+        for candidate in candidates:
+            if normalize_key(candidate) == normalized:
+                return candidate
+        canonical = self.canonical(key)
+        if canonical is None:
+            return None
+        for candidate in candidates:
+            if self.canonical(candidate) == canonical:
+                return candidate
+        return None
+
+
+_default_index: Optional[FieldAliasIndex] = None
+_default_lock = threading.Lock()
+
+
+def get_field_index() -> FieldAliasIndex:
+    """Return the process-wide index over the shared alias table."""
+    global _default_index
+    with _default_lock:
+        if _default_index is None:
+            _default_index = FieldAliasIndex()
+        return _default_index
@@ -0,0 +1,107 @@
+"""
+Deterministic profile merge on top of the field alias index.
+
+Each incoming key is placed locally when possible: same key, same normalized
+key, or same canonical (or broader) field as existing keys, all of which are
+updated. Only a known alias of the same field may overwrite an existing value;
+a similarity match or a broader field (a cell number onto "phone") just fills
+it when empty. Keys the index recognises with a confident match but that have no
+existing counterpart are added as new fields. Only keys whose match is ambiguous are
+handed to the optional ``resolver`` (e.g. an LLM), together with the existing
+keys that could plausibly be their counterpart.
+"""
+
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+from .index import FieldAliasIndex, get_field_index, normalize_key
+
+logger = logging.getLogger(__name__)
+
+# resolver(ambiguous new fields, candidate current fields) -> {new_key: current_key or None}
+Resolver = Callable[[Dict[str, Any], Dict[str, Any]], Dict[str, Optional[str]]]
+
+
+class MergeResult:
+    def __init__(self, merged: Dict[str, Any]):
+        self.merged = merged
+        # new key -> list of current keys it was written to
+        self.mapped: Dict[str, List[str]] = {}
+        self.added: List[str] = []
+        self.resolved_remotely: List[str] = []
+
+    def summary(self) -> Dict[str, int]:
+        return {"mapped": len(self.mapped), "added": len(self.added), "resolved_remotely": len(self.resolved_remotely)}
+
+
+def merge_profiles(
+    current: Dict[str, Any],
+    new: Dict[str, Any],
+    index: Optional[FieldAliasIndex] = None,
+    resolver: Optional[Resolver] = None,
+) -> MergeResult:
+    """Merge ``new`` into a copy of ``current`` and report where each key went."""
+    index = index or get_field_index()
+    result = MergeResult(dict(current))
+
+    by_normalized: Dict[str, List[str]] = {}
+    by_canonical: Dict[str, List[str]] = {}
+    for key in current:
+        by_normalized.setdefault(normalize_key(key), []).append(key)
+        canonical = index.canonical(key)
+        if canonical:
+            by_canonical.setdefault(canonical, []).append(key)
+
+    ambiguous: Dict[str, Any] = {}
+    ambiguous_candidates: Dict[str, Any] = {}
+
+    for key, value in new.items():
+        targets = [key] if key in current else by_normalized.get(normalize_key(key))
+        if not targets:
+            match = index.resolve(key)
+            if match.confident:
+                # Fall back to a broader existing field, e.g. a mobile number into "phone"
+                field = index.broaden(match.canonical, by_canonical)
+                targets = by_canonical.get(field) if field else None
+                if targets and not (match.alias and field == match.canonical):
+                    # "emergencyContactFirstName" resembling "emergencyContactName" is no reason to replace it
+                    targets = [target for target in targets if current.get(target) in (None, "")] or None
+            elif match.ambiguous and resolver is not None:
+                candidates = [
+                    current_key
+                    for candidate in (match.canonical, match.runner_up)
+                    for current_key in by_canonical.get(candidate, [])
+                ]
+                # Nothing existing to map onto means nothing to ask about
+                if candidates:
+                    ambiguous[key] = value
+                    for current_key in candidates:
+                        ambiguous_candidates[current_key] = current[current_key]
+                    continue
+
+        if targets:
+            for target in targets:
+                result.merged[target] = value
+            result.mapped[key] = list(targets)
+        else:
+            result.merged[key] = value
+            result.added.append(key)
+
+    if ambiguous:
+        mapping: Dict[str, Optional[str]] = {}
+        try:
+            mapping = resolver(ambiguous, ambiguous_candidates) or {}
+        except Exception as e:
+            logger.error(f"Field resolver failed, adding ambiguous keys as new fields: {e}")
+        for key, value in ambiguous.items():
+            target = mapping.get(key)
+            if target and target in current:
+                result.merged[target] = value
+                result.mapped[key] = [target]
+                result.resolved_remotely.append(key)
+            else:
+                result.merged[key] = value
+                result.added.append(key)
+
+    logger.info(f"Merged profile fields: {result.summary()}")
+    return result
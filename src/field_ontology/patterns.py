@@ -0,0 +1,214 @@
+"""
+Rule-based extraction of labelled fields from OCR text.
+
+Form-like documents mostly consist of "Label: value" pairs. Each line is split
+into label/value segments with a single compiled pattern, labels are resolved
+through the alias index, and the value is accepted only when it passes the
+validator for that field (the SSN, phone, date, email, name and insurance ID
+rules used by the budget orchestrator's extraction and autofill tools).
+
+Generic labels ("Name:", "Phone:", "Date:", "Address:") only name a patient
+field outside of other sections. Under a header such as EMERGENCY CONTACT or
+Lab Results they describe someone or something else, so they are left in the
+residual.
+
+Accepted segments are removed from the text; what is left over is the
+residual that still needs a model to interpret.
+"""
+
+import logging
+import re
+from typing import Dict, List, Optional, Pattern, Tuple
+
+from .index import FieldAliasIndex, get_field_index, normalize_key
+
+logger = logging.getLogger(__name__)
+
+# Residual text with fewer letters/digits than this is not worth a model call
+MIN_RESIDUAL_CHARS = 20
+MAX_FREE_TEXT_LENGTH = 200
+MAX_HEADER_LENGTH = 60
+
+# Labels that don't say whose field it is; trusted only before any section header or in a patient section
+GENERIC_LABELS = {
+    "name", "fullname", "phone", "phonenumber", "telephone", "tel", "cell", "mobile", "date", "address",
+    "streetaddress", "city", "state", "zip", "zipcode", "email", "emailaddress",
+}
+PATIENT_SECTION_WORDS = ("patient", "personal", "demographic", "applicant", "your information", "member information")
+
+# Segments on one OCR line are separated by wide gaps, tabs or pipes
+_SEGMENT_SPLIT = re.compile(r'\s{3,}|\t+|\s\|\s')
+_LABELLED = re.compile(r"^(?P<label>[A-Za-z][A-Za-z0-9 '#/().&-]{0,60}?)\s*:\s*(?P<value>\S.*?)\s*$")
+_PLACEHOLDER = re.compile(r'^[_\-.\s]*$|^(?:n/?a|none given|unknown|tbd)$', re.IGNORECASE)
+_ALNUM = re.compile(r'[A-Za-z0-9]')
+_EMAIL_ANYWHERE = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b')
+
+_DATE = re.compile(
+    r'(?:\d{1,2}[/\-.]\d{1,2}[/\-.]\d{2,4}'
+    r'|\d{4}[/\-.]\d{1,2}[/\-.]\d{1,2}'
+    r'|(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+\d{1,2},?\s+\d{4}'
+    r'|\d{1,2}\s+(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?,?\s+\d{4})',
+    re.IGNORECASE,
+)
+_PHONE = re.compile(r'(?:\+?1[-.\s]?)?\(?\d{3}\)?[-.\s]?\d{3}[-.\s]?\d{4}(?:\s*(?:x|ext\.?)\s*\d{1,5})?', re.IGNORECASE)
+_SSN = re.compile(r'\d{3}[-\s]?\d{2}[-\s]?\d{4}')
+_EMAIL = re.compile(r'[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}')
+_NAME = re.compile(r"[A-Za-z][A-Za-z\s\-.',]{1,80}")
+_ZIP = re.compile(r'\d{5}(?:-\d{4})?')
+_IDENTIFIER = re.compile(r'[A-Za-z0-9][A-Za-z0-9\-]{2,29}')
+_GENDER = re.compile(r'male|female|m|f|other|non-binary|nonbinary', re.IGNORECASE)
+_STATE = re.compile(r'[A-Za-z]{2}|[A-Za-z][A-Za-z ]{3,30}')
+
+PHONE_FIELDS = ("phone", "homePhone", "cellPhone", "workPhone", "emergencyContactPhone", "insurancePhone")
+NAME_FIELDS = ("name", "firstName", "middleName", "lastName", "emergencyContactName", "subscriberName",
+               "primaryCarePhysicianName")
+DATE_FIELDS = ("dateOfBirth", "signatureDate", "desiredAppointmentDate1", "desiredAppointmentDate2")
+# Free-text medical fields, accepted when labelled (the "Medication:" / "Diagnosis:" patterns)
+FREE_TEXT_FIELDS = ("medications", "allergies", "conditions", "reasonForVisit")
+
+# Canonical field -> full-match pattern its value must satisfy
+FIELD_VALIDATORS: Dict[str, Pattern] = {
+    "ssn": _SSN,
+    "email": _EMAIL,
+    "gender": _GENDER,
+    "addressZipCode": _ZIP,
+    "addressState": _STATE,
+    "groupNumber": _IDENTIFIER,
+    "policyNumber": _IDENTIFIER,
+    "subscriberId": _IDENTIFIER,
+    **{field: _PHONE for field in PHONE_FIELDS},
+    **{field: _NAME for field in NAME_FIELDS},
+    **{field: _DATE for field in DATE_FIELDS},
+}
+
+
+def _digits(value: str) -> str:
+    return re.sub(r'\D', '', value)
+
+
+def validate_field_value(field: str, value: str) -> bool:
+    """Whether ``value`` is a plausible value for canonical ``field``."""
+    if field in FREE_TEXT_FIELDS:
+        return len(value) <= MAX_FREE_TEXT_LENGTH
+    pattern = FIELD_VALIDATORS.get(field)
+    if pattern is None or not pattern.fullmatch(value):
+        return False
+    if field == "ssn":
+        return len(_digits(value)) == 9
+    if field in PHONE_FIELDS:
+        digits = _digits(re.split(r'x|ext', value, flags=re.IGNORECASE)[0])
+        return len(digits) == 10 or (len(digits) == 11 and digits.startswith("1"))
+    if field in ("groupNumber", "policyNumber", "subscriberId"):
+        # Identifiers always carry at least one digit; a bare word is more likely a misread label
+        return any(c.isdigit() for c in value)
+    return True
+
+
+class PatternExtraction:
+    """Fields found locally and the text left for model-based extraction."""
+
+    def __init__(self, fields: Dict[str, str], residual_text: str, matched_segments: int):
+        self.fields = fields
+        self.residual_text = residual_text
+        self.matched_segments = matched_segments
+
+    @property
+    def has_residual(self) -> bool:
+        return len(_ALNUM.findall(self.residual_text)) >= MIN_RESIDUAL_CHARS
+
+    def __repr__(self) -> str:
+        return f"PatternExtraction({len(self.fields)} fields, {len(self.residual_text)} residual chars)"
+
+
+class PatternExtractor:
+    """Extracts validated labelled fields from text in a single pass over its lines."""
+
+    def __init__(self, index: Optional[FieldAliasIndex] = None):
+        self.index = index or get_field_index()
+
+    @staticmethod
+    def _section_header(segments: List[str]) -> Optional[str]:
+        """The header text if a line looks like a section heading ("EMERGENCY CONTACT", "Lab Results:")."""
+        if len(segments) != 1:
+            return None
+        line = segments[0].strip()
+        if not line or len(line) > MAX_HEADER_LENGTH or not any(c.isalpha() for c in line):
+            return None
+        if line.endswith(":"):
+            return line[:-1].lower()
+        if _LABELLED.match(line):
+            return None
+        words = line.split()
+        if line.isupper() or (len(words) <= 6 and all(word[0].isupper() or not word[0].isalpha() for word in words)):
+            return line.lower()
+        return None
+
+    def extract(self, text: str) -> PatternExtraction:
+        found: Dict[str, str] = {}
+        # Field -> (line number, segment number) of every accepted occurrence
+        positions: Dict[str, List[Tuple[int, int]]] = {}
+        conflicting = set()
+
+        lines = (text or "").splitlines()
+        line_segments = [_SEGMENT_SPLIT.split(line.strip()) for line in lines]
+        section: Optional[str] = None
+        for line_no, segments in enumerate(line_segments):
+            header = self._section_header(segments)
+            if header is not None:
+                section = header
+                continue
+            patient_section = section is None or any(word in section for word in PATIENT_SECTION_WORDS)
+            for segment_no, segment in enumerate(segments):
+                match = _LABELLED.match(segment)
+                if not match:
+                    continue
+                value = match.group("value").strip().rstrip(",;")
+                if _PLACEHOLDER.match(value):
+                    continue
+                if not patient_section and normalize_key(match.group("label")) in GENERIC_LABELS:
+                    # Whose name/phone/date this is depends on the section; let the model read it
+                    continue
+                field = self.index.canonical(match.group("label"))
+                if field is None or not validate_field_value(field, value):
+                    continue
+                if field in found and found[field] != value:
+                    # Same field with different values, e.g. patient vs. emergency contact
+                    # phone under generic labels: leave it for the model
+                    conflicting.add(field)
+                found.setdefault(field, value)
+                positions.setdefault(field, []).append((line_no, segment_no))
+
+        # An e-mail address is unambiguous even without a label, as long as there is only one
+        if "email" not in found:
+            emails = set(_EMAIL_ANYWHERE.findall(text or ""))
+            if len(emails) == 1:
+                found["email"] = emails.pop()
+
+        consumed = set()
+        fields: Dict[str, str] = {}
+        for field, value in found.items():
+            if field in conflicting:
+                continue
+            fields[field] = value
+            consumed.update(positions.get(field, []))
+
+        residual_lines = []
+        for line_no, segments in enumerate(line_segments):
+            kept = [segment for segment_no, segment in enumerate(segments) if (line_no, segment_no) not in consumed]
+            if any(segment.strip() for segment in kept):
+                residual_lines.append("   ".join(kept))
+
+        result = PatternExtraction(fields, "\n".join(residual_lines), len(consumed))
+        logger.info(f"Pattern extraction: {result}")
+        return result
+
+
+_default_extractor: Optional[PatternExtractor] = None
+
+
+def extract_labelled_fields(text: str) -> PatternExtraction:
+    """Run the shared pattern extractor over ``text``."""
+    global _default_extractor
+    if _default_extractor is None:
+        _default_extractor = PatternExtractor()
+    return _default_extractor.extract(text)
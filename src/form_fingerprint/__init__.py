@@ -0,0 +1,16 @@
+# Layout fingerprints for recognising known forms from scans and photos
+# Shared by the camera form endpoint and the PDF writer
+
+from .fingerprint import LayoutFingerprint, layout_fingerprint, page_fingerprints, hamming
+from .index import LayoutEntry, LayoutIndex, LayoutMatch, get_layout_index
+
+__all__ = [
+    "LayoutFingerprint",
+    "layout_fingerprint",
+    "page_fingerprints",
+    "hamming",
+    "LayoutEntry",
+    "LayoutIndex",
+    "LayoutMatch",
+    "get_layout_index",
+]
@@ -0,0 +1,85 @@
+"""
+Perceptual layout fingerprints of form images.
+
+A blank form is recognised by its ruling, not its text: the rows holding
+horizontal rules and box borders, the columns holding vertical ones, and
+where on the page edges are dense. The image is downscaled to a fixed grid,
+so the fingerprint is insensitive to resolution, JPEG noise and handwriting,
+and costs a few milliseconds instead of an OCR pass.
+
+Each fingerprint has two parts:
+
+- ``vector``: the horizontal and vertical line profiles, zero-mean and unit
+  length, compared by cosine similarity
+- ``bits``: a 256-bit hash of block-wise edge density (above/below the
+  median block), compared by Hamming distance
+"""
+
+from typing import List, Sequence
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# The image is resampled to this grid (+1 so the gradients come out even)
+GRID_WIDTH = 96
+GRID_HEIGHT = 128
+PROFILE_BINS = 64
+HASH_SIDE = 16
+HASH_BITS = HASH_SIDE * HASH_SIDE
+
+
+class LayoutFingerprint:
+    __slots__ = ("vector", "bits")
+
+    def __init__(self, vector: np.ndarray, bits: int):
+        self.vector = vector
+        self.bits = bits
+
+    def to_json(self) -> dict:
+        return {"vector": [round(float(x), 5) for x in self.vector], "bits": format(self.bits, "x")}
+
+    @classmethod
+    def from_json(cls, data: dict) -> "LayoutFingerprint":
+        return cls(np.asarray(data["vector"], dtype=np.float32), int(data["bits"], 16))
+
+
+def _resample(profile: np.ndarray, bins: int) -> np.ndarray:
+    positions = np.linspace(0, len(profile) - 1, bins)
+    return np.interp(positions, np.arange(len(profile)), profile)
+
+
+def _unit(vector: np.ndarray) -> np.ndarray:
+    vector = vector - vector.mean()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def layout_fingerprint(image: Image.Image) -> LayoutFingerprint:
+    """Fingerprint the layout of a form page image."""
+    gray = ImageOps.autocontrast(image.convert("L"))
+    grid = np.asarray(gray.resize((GRID_WIDTH + 1, GRID_HEIGHT + 1), Image.BILINEAR), dtype=np.float32) / 255.0
+
+    # Vertical intensity changes trace horizontal rules and vice versa
+    horizontal_edges = np.abs(np.diff(grid, axis=0))[:, :-1]
+    vertical_edges = np.abs(np.diff(grid, axis=1))[:-1, :]
+    edges = np.maximum(horizontal_edges, vertical_edges)
+    threshold = edges.mean() + edges.std()
+
+    rows = _resample((horizontal_edges > threshold).mean(axis=1), PROFILE_BINS)
+    cols = _resample((vertical_edges > threshold).mean(axis=0), PROFILE_BINS)
+    vector = np.concatenate([_unit(rows), _unit(cols)]).astype(np.float32)
+    vector = _unit(vector)
+
+    density = (edges > threshold).reshape(
+        HASH_SIDE, GRID_HEIGHT // HASH_SIDE, HASH_SIDE, GRID_WIDTH // HASH_SIDE
+    ).mean(axis=(1, 3))
+    bits = np.packbits((density > np.median(density)).flatten())
+    return LayoutFingerprint(vector, int.from_bytes(bits.tobytes(), "big"))
+
+
+def page_fingerprints(images: Sequence[Image.Image]) -> List[LayoutFingerprint]:
+    return [layout_fingerprint(image) for image in images]
@@ -0,0 +1,260 @@
+"""
+Nearest-neighbour index over layout fingerprints of known forms.
+
+Each entry stores a form's fingerprint together with what was learned the
+first time it was processed: the field schema and the pixel coordinates of
+its fields on the reference image. Fingerprint vectors are kept as rows of
+one matrix, so a query is a single matrix-vector product plus a Hamming check
+on the best candidates.
+
+A match needs a cosine similarity of at least MIN_SIMILARITY, an edge-hash
+distance of at most MAX_HAMMING bits, and a clear lead over the best entry
+with a different schema; anything closer to a tie is treated as unknown.
+
+Entries have a ``kind``: "camera" for forms learned from camera photos and
+"template" for the fixed templates of the PDF writer, whose schema has a
+different shape. Lookups stay within one kind. ``learn`` updates the entry of
+a form it already knows instead of adding another one, and at most
+MAX_ENTRIES are kept per kind.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .fingerprint import HASH_BITS, LayoutFingerprint, hamming
+
+logger = logging.getLogger(__name__)
+
+MIN_SIMILARITY = 0.9
+MAX_HAMMING = HASH_BITS // 4
+MIN_MARGIN = 0.02
+# Candidates checked against the edge hash, best similarity first
+CANDIDATES = 5
+MAX_ENTRIES = 500
+
+DEFAULT_INDEX_PATH = os.getenv(
+    "LAYOUT_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "uploads", "layout_index.json"),
+)
+
+
+def schema_key(schema: Any) -> Tuple[str, ...]:
+    """Order-independent identity of a field schema (field ids, or labels)."""
+    if not isinstance(schema, list):
+        return ()
+    return tuple(sorted(
+        str(field.get("id") or field.get("label")) if isinstance(field, dict) else str(field)
+        for field in schema
+    ))
+
+
+class LayoutEntry:
+    def __init__(self, form_key: str, fingerprint: LayoutFingerprint, schema: Any,
+                 coordinates: Dict[str, Sequence[float]], size: Tuple[int, int], created_at: Optional[float] = None,
+                 kind: str = "camera"):
+        self.form_key = form_key
+        self.fingerprint = fingerprint
+        self.schema = schema
+        self.schema_key = schema_key(schema)
+        self.coordinates = coordinates
+        self.size = tuple(size)
+        self.created_at = created_at or time.time()
+        self.kind = kind
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "formKey": self.form_key,
+            "fingerprint": self.fingerprint.to_json(),
+            "schema": self.schema,
+            "coordinates": {k: list(v) for k, v in self.coordinates.items()},
+            "size": list(self.size),
+            "createdAt": self.created_at,
+            "kind": self.kind,
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "LayoutEntry":
+        # Entries written before kinds existed: camera ones are keyed "camera-<hash>"
+        kind = data.get("kind") or ("camera" if data["formKey"].startswith("camera-") else "template")
+        return cls(data["formKey"], LayoutFingerprint.from_json(data["fingerprint"]), data.get("schema"),
+                   data.get("coordinates") or {}, tuple(data["size"]), data.get("createdAt"), kind)
+
+
+class LayoutMatch:
+    def __init__(self, entry: LayoutEntry, similarity: float, distance: int):
+        self.entry = entry
+        self.form_key = entry.form_key
+        self.schema = entry.schema
+        self.similarity = similarity
+        self.distance = distance
+
+    def coordinates_for(self, size: Tuple[int, int]) -> Dict[str, Tuple[int, int]]:
+        """Field coordinates scaled from the reference image to an image of ``size``."""
+        ref_width, ref_height = self.entry.size
+        sx = size[0] / ref_width if ref_width else 1.0
+        sy = size[1] / ref_height if ref_height else 1.0
+        return {k: (int(round(v[0] * sx)), int(round(v[1] * sy))) for k, v in self.entry.coordinates.items()}
+
+    def __repr__(self) -> str:
+        return f"LayoutMatch({self.form_key!r}, similarity={self.similarity:.3f}, distance={self.distance})"
+
+
+class LayoutIndex:
+    """Known form layouts, persisted as JSON and searched in memory."""
+
+    def __init__(self, path: Optional[str] = DEFAULT_INDEX_PATH):
+        self.path = path
+        self._entries: List[LayoutEntry] = []
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._lock = threading.Lock()
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _rebuild(self) -> None:
+        if self._entries:
+            self._matrix = np.stack([entry.fingerprint.vector for entry in self._entries])
+        else:
+            self._matrix = np.zeros((0, 0), dtype=np.float32)
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._entries = [LayoutEntry.from_json(item) for item in json.load(f).get("entries", [])]
+        except Exception as e:
+            logger.error(f"Failed to load layout index {self.path}: {e}")
+            self._entries = []
+        self._rebuild()
+        logger.info(f"Layout index: {len(self._entries)} known forms")
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"entries": [entry.to_json() for entry in self._entries]}, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"Failed to save layout index {self.path}: {e}")
+
+    def add(self, form_key: str, fingerprint: LayoutFingerprint, schema: Any = None,
+            coordinates: Optional[Dict[str, Sequence[float]]] = None, size: Tuple[int, int] = (0, 0),
+            kind: str = "camera") -> LayoutEntry:
+        """Add or replace the entry for ``form_key``."""
+        entry = LayoutEntry(form_key, fingerprint, schema, coordinates or {}, size, kind=kind)
+        with self._lock:
+            self._store(entry, replace=form_key)
+        logger.info(f"Indexed layout of form '{form_key}'")
+        return entry
+
+    def learn(self, form_key: str, fingerprint: LayoutFingerprint, schema: Any = None,
+              coordinates: Optional[Dict[str, Sequence[float]]] = None, size: Tuple[int, int] = (0, 0),
+              kind: str = "camera") -> LayoutEntry:
+        """
+        Remember a form that ``nearest`` didn't recognise. An entry that nearly matched, or one with
+        the same schema, is updated in place (keeping its key) rather than duplicated.
+        """
+        with self._lock:
+            replace = form_key
+            key = schema_key(schema)
+            candidates = self._ranked(fingerprint, kind)
+            for i, similarity in candidates:
+                entry = self._entries[i]
+                near = (similarity >= MIN_SIMILARITY
+                        and hamming(entry.fingerprint.bits, fingerprint.bits) <= MAX_HAMMING)
+                if near or (key and entry.schema_key == key):
+                    replace = entry.form_key
+                    break
+            entry = LayoutEntry(replace, fingerprint, schema, coordinates or {}, size, kind=kind)
+            self._store(entry, replace=replace)
+        logger.info(f"{'Updated' if replace != form_key else 'Indexed'} layout of form '{replace}'")
+        return entry
+
+    def _store(self, entry: LayoutEntry, replace: str) -> None:
+        entries = [e for e in self._entries if e.form_key != replace] + [entry]
+        same_kind = [e for e in entries if e.kind == entry.kind]
+        if len(same_kind) > MAX_ENTRIES:
+            # Oldest first out
+            evicted = {id(e) for e in sorted(same_kind, key=lambda e: e.created_at)[:len(same_kind) - MAX_ENTRIES]}
+            entries = [e for e in entries if id(e) not in evicted]
+        self._entries = entries
+        self._rebuild()
+        self._save()
+
+    def _ranked(self, fingerprint: LayoutFingerprint, kind: Optional[str]) -> List[Tuple[int, float]]:
+        """(entry position, similarity) of the CANDIDATES most similar entries of ``kind``."""
+        if not self._entries:
+            return []
+        similarities = self._matrix @ fingerprint.vector
+        ranked = []
+        for i in np.argsort(-similarities):
+            if kind is None or self._entries[i].kind == kind:
+                ranked.append((int(i), float(similarities[i])))
+                if len(ranked) == CANDIDATES:
+                    break
+        return ranked
+
+    def remove(self, form_key: str) -> bool:
+        with self._lock:
+            kept = [e for e in self._entries if e.form_key != form_key]
+            if len(kept) == len(self._entries):
+                return False
+            self._entries = kept
+            self._rebuild()
+            self._save()
+        return True
+
+    def forms(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [{"formKey": e.form_key, "fields": len(e.schema or []), "createdAt": e.created_at, "kind": e.kind}
+                    for e in self._entries]
+
+    def nearest(self, fingerprint: LayoutFingerprint, kind: Optional[str] = None) -> Optional[LayoutMatch]:
+        """The known form of ``kind`` this layout belongs to, or None when nothing matches clearly."""
+        with self._lock:
+            candidates = self._ranked(fingerprint, kind)
+            best = None
+            for i, similarity in candidates:
+                if similarity < MIN_SIMILARITY:
+                    break
+                distance = hamming(self._entries[i].fingerprint.bits, fingerprint.bits)
+                if distance <= MAX_HAMMING:
+                    best = LayoutMatch(self._entries[i], similarity, distance)
+                    break
+            if best is None:
+                return None
+            # The runner-up with a different schema must be clearly worse; another
+            # photo of the same form is no reason for doubt
+            for i, similarity in candidates:
+                entry = self._entries[i]
+                if entry.form_key != best.form_key and entry.schema_key != best.entry.schema_key:
+                    if best.similarity - similarity < MIN_MARGIN:
+                        logger.info(f"Ambiguous layout: {best.form_key} vs {entry.form_key}")
+                        return None
+                    break
+        logger.info(f"Layout match: {best}")
+        return best
+
+
+_default_index: Optional[LayoutIndex] = None
+_default_lock = threading.Lock()
+
+
+def get_layout_index() -> LayoutIndex:
+    """Return the process-wide layout index at DEFAULT_INDEX_PATH."""
+    global _default_index
+    with _default_lock:
+        if _default_index is None:
+            _default_index = LayoutIndex()
+        return _default_index
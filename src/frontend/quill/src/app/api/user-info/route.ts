@@ -1,8 +1,8 @@
 import { NextResponse } from 'next/server';
-import fs from 'fs/promises';
-import path from 'path';
+import axios from 'axios';
 
-const USER_INFO_PATH = path.join(process.cwd(), '..', '..', 'uploads', 'user_info.json');
+// User info lives in the FastAPI profile store; uploads/user_info.json is no longer the source of truth
+const FASTAPI_URL = 'http://localhost:8000';
 
 // Add CORS headers to response
 function addCorsHeaders(response: NextResponse) {
@@ -16,21 +16,20 @@ export async function OPTIONS() {
   return addCorsHeaders(new NextResponse(null, { status: 204 }));
 }
 
-export async function GET() {
+export async function GET(request: Request) {
   try {
-    // Read the file
-    const fileContent = await fs.readFile(USER_INFO_PATH, 'utf-8');
-    
-    // Parse the JSON content
-    const userInfo = JSON.parse(fileContent);
-    
+    const profileId = new URL(request.url).searchParams.get('profileId');
+    const response = await axios.get(`${FASTAPI_URL}/get-user-info`, {
+      params: profileId ? { profileId } : undefined,
+    });
+
     // Return the data with CORS headers
-    return addCorsHeaders(NextResponse.json({ info: userInfo }));
-  } catch (error: unknown) {
-    console.error('Error reading user_info.json:', error);
+    return addCorsHeaders(NextResponse.json({ info: response.data.info }));
+  } catch (error: any) {
+    console.error('Error reading user info:', error.response?.data || error.message);
     return addCorsHeaders(NextResponse.json(
       { error: 'Failed to read user info' },
-      { status: 500 }
+      { status: error.response?.status || 500 }
     ));
   }
 }
@@ -45,18 +44,22 @@ export async function POST(request: Request) {
     }
 
     const userInfo = JSON.parse(info);
-    await fs.writeFile(USER_INFO_PATH, JSON.stringify(userInfo, null, 2));
+    const profileId = formData.get('profileId') as string | null;
+    await axios.post(`${FASTAPI_URL}/update-user-info`, {
+      info: userInfo,
+      ...(profileId ? { profileId } : {}),
+    });
 
     return addCorsHeaders(NextResponse.json({ 
       message: 'User info updated successfully',
       info: userInfo
     }));
-  } catch (error: unknown) {
-    const errorMessage = error instanceof Error ? error.message : 'Unknown error';
+  } catch (error: any) {
+    const errorMessage = error.response?.data || error.message || 'Unknown error';
     console.error('Error updating user info:', errorMessage);
     return addCorsHeaders(NextResponse.json({ 
       error: 'Failed to update user info',
       details: errorMessage 
-    }, { status: 500 }));
+    }, { status: error.response?.status || 500 }));
   }
 }
\ No newline at end of file
@@ -6,7 +6,7 @@ Provides endpoints for form submission and patient profile management
 from fastapi import APIRouter, HTTPException, BackgroundTasks
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Callable, List
 import logging
 import os
 import json
@@ -40,6 +40,20 @@ class PatientQuery(BaseModel):
 TEMP_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "mockups", "frontend2", "temp")
 os.makedirs(TEMP_DIR, exist_ok=True)
 
+# Called with (submission, submission_id) for every accepted form, e.g. to index it
+_submission_listeners: List[Callable[[Dict[str, Any], str], Any]] = []
+
+def add_submission_listener(listener: Callable[[Dict[str, Any], str], Any]):
+    """Register a callback notified of every form submitted through this router."""
+    _submission_listeners.append(listener)
+
+def notify_submission_listeners(submission: Dict[str, Any], submission_id: str):
+    for listener in _submission_listeners:
+        try:
+            listener(submission, submission_id)
+        except Exception as e:
+            logger.error(f"Form submission listener failed: {str(e)}")
+
 @router.post("/submit-form")
 async def submit_form(submission: FormSubmission, background_tasks: BackgroundTasks):
     """
@@ -82,6 +96,7 @@ async def submit_form(submission: FormSubmission, background_tasks: BackgroundTa
             submission.formName,
             submission.formData
         )
+        notify_submission_listeners(temp_data, os.path.splitext(temp_filename)[0])
         
         # Clean up temp file after processing
         if os.path.exists(temp_filepath):
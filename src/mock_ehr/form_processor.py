@@ -8,64 +8,41 @@ from typing import Dict, List, Any, Optional
 from datetime import datetime
 from .schema_definitions import CONCEPT_VALUES, MEASUREMENT_CONCEPTS
 from .supabase_manager import SupabaseManager
+from field_ontology import get_field_index
 
 logger = logging.getLogger(__name__)
 
+# EHR fields that form data is mapped onto
+EHR_FIELDS = {
+    # Person table
+    "name", "dateOfBirth", "gender", "race", "ethnicity",
+    # Contact information (might go to a separate table in full implementation)
+    "phone", "homePhone", "cellPhone", "workPhone", "email", "address",
+    # Insurance information
+    "insuranceProvider", "policyNumber", "groupNumber",
+    # Medical conditions and medications
+    "conditions", "allergies", "medications",
+    # Vital signs
+    "bloodPressure", "heartRate", "temperature", "weight", "height", "bmi",
+}
+
 class FormProcessor:
     def __init__(self, supabase_manager: SupabaseManager):
         """Initialize with Supabase manager instance."""
         self.db = supabase_manager
         
-        # Field mappings from common form fields to EHR schema
-        self.field_mappings = {
-            # Person table mappings
-            "patientName": "name",
-            "fullName": "name",
-            "name": "name",
-            "dateOfBirth": "dateOfBirth",
-            "dob": "dateOfBirth",
-            "birthDate": "dateOfBirth",
-            "gender": "gender",
-            "sex": "gender",
-            "race": "race",
-            "ethnicity": "ethnicity",
-            
-            # Contact information (might go to a separate table in full implementation)
-            "phone": "phone",
-            "phoneNumber": "phone",
-            "email": "email",
-            "emailAddress": "email",
-            "address": "address",
-            "streetAddress": "address",
-            
-            # Insurance information
-            "insuranceProvider": "insuranceProvider",
-            "insuranceCompany": "insuranceProvider",
-            "policyNumber": "policyNumber",
-            "groupNumber": "groupNumber",
-            
-            # Medical conditions
-            "conditions": "conditions",
-            "diagnoses": "conditions",
-            "medicalConditions": "conditions",
-            "allergies": "allergies",
-            
-            # Medications
-            "medications": "medications",
-            "currentMedications": "medications",
-            "drugs": "medications",
-            
-            # Vital signs
-            "bloodPressure": "bloodPressure",
-            "bp": "bloodPressure",
-            "heartRate": "heartRate",
-            "pulse": "heartRate",
-            "temperature": "temperature",
-            "temp": "temperature",
-            "weight": "weight",
-            "height": "height",
-            "bmi": "bmi"
-        }
+        # Common form field names are resolved to these EHR fields through the
+        # shared field ontology (e.g. "patientName" -> "name", "dob" -> "dateOfBirth")
+        self.field_index = get_field_index()
+        self.ehr_fields = EHR_FIELDS
+    
+    def _map_field(self, key: str) -> str:
+        """Map a form field name to its EHR field name, or return it unchanged."""
+        # Only known aliases: a merely similar name could overwrite another field's value
+        match = self.field_index.resolve(key)
+        if match.confident and match.alias:
+            return self.field_index.broaden(match.canonical, self.ehr_fields) or key
+        return key
     
     def process_form_submission(self, form_name: str, form_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -145,7 +122,7 @@ class FormProcessor:
                         flatten(value, f"{new_key}_")
                     else:
                         # Map to standard field names
-                        mapped_key = self.field_mappings.get(key, key)
+                        mapped_key = self._map_field(key)
                         normalized[mapped_key] = value
             elif isinstance(data, list):
                 for i, item in enumerate(data):
@@ -181,6 +158,12 @@ class FormProcessor:
                         person_data["name"] = data[alt]
                     break
         
+        if not person_data.get("phone"):
+            for alt in ["cellPhone", "homePhone", "workPhone"]:
+                if data.get(alt):
+                    person_data["phone"] = data[alt]
+                    break
+        
         return person_data
     
     def _extract_conditions(self, data: Dict[str, Any]) -> List[str]:
@@ -0,0 +1,248 @@
+"""
+Streaming speech recognition for the voice websocket.
+
+In the original protocol the client records a whole utterance, sends it as
+binary frames followed by ``END``, and nothing is transcribed before ``END``.
+With ``?asrStream=1`` (or an ``ASR_STREAM:1`` control message) the client
+instead sends raw 16 kHz mono 16-bit little-endian PCM continuously, in frames
+of any size, and the server:
+
+- runs an energy voice-activity detector over 30 ms frames, with a noise
+  floor that starts low and adapts to the room,
+- transcribes the utterance so far every ``partial_interval_ms`` of speech and
+  at every pause, pushing the text to the client as partial transcripts,
+- ends the utterance after ``end_silence_ms`` of silence. If the pause
+  transcription already covered all of the speech it becomes the final
+  transcript, so recognition mostly overlaps with the user still talking.
+- calls ``on_speech`` once an utterance has ``barge_in_ms`` of speech, so the
+  caller can cancel a reply the user is talking over.
+
+The recognizer itself is any blocking ``transcribe(wav_bytes) -> str``. It runs
+through ``run_blocking`` (e.g. a shared worker pool; ``asyncio.to_thread`` by
+default), so the websocket keeps receiving audio meanwhile. When audio ends an
+utterance, ``push`` returns the final transcription as a task, and the caller
+awaits it wherever it answers the utterance, not in its receive loop.
+"""
+
+import asyncio
+import io
+import logging
+import math
+import sys
+import wave
+from array import array
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+FRAME_MS = 30
+# A frame is speech when its RMS is this many times the noise floor (and above MIN_SPEECH_RMS)
+SPEECH_TO_NOISE_RATIO = 3.0
+MIN_SPEECH_RMS = 300.0
+NOISE_ADAPTATION = 0.05
+# Audio kept from before speech onset so the first syllable isn't clipped
+PREROLL_MS = 300
+# Silence that triggers a partial transcript, and silence that ends the utterance
+PAUSE_MS = 300
+END_SILENCE_MS = 800
+PARTIAL_INTERVAL_MS = 1500
+# Utterances with less speech than this are treated as noise
+MIN_SPEECH_MS = 250
+# Speech that counts as the user talking over the assistant; less is dropped as noise anyway
+BARGE_IN_MS = MIN_SPEECH_MS
+MAX_UTTERANCE_MS = 30000
+
+# Placeholders voice.transcribe returns instead of raising
+NO_TRANSCRIPT = ("[No speech detected]", "[Transcription failed]")
+
+
+def is_usable_transcript(text: Optional[str]) -> bool:
+    return bool(text and text.strip()) and not text.strip().startswith(NO_TRANSCRIPT)
+
+
+def pcm_rms(frame: bytes) -> float:
+    samples = array("h")
+    samples.frombytes(frame[: len(frame) - len(frame) % SAMPLE_WIDTH])
+    if sys.byteorder == "big":
+        samples.byteswap()
+    if not samples:
+        return 0.0
+    return math.sqrt(sum(s * s for s in samples) / len(samples))
+
+
+def pcm_to_wav(pcm: bytes, sample_rate: int = SAMPLE_RATE) -> bytes:
+    """Wrap raw mono 16-bit PCM in a WAV container for the STT upload."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(SAMPLE_WIDTH)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+
+class EnergyVAD:
+    """Frame-level speech detection against an adaptive noise floor."""
+
+    def __init__(self, sample_rate: int = SAMPLE_RATE, frame_ms: int = FRAME_MS,
+                 ratio: float = SPEECH_TO_NOISE_RATIO, min_rms: float = MIN_SPEECH_RMS,
+                 initial_noise: Optional[float] = None):
+        self.frame_bytes = sample_rate * frame_ms // 1000 * SAMPLE_WIDTH
+        self.ratio = ratio
+        self.min_rms = min_rms
+        # A low prior rather than the first frame's level: a clip may start mid-word
+        self.noise = initial_noise if initial_noise is not None else min_rms / ratio
+
+    def is_speech(self, frame: bytes) -> bool:
+        level = pcm_rms(frame)
+        speech = level >= max(self.min_rms, self.noise * self.ratio)
+        if not speech:
+            # Only background frames move the floor, so speech doesn't raise it
+            self.noise += NOISE_ADAPTATION * (level - self.noise)
+        return speech
+
+
+class StreamingTranscriber:
+    """Turns a continuous PCM stream into utterance transcripts for one connection."""
+
+    def __init__(
+        self,
+        transcribe: Callable[[bytes], str],
+        on_partial: Optional[Callable[[str], Awaitable[None]]] = None,
+        on_speech: Optional[Callable[[], Awaitable[None]]] = None,
+        sample_rate: int = SAMPLE_RATE,
+        end_silence_ms: int = END_SILENCE_MS,
+        partial_interval_ms: int = PARTIAL_INTERVAL_MS,
+        min_speech_ms: int = MIN_SPEECH_MS,
+        max_utterance_ms: int = MAX_UTTERANCE_MS,
+        barge_in_ms: int = BARGE_IN_MS,
+        run_blocking: Optional[Callable[..., Awaitable[Any]]] = None,
+    ):
+        self.transcribe = transcribe
+        self.run_blocking = run_blocking or asyncio.to_thread
+        self.on_partial = on_partial
+        self.on_speech = on_speech
+        self.barge_in_ms = barge_in_ms
+        self.sample_rate = sample_rate
+        self.end_silence_ms = end_silence_ms
+        self.partial_interval_ms = partial_interval_ms
+        self.min_speech_ms = min_speech_ms
+        self.max_utterance_bytes = sample_rate * SAMPLE_WIDTH * max_utterance_ms // 1000
+        self.vad = EnergyVAD(sample_rate)
+        self._buffer = b""
+        self._preroll: deque = deque(maxlen=max(1, PREROLL_MS // FRAME_MS))
+        self._reset_utterance()
+
+    def _reset_utterance(self) -> None:
+        self._utterance = bytearray()
+        self._in_speech = False
+        self._speech_ms = 0
+        self._silence_ms = 0
+        self._since_partial_ms = 0
+        self._speech_end = 0  # utterance length right after the last speech frame
+        self._partial_task: Optional[asyncio.Task] = None
+        self._partial_covers = 0
+        self._speech_reported = False
+
+    async def push(self, pcm: bytes) -> "Optional[asyncio.Task[Optional[str]]]":
+        """Add audio; when this audio ended an utterance, returns the task transcribing it."""
+        self._buffer += pcm
+        frame_bytes = self.vad.frame_bytes
+        while len(self._buffer) >= frame_bytes:
+            frame, self._buffer = self._buffer[:frame_bytes], self._buffer[frame_bytes:]
+            ended = self._add_frame(frame)
+            if not self._speech_reported and self._speech_ms >= self.barge_in_ms:
+                self._speech_reported = True
+                if self.on_speech is not None:
+                    await self.on_speech()
+            if ended:
+                # Audio after the end stays buffered for the next utterance
+                return self._finish()
+        return None
+
+    def flush(self) -> "Optional[asyncio.Task[Optional[str]]]":
+        """End the current utterance now (client stopped recording); the task transcribing it."""
+        return self._finish() if self._in_speech else None
+
+    def _add_frame(self, frame: bytes) -> bool:
+        speech = self.vad.is_speech(frame)
+        if not self._in_speech:
+            if not speech:
+                self._preroll.append(frame)
+                return False
+            self._in_speech = True
+            self._utterance.extend(b"".join(self._preroll))
+            self._preroll.clear()
+
+        self._utterance.extend(frame)
+        if speech:
+            self._speech_ms += FRAME_MS
+            self._silence_ms = 0
+            self._since_partial_ms += FRAME_MS
+            self._speech_end = len(self._utterance)
+            if self._since_partial_ms >= self.partial_interval_ms:
+                self._start_partial()
+        else:
+            self._silence_ms += FRAME_MS
+            if self._silence_ms == PAUSE_MS:
+                self._start_partial()
+            if self._silence_ms >= self.end_silence_ms:
+                return True
+        return len(self._utterance) >= self.max_utterance_bytes
+
+    def _start_partial(self) -> None:
+        self._since_partial_ms = 0
+        if self._speech_ms < self.min_speech_ms:
+            return
+        if self._partial_task is not None and not self._partial_task.done():
+            return  # one partial at a time; the next one covers more audio anyway
+        self._partial_covers = len(self._utterance)
+        self._partial_task = asyncio.create_task(self._run_partial(pcm_to_wav(bytes(self._utterance), self.sample_rate)))
+
+    async def _run_partial(self, audio: bytes) -> Optional[str]:
+        try:
+            text = await self.run_blocking(self.transcribe, audio)
+        except Exception as e:
+            logger.warning(f"Partial transcription failed: {e}")
+            return None
+        if not is_usable_transcript(text):
+            return None
+        if self.on_partial is not None:
+            try:
+                await self.on_partial(text)
+            except Exception as e:
+                logger.warning(f"Could not deliver partial transcript: {e}")
+        return text
+
+    def _finish(self) -> "Optional[asyncio.Task[Optional[str]]]":
+        speech_ms, speech_end = self._speech_ms, self._speech_end
+        utterance = bytes(self._utterance)
+        partial_task, partial_covers = self._partial_task, self._partial_covers
+        self._reset_utterance()
+
+        if speech_ms < self.min_speech_ms:
+            logger.debug(f"Dropping {speech_ms} ms of speech as noise")
+            return None
+        task = asyncio.create_task(self._final_transcript(utterance, speech_ms, speech_end, partial_task, partial_covers))
+        # Retrieve the outcome even if the utterance is dropped before anyone awaits it
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+    async def _final_transcript(self, utterance: bytes, speech_ms: int, speech_end: int,
+                                partial_task: Optional[asyncio.Task], partial_covers: int) -> Optional[str]:
+        if partial_task is not None:
+            if partial_covers >= speech_end:
+                text = await partial_task
+                if text:
+                    logger.info(f"Final transcript reused from pause transcription ({speech_ms} ms of speech)")
+                    return text
+            else:
+                # Stale: the final transcript below supersedes it
+                partial_task.cancel()
+        # Trailing silence beyond a short tail adds upload and nothing else
+        tail = self.sample_rate * SAMPLE_WIDTH * PAUSE_MS // 1000
+        audio = pcm_to_wav(utterance[: speech_end + tail], self.sample_rate)
+        return await self.run_blocking(self.transcribe, audio)
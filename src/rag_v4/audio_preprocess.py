@@ -0,0 +1,133 @@
+"""
+Audio preprocessing before speech-to-text.
+
+Browsers upload whatever MediaRecorder produced (webm/opus, sometimes at
+48 kHz stereo, with leading and trailing silence). Before transcription each
+utterance is:
+
+1. decoded by ffmpeg to 16 kHz mono 16-bit PCM,
+2. trimmed to the span the voice-activity detector marks as speech (plus a
+   little padding). Only a near-silent utterance is rejected here, with no
+   STT call; when the detector finds too little speech in audible audio the
+   whole utterance is sent instead,
+3. re-encoded as 24 kbps Ogg/Opus, which is a fraction of the original upload.
+
+ffmpeg is an optional dependency (FFMPEG_PATH or on PATH). Without it, or when
+decoding fails, the original bytes go to STT unchanged.
+"""
+
+import logging
+import os
+import shutil
+import subprocess
+from typing import Optional, Tuple
+
+from asr_stream import FRAME_MS, MIN_SPEECH_RMS, SAMPLE_RATE, SAMPLE_WIDTH, EnergyVAD, pcm_rms, pcm_to_wav
+
+logger = logging.getLogger(__name__)
+
+FFMPEG = os.getenv("FFMPEG_PATH") or shutil.which("ffmpeg")
+FFMPEG_TIMEOUT = 20
+OPUS_BITRATE = "24k"
+# Audio kept around the detected speech so word edges aren't clipped
+SPEECH_PADDING_MS = 200
+# Less speech than this counts as no speech at all
+MIN_SPEECH_MS = 150
+
+
+class PreparedAudio:
+    def __init__(self, audio: bytes, filename: str, original_bytes: int,
+                 duration_ms: Optional[int] = None, speech_ms: Optional[int] = None):
+        self.audio = audio
+        self.filename = filename
+        self.original_bytes = original_bytes
+        self.duration_ms = duration_ms
+        self.speech_ms = speech_ms
+
+    def __repr__(self) -> str:
+        return (f"PreparedAudio({self.filename}, {self.original_bytes} -> {len(self.audio)} bytes, "
+                f"speech {self.speech_ms} of {self.duration_ms} ms)")
+
+
+def _ffmpeg(args: list, data: bytes) -> Optional[bytes]:
+    try:
+        result = subprocess.run(
+            [FFMPEG, "-hide_banner", "-loglevel", "error", *args],
+            input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=FFMPEG_TIMEOUT,
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"ffmpeg failed: {e}")
+        return None
+    if result.returncode != 0 or not result.stdout:
+        logger.warning(f"ffmpeg exited with {result.returncode}: {result.stderr.decode(errors='replace')[-300:]}")
+        return None
+    return result.stdout
+
+
+def decode_pcm(audio: bytes) -> Optional[bytes]:
+    """Any container/codec ffmpeg reads -> 16 kHz mono s16le PCM."""
+    return _ffmpeg(["-i", "pipe:0", "-vn", "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", "pipe:1"], audio)
+
+
+def encode_opus(pcm: bytes) -> Optional[bytes]:
+    return _ffmpeg([
+        "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "-i", "pipe:0",
+        "-c:a", "libopus", "-b:a", OPUS_BITRATE, "-application", "voip", "-f", "ogg", "pipe:1",
+    ], pcm)
+
+
+def trim_silence(pcm: bytes, vad: Optional[EnergyVAD] = None) -> Tuple[bytes, int]:
+    """The speech span of ``pcm`` with padding, and the milliseconds of speech in it."""
+    vad = vad or EnergyVAD(SAMPLE_RATE)
+    frame_bytes = vad.frame_bytes
+    first = last = None
+    speech_frames = 0
+    for index in range(len(pcm) // frame_bytes):
+        if vad.is_speech(pcm[index * frame_bytes:(index + 1) * frame_bytes]):
+            speech_frames += 1
+            if first is None:
+                first = index
+            last = index
+    if first is None:
+        return b"", 0
+    padding = SPEECH_PADDING_MS // FRAME_MS
+    start = max(0, first - padding) * frame_bytes
+    end = min(len(pcm), (last + 1 + padding) * frame_bytes)
+    return pcm[start:end], speech_frames * FRAME_MS
+
+
+def peak_rms(pcm: bytes, frame_bytes: int = SAMPLE_RATE * FRAME_MS // 1000 * SAMPLE_WIDTH) -> float:
+    """Loudest frame level of ``pcm``."""
+    return max((pcm_rms(pcm[i:i + frame_bytes]) for i in range(0, len(pcm), frame_bytes)), default=0.0)
+
+
+def prepare_for_stt(audio: bytes, filename: str = "audio.webm") -> Optional[PreparedAudio]:
+    """
+    Audio to upload for transcription, or None when the recording holds no speech.
+    Falls back to the original bytes whenever ffmpeg can't help.
+    """
+    if not FFMPEG:
+        return PreparedAudio(audio, filename, len(audio))
+    pcm = decode_pcm(audio)
+    if pcm is None:
+        return PreparedAudio(audio, filename, len(audio))
+
+    duration_ms = len(pcm) * 1000 // (SAMPLE_RATE * SAMPLE_WIDTH)
+    speech, speech_ms = trim_silence(pcm)
+    if speech_ms < MIN_SPEECH_MS:
+        if peak_rms(pcm) < MIN_SPEECH_RMS:
+            logger.info(f"No speech in {duration_ms} ms of audio; skipping STT")
+            return None
+        # Audible but not clearly speech to the detector: let STT decide on the whole clip
+        speech, speech_ms = pcm, None
+
+    encoded = encode_opus(speech)
+    if encoded is not None:
+        prepared = PreparedAudio(encoded, "audio.ogg", len(audio), duration_ms, speech_ms)
+    else:
+        # No libopus: trimmed 16 kHz WAV, unless that is bigger than what we received
+        wav = pcm_to_wav(speech)
+        prepared = (PreparedAudio(wav, "audio.wav", len(audio), duration_ms, speech_ms) if len(wav) < len(audio)
+                    else PreparedAudio(audio, filename, len(audio), duration_ms, speech_ms))
+    logger.info(f"Prepared audio for STT: {prepared}")
+    return prepared
@@ -0,0 +1,64 @@
+"""
+Cooperative cancellation for blocking work running on worker threads.
+
+A thread blocked on an HTTP call cannot be interrupted. Instead, the work
+belonging to one request (for example one voice utterance) runs inside a
+``cancel_scope`` holding a ``threading.Event``. Long-running helpers such as
+LLM retries and hedges, TTS chunk loops and multi-pass prompts check the
+event at their safe points. Once it is set they raise ``OperationCancelled``
+instead of starting more upstream work.
+
+The scope is a context variable, so it follows asyncio tasks. It also follows
+jobs submitted with ``run_in_scope``, which copies the caller's context onto
+the worker thread.
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+_token: "contextvars.ContextVar[Optional[threading.Event]]" = contextvars.ContextVar("cancel_token", default=None)
+
+
+class OperationCancelled(Exception):
+    """The surrounding cancel scope was cancelled; the result is no longer wanted."""
+
+
+def current_token() -> Optional[threading.Event]:
+    return _token.get()
+
+
+def is_cancelled() -> bool:
+    token = _token.get()
+    return token is not None and token.is_set()
+
+
+def raise_if_cancelled() -> None:
+    if is_cancelled():
+        raise OperationCancelled("cancelled")
+
+
+def wait_cancelled(seconds: float) -> bool:
+    """Sleep up to ``seconds``, waking early when the scope is cancelled; True if it was."""
+    token = _token.get()
+    if token is None:
+        time.sleep(seconds)
+        return False
+    return token.wait(seconds)
+
+
+@contextmanager
+def cancel_scope(token: threading.Event) -> Iterator[threading.Event]:
+    reset = _token.set(token)
+    try:
+        yield token
+    finally:
+        _token.reset(reset)
+
+
+def run_in_scope(func: Callable[..., Any]) -> Callable[..., Any]:
+    """Bind ``func`` to the caller's context, so it runs inside the same cancel scope on another thread."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(func, *args, **kwargs)
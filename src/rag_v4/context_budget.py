@@ -0,0 +1,281 @@
+"""
+Token budgeting and context compaction for chat history.
+
+Recent turns are kept verbatim. Older turns are grouped into fixed-size
+blocks counted from the start of the conversation; each block is folded into
+a rolling summary by a background worker. Because block boundaries never
+move, a summary computed for one request is reused by every later request of
+the same conversation, so per-turn prompt size stays flat as sessions grow.
+Until a block's summary is ready, a cheap extractive digest stands in for it.
+"""
+
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _ENCODING = None
+
+DEFAULT_TOKEN_BUDGET = 1200
+DEFAULT_RECENT_TURNS = 6
+DEFAULT_BLOCK_SIZE = 8
+# Characters kept per turn in the extractive stand-in for a pending summary
+EXTRACTIVE_TURN_CHARS = 160
+MAX_CACHED_SUMMARIES = 512
+
+ROLE_LABELS = {"user": "User", "assistant": "Assistant", "doctor": "Doctor"}
+
+_SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+')
+_WORD = re.compile(r"[a-z0-9']+")
+
+# Words that change or qualify a fact: a sentence containing one is never a mere restatement
+CORRECTION_WORDS = {
+    "no", "not", "isn't", "wasn't", "aren't", "don't", "doesn't", "never", "wrong", "incorrect",
+    "actually", "instead", "change", "changed", "update", "updated", "correct", "correction",
+    "fix", "new", "now", "but", "anymore", "moved", "old", "previous", "typo", "mistake",
+}
+# Words a restatement may contain besides the known values ("my phone number is ...")
+RESTATEMENT_WORDS = {
+    "i", "i'm", "im", "am", "my", "me", "mine", "is", "are", "was", "it", "it's", "its", "the", "a", "an",
+    "and", "of", "at", "in", "on", "to", "for", "as", "that", "this", "here", "yes", "yeah", "ok", "okay",
+    "so", "just", "again", "still", "also", "please", "use", "name", "first", "last", "full", "date",
+    "birth", "dob", "birthday", "born", "phone", "number", "cell", "mobile", "email", "e", "mail",
+    "address", "street", "city", "state", "zip", "code", "ssn", "social", "security", "live", "lives",
+    "called", "call", "reach",
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Count tokens with tiktoken when installed, else approximate 4 chars/token."""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return len(text) // 4 + 1
+
+
+def format_turn(turn: Dict[str, Any]) -> str:
+    role = ROLE_LABELS.get(turn.get("type"), str(turn.get("type", "User")).capitalize())
+    return f"{role}: {turn.get('content', '')}"
+
+
+def known_values(user_info: Optional[Dict[str, Any]], vector_db_dir: str = "vector_db") -> List[str]:
+    """Lower-cased user_info values long enough to identify a fact in text."""
+    if not user_info:
+        return []
+    values = []
+    for value in user_info.values():
+        if isinstance(value, (dict, list)) or value is None:
+            continue
+        text = str(value).strip().lower()
+        if len(text) >= 4 and vector_db_dir not in text:
+            values.append(text)
+    return values
+
+
+def restates_known_facts(sentence: str, values: List[str]) -> bool:
+    """True when ``sentence`` only repeats known values, with nothing new or corrective in it."""
+    text = sentence.lower()
+    matched = [value for value in values if value in text]
+    if not matched:
+        return False
+    for value in sorted(matched, key=len, reverse=True):
+        text = text.replace(value, " ")
+    words = _WORD.findall(text)
+    if any(word in CORRECTION_WORDS for word in words):
+        return False
+    return all(word in RESTATEMENT_WORDS for word in words)
+
+
+def strip_known_facts(turn: Dict[str, Any], values: List[str]) -> str:
+    """Drop sentences of a user turn that only restate data already in user_info."""
+    content = str(turn.get("content", ""))
+    if not values or turn.get("type") != "user":
+        return content
+    kept = [
+        sentence for sentence in _SENTENCE_SPLIT.split(content)
+        if not restates_known_facts(sentence, values)
+    ]
+    return " ".join(kept)
+
+
+class ContextCompactor:
+    """Renders chat history into a bounded prompt section."""
+
+    def __init__(
+        self,
+        summarizer: Callable[[str, str], str],
+        token_budget: int = DEFAULT_TOKEN_BUDGET,
+        recent_turns: int = DEFAULT_RECENT_TURNS,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+    ):
+        self.summarizer = summarizer
+        self.token_budget = token_budget
+        self.recent_turns = recent_turns
+        self.block_size = block_size
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="context-compactor")
+
+    @staticmethod
+    def _chain_key(previous_key: str, block: List[Dict[str, Any]]) -> str:
+        digest = hashlib.sha1(previous_key.encode("utf-8"))
+        for turn in block:
+            digest.update(format_turn(turn).encode("utf-8"))
+            digest.update(b"\x00")
+        return digest.hexdigest()
+
+    def _get_summary(self, key: str) -> Optional[str]:
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is not None:
+                self._summaries.move_to_end(key)
+            return summary
+
+    def _store_summary(self, key: str, summary: str) -> None:
+        with self._lock:
+            self._summaries[key] = summary
+            self._summaries.move_to_end(key)
+            while len(self._summaries) > MAX_CACHED_SUMMARIES:
+                self._summaries.popitem(last=False)
+            self._pending.discard(key)
+
+    def _schedule(self, key: str, previous_summary: str, block: List[Dict[str, Any]], values: List[str]) -> None:
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+
+        turns_text = "\n".join(
+            f"{ROLE_LABELS.get(t.get('type'), 'User')}: {strip_known_facts(t, values)}" for t in block
+        )
+
+        def run():
+            try:
+                summary = (self.summarizer(previous_summary, turns_text) or "").strip()
+                self._store_summary(key, summary or previous_summary)
+            except Exception as e:
+                logger.error(f"Background conversation summary failed: {e}")
+                with self._lock:
+                    self._pending.discard(key)
+
+        self._executor.submit(run)
+
+    def split(self, turns: List[Dict[str, Any]]) -> Tuple[List[List[Dict[str, Any]]], List[Dict[str, Any]]]:
+        """Split turns into fixed-size older blocks and the verbatim tail."""
+        compactable = max(0, len(turns) - self.recent_turns)
+        full_blocks = compactable // self.block_size
+        blocks = [
+            turns[i * self.block_size:(i + 1) * self.block_size] for i in range(full_blocks)
+        ]
+        return blocks, turns[full_blocks * self.block_size:]
+
+    def render(
+        self,
+        turns: List[Dict[str, Any]],
+        user_info: Optional[Dict[str, Any]] = None,
+        token_budget: Optional[int] = None,
+        anchor: Tuple[str, str] = ("", ""),
+    ) -> str:
+        """Return the chat history section for a prompt within the token budget.
+
+        ``anchor`` is the (chain key, summary) of turns the caller has already
+        dropped, so stateful sessions can discard summarized turns.
+        """
+        budget = token_budget or self.token_budget
+        values = known_values(user_info)
+        blocks, recent = self.split(turns)
+
+        key, summary = anchor
+        pending_lines: List[str] = []
+        scheduled = False
+        for block in blocks:
+            next_key = self._chain_key(key, block)
+            next_summary = self._get_summary(next_key) if not pending_lines else None
+            if next_summary is not None:
+                key, summary = next_key, next_summary
+                continue
+            if not scheduled:
+                # Summaries chain, so only the first missing block can be computed now
+                self._schedule(next_key, summary, block, values)
+                scheduled = True
+            for turn in block:
+                text = strip_known_facts(turn, values).strip()
+                if text:
+                    role = ROLE_LABELS.get(turn.get("type"), "User")
+                    pending_lines.append(f"{role}: {text[:EXTRACTIVE_TURN_CHARS]}")
+
+        recent_lines = [format_turn(turn) for turn in recent]
+
+        def assemble() -> str:
+            parts = []
+            if summary:
+                parts.append(f"Summary of earlier conversation: {summary}")
+            parts.extend(pending_lines)
+            parts.extend(recent_lines)
+            return "\n" + "\n".join(parts) + "\n" if parts else ""
+
+        text = assemble()
+        # Trim oldest material first, always keeping the last exchange verbatim
+        while estimate_tokens(text) > budget and (pending_lines or len(recent_lines) > 2):
+            if pending_lines:
+                pending_lines.pop(0)
+            else:
+                recent_lines.pop(0)
+            text = assemble()
+        if estimate_tokens(text) > budget and summary:
+            summary = summary[: max(0, len(summary) - 4 * (estimate_tokens(text) - budget))]
+            text = assemble()
+        return text
+
+    def settled_anchor(self, turns: List[Dict[str, Any]], anchor: Tuple[str, str] = ("", "")) -> Tuple[Tuple[str, str], int]:
+        """Return the furthest summarized anchor and how many turns it covers."""
+        blocks, _ = self.split(turns)
+        key, summary = anchor
+        covered = 0
+        for block in blocks:
+            next_key = self._chain_key(key, block)
+            next_summary = self._get_summary(next_key)
+            if next_summary is None:
+                break
+            key, summary = next_key, next_summary
+            covered += len(block)
+        return (key, summary), covered
+
+
+class ConversationContext:
+    """Per-connection conversation memory with bounded growth."""
+
+    def __init__(self, compactor: ContextCompactor):
+        self.compactor = compactor
+        self.turns: List[Dict[str, Any]] = []
+        self._anchor: Tuple[str, str] = ("", "")
+
+    def __len__(self) -> int:
+        return len(self.turns)
+
+    def append(self, turn_type: str, content: str) -> None:
+        self.turns.append({"type": turn_type, "content": content})
+
+    def replace(self, turns: List[Dict[str, Any]]) -> None:
+        """Restore history sent by the client, discarding previous state."""
+        self.turns = [{"type": t.get("type"), "content": t.get("content", "")} for t in turns]
+        self._anchor = ("", "")
+
+    def render(self, user_info: Optional[Dict[str, Any]] = None, token_budget: Optional[int] = None) -> str:
+        text = self.compactor.render(self.turns, user_info, token_budget, anchor=self._anchor)
+        # Turns already folded into a summary no longer need to be held in memory
+        self._anchor, covered = self.compactor.settled_anchor(self.turns, self._anchor)
+        if covered:
+            self.turns = self.turns[covered:]
+        return text
@@ -0,0 +1,219 @@
+"""
+Content-hash ledger of text that has already been through key-value extraction.
+
+Documents are split into pages and conversations into turns. Each unit is
+hashed after whitespace normalization.
+
+Document pages are recorded per profile together with the extraction batch
+they were part of. Re-uploading a document only extracts the pages never seen
+before, and a stored batch result is reused only while every page of that
+batch is still in the upload. A batch with a changed or removed page is
+extracted again, so its fields can't come back from a page that is gone.
+
+Conversation turns are only compared with the previous submission of the same
+profile, and only within ``CONVERSATION_WINDOW`` seconds. A re-sent transcript
+is not extracted twice, but a turn repeated later ("X", "Y", then "X" again)
+is new information and is extracted.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Page separator written by extract_text_from_pdf_with_ocr
+PAGE_MARKER = re.compile(r'\n?--- Page \d+ ---\n')
+_WHITESPACE = re.compile(r'\s+')
+# Seconds after which a conversation submission no longer counts as the previous one
+CONVERSATION_WINDOW = float(os.getenv("EXTRACTION_CONVERSATION_WINDOW", "1800"))
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS extracted_units (
+        scope TEXT NOT NULL,
+        unit_hash TEXT NOT NULL,
+        batch_id TEXT NOT NULL,
+        PRIMARY KEY (scope, unit_hash)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS extraction_batches (
+        batch_id TEXT PRIMARY KEY,
+        result TEXT NOT NULL,
+        created_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS batch_units (
+        batch_id TEXT NOT NULL,
+        unit_hash TEXT NOT NULL,
+        PRIMARY KEY (batch_id, unit_hash)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS conversation_turns (
+        scope TEXT PRIMARY KEY,
+        hashes TEXT NOT NULL,
+        recorded_at REAL NOT NULL
+    )
+    """,
+]
+
+
+def content_hash(text: str) -> str:
+    """Hash of the text with whitespace collapsed, so OCR spacing noise doesn't matter."""
+    normalized = _WHITESPACE.sub(" ", text).strip()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def document_units(documents: Iterable[Any]) -> List[str]:
+    """Split loaded documents into page-sized units."""
+    units = []
+    for document in documents or []:
+        content = getattr(document, "page_content", document) or ""
+        for page in PAGE_MARKER.split(str(content)):
+            if page.strip():
+                units.append(page.strip())
+    return units
+
+
+def conversation_units(text: str) -> List[str]:
+    """Split conversation text into turns (one per non-empty line)."""
+    return [line.strip() for line in (text or "").splitlines() if line.strip()]
+
+
+class ExtractionLedger:
+    """SQLite-backed record of extracted units and their extraction results."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        for statement in SCHEMA:
+            self._conn.execute(statement)
+        self._lock = threading.Lock()
+
+    def plan(self, scope: str, units: List[str]) -> Tuple[List[str], Dict[str, Any]]:
+        """Return the document units to extract, and the merged results covering the rest."""
+        hashes = [content_hash(unit) for unit in units]
+        present = set(hashes)
+        with self._lock:
+            seen: Dict[str, str] = {}
+            # Stay well below SQLite's bound-parameter limit
+            for i in range(0, len(hashes), 500):
+                batch = hashes[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT unit_hash, batch_id FROM extracted_units WHERE scope = ? AND unit_hash IN ({placeholders})",
+                    [scope, *batch],
+                ).fetchall()
+                seen.update(rows)
+
+            previous: Dict[str, Any] = {}
+            for batch_id in dict.fromkeys(seen[h] for h in hashes if h in seen):
+                members = {
+                    row[0] for row in self._conn.execute(
+                        "SELECT unit_hash FROM batch_units WHERE batch_id = ?", (batch_id,)
+                    )
+                }
+                row = self._conn.execute(
+                    "SELECT result FROM extraction_batches WHERE batch_id = ?", (batch_id,)
+                ).fetchone()
+                # The batch result mixes all its pages; reuse it only if none of them changed or went away
+                if row and members and members <= present:
+                    previous.update(json.loads(row[0]))
+                else:
+                    seen = {h: b for h, b in seen.items() if b != batch_id}
+
+        new_units = []
+        pending = set()
+        for unit, unit_hash in zip(units, hashes):
+            if unit_hash not in seen and unit_hash not in pending:
+                new_units.append(unit)
+                pending.add(unit_hash)
+        logger.info(f"Extraction ledger [{scope}]: {len(new_units)} new of {len(units)} units")
+        return new_units, previous
+
+    def record(self, scope: str, units: List[str], result: Dict[str, Any]) -> None:
+        """Mark units as extracted, storing the result of the batch they were extracted in."""
+        if not units:
+            return
+        batch_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO extraction_batches (batch_id, result, created_at) VALUES (?, ?, ?)",
+                    (batch_id, json.dumps(result), time.time()),
+                )
+                hashes = list(dict.fromkeys(content_hash(unit) for unit in units))
+                self._conn.executemany(
+                    "INSERT INTO extracted_units (scope, unit_hash, batch_id) VALUES (?, ?, ?) "
+                    "ON CONFLICT(scope, unit_hash) DO UPDATE SET batch_id = excluded.batch_id",
+                    [(scope, unit_hash, batch_id) for unit_hash in hashes],
+                )
+                self._conn.executemany(
+                    "INSERT INTO batch_units (batch_id, unit_hash) VALUES (?, ?)",
+                    [(batch_id, unit_hash) for unit_hash in hashes],
+                )
+                self._prune()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _prune(self) -> None:
+        """Drop batches no unit points at any more (their pages were all re-extracted since)."""
+        self._conn.execute(
+            "DELETE FROM extraction_batches WHERE batch_id NOT IN (SELECT batch_id FROM extracted_units)"
+        )
+        self._conn.execute(
+            "DELETE FROM batch_units WHERE batch_id NOT IN (SELECT batch_id FROM extraction_batches)"
+        )
+
+    def plan_conversation(self, scope: str, turns: List[str]) -> List[str]:
+        """Return the turns that were not in the previous submission (repeats count separately)."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT hashes, recorded_at FROM conversation_turns WHERE scope = ?", (scope,)
+            ).fetchone()
+        remaining = Counter()
+        if row and time.time() - row[1] <= CONVERSATION_WINDOW:
+            remaining = Counter(json.loads(row[0]))
+
+        # Match from the start, so the latest occurrence of a repeated turn is the new one
+        new_turns = []
+        for turn in turns:
+            turn_hash = content_hash(turn)
+            if remaining[turn_hash] > 0:
+                remaining[turn_hash] -= 1
+            else:
+                new_turns.append(turn)
+        logger.info(f"Extraction ledger [{scope}]: {len(new_turns)} new of {len(turns)} turns")
+        return new_turns
+
+    def record_conversation(self, scope: str, turns: List[str]) -> None:
+        """Remember the turns of this submission as the one the next submission is compared with."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO conversation_turns (scope, hashes, recorded_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(scope) DO UPDATE SET hashes = excluded.hashes, recorded_at = excluded.recorded_at",
+                (scope, json.dumps([content_hash(turn) for turn in turns]), time.time()),
+            )
+
+    def forget(self, scope: str) -> None:
+        """Drop everything recorded for a scope so its content is extracted again."""
+        with self._lock:
+            self._conn.execute("DELETE FROM extracted_units WHERE scope = ?", (scope,))
+            self._conn.execute("DELETE FROM conversation_turns WHERE scope = ?", (scope,))
+            self._prune()
@@ -0,0 +1,420 @@
+"""
+Indexed store of filled form submissions.
+
+Submissions saved by the frontend (one JSON file per form) and forms posted
+to the EHR router are parsed once and indexed by patient: every word of a
+patient name (or of any short answer, whatever its label), and normalized
+identifiers such as SSN, date of birth, e-mail and member ID, map to the ids
+of the forms that mention them. Looking up a
+patient intersects the posting sets of the query words, so the cost depends
+on the number of matching forms rather than on the submission history.
+
+A background thread re-scans the submissions directory (by modification
+time) every REFRESH_INTERVAL seconds, so files written after startup are
+picked up without a restart. Lookups never touch the directory, and files are
+parsed outside the index lock.
+
+Only a compact manifest (id, template, timestamp, mtime and patient keys per
+file) is kept on disk and loaded at startup; the first directory scan only
+parses files the manifest doesn't know. Form bodies are read on demand and
+kept in a bounded LRU cache. Forms posted to the EHR router have no file of
+their own; the newest MAX_PINNED_FORMS of them are kept in the manifest too.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from field_ontology import get_field_index, key_words
+
+logger = logging.getLogger(__name__)
+
+REFRESH_INTERVAL = 2.0
+MAX_CACHED_FORMS = 128
+MAX_PINNED_FORMS = 1000
+# Version 2 also indexes the words of short free-text answers
+MANIFEST_VERSION = 2
+# Answers of at most this many words are indexed as possible names, whatever their label
+MAX_NAME_VALUE_WORDS = 6
+
+# Canonical fields whose values name the patient (or someone the form is about)
+NAME_FIELDS = {"name", "firstName", "middleName", "lastName", "emergencyContactName", "subscriberName"}
+# Canonical fields whose values identify a patient exactly
+IDENTIFIER_FIELDS = {"ssn", "dateOfBirth", "email", "subscriberId", "policyNumber"}
+
+_NAME_WORD = re.compile(r"[a-z][a-z'\-]*")
+
+
+def name_tokens(text: Any) -> List[str]:
+    """Lower-case words of a person's name."""
+    return _NAME_WORD.findall(str(text).lower())
+
+
+def identifier_key(field: str, value: Any) -> Optional[str]:
+    """Normalized index key for an identifying value, e.g. ``ssn:123456789``."""
+    text = str(value).strip().lower()
+    if field == "email":
+        normalized = text
+    else:
+        normalized = re.sub(r'[^a-z0-9]', '', text)
+    return f"{field}:{normalized}" if normalized else None
+
+
+def extract_answers(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Non-empty answers of a submission, whatever shape it was saved in."""
+    answers: Dict[str, Any] = {}
+    if isinstance(data.get('formValues'), dict):
+        for k, v in data['formValues'].items():
+            if v not in (None, ""):
+                answers[k] = v
+    elif isinstance(data.get('fields'), dict):
+        # EHR router submissions store the raw form data
+        for k, v in data['fields'].items():
+            if v not in (None, ""):
+                answers[k] = v
+    else:
+        for field in data.get('fields', []) or []:
+            if not isinstance(field, dict):
+                continue
+            val = field.get('value')
+            if val not in (None, ""):
+                answers[field.get('label') or field.get('id')] = val
+    return answers
+
+
+class FilledFormsStore:
+    """Filled form submissions with an inverted index from patient keys to form ids."""
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        manifest_path: Optional[str] = None,
+        refresh_interval: float = REFRESH_INTERVAL,
+        max_cached_forms: int = MAX_CACHED_FORMS,
+        max_pinned_forms: int = MAX_PINNED_FORMS,
+    ):
+        self.directory = directory
+        self.manifest_path = manifest_path
+        self.refresh_interval = refresh_interval
+        self.max_cached_forms = max_cached_forms
+        self.max_pinned_forms = max_pinned_forms
+        self._index = get_field_index()
+        # form id -> {'path', 'templateName', 'submittedAt'}
+        self._meta: Dict[str, Dict[str, Any]] = {}
+        self._keys: Dict[str, Set[str]] = {}
+        self._postings: Dict[str, Set[str]] = {}
+        # path -> (mtime, form id) of the files currently indexed
+        self._files: Dict[str, Tuple[float, str]] = {}
+        # Bodies of file-backed forms, paged in on demand
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # Bodies of forms without a file (posted to the EHR router), oldest first
+        self._pinned: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._last_refresh = 0.0
+        self._dirty = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self._load_manifest()
+        if self.directory or self.manifest_path:
+            self.start()
+
+    def __len__(self) -> int:
+        return len(self._meta)
+
+    def start(self) -> None:
+        """Reconcile with the directory now and then every ``refresh_interval`` seconds, off-thread."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="filled-forms-scan", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        force = True
+        while True:
+            try:
+                self.refresh(force=force)
+                with self._lock:
+                    dirty, self._dirty = self._dirty, False
+                if dirty:
+                    self._save_manifest()
+            except Exception as e:
+                logger.error(f"Filled forms refresh failed: {e}")
+            force = False
+            if self._stop.wait(self.refresh_interval):
+                return
+
+    def patient_keys(self, form: Dict[str, Any]) -> Set[str]:
+        """
+        Index keys for a form: name words and normalized identifiers. Forms name the
+        patient under all sorts of labels ("Patient", "Insured", "Subscriber"), so the
+        words of every short free-text answer are indexed as well.
+        """
+        keys: Set[str] = set()
+        patient_name = form.get('patientName')
+        if patient_name:
+            keys.update(name_tokens(patient_name))
+        for label, value in form['answers'].items():
+            if isinstance(value, (dict, list, bool)):
+                continue
+            field = self._index.canonical(label)
+            if field in NAME_FIELDS or (field is None and "name" in key_words(label)):
+                keys.update(name_tokens(value))
+            elif field in IDENTIFIER_FIELDS:
+                key = identifier_key(field, value)
+                if key:
+                    keys.add(key)
+            elif isinstance(value, str) and len(value.split()) <= MAX_NAME_VALUE_WORDS:
+                keys.update(name_tokens(value))
+        return keys
+
+    @staticmethod
+    def _form(data: Dict[str, Any], form_id: str, answers: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'id': form_id,
+            'templateName': data.get('templateName') or data.get('formName'),
+            'submittedAt': data.get('submittedAt'),
+            'answers': answers,
+        }
+
+    def add(self, data: Dict[str, Any], form_id: Optional[str] = None, path: Optional[str] = None) -> Optional[str]:
+        """Index one submission (a saved JSON document). Returns its id, or None if empty."""
+        answers = extract_answers(data)
+        if not answers:
+            return None  # Ignore completely empty submissions
+        form_id = str(data.get('id') or form_id or f"submission-{len(self._meta) + 1}")
+        form = self._form(data, form_id, answers)
+        keys = self.patient_keys({**form, 'patientName': data.get('patientName')})
+        with self._lock:
+            self._index_form(form_id, {'path': path, 'templateName': form['templateName'],
+                                       'submittedAt': form['submittedAt']}, keys)
+            if path:
+                self._cache_form(form)
+            else:
+                self._pin(form)
+        return form_id
+
+    def _pin(self, form: Dict[str, Any]) -> None:
+        self._pinned[form['id']] = form
+        self._pinned.move_to_end(form['id'])
+        while len(self._pinned) > self.max_pinned_forms:
+            evicted, _ = self._pinned.popitem(last=False)
+            self._unindex(evicted)
+            self._meta.pop(evicted, None)
+        # Persisted by the background thread, not by the (async) caller
+        self._dirty = True
+
+    def remove(self, form_id: str) -> None:
+        with self._lock:
+            self._unindex(form_id)
+            self._meta.pop(form_id, None)
+            self._cache.pop(form_id, None)
+            if self._pinned.pop(form_id, None) is not None:
+                self._dirty = True
+
+    def _index_form(self, form_id: str, meta: Dict[str, Any], keys: Set[str]) -> None:
+        self._unindex(form_id)
+        self._meta[form_id] = meta
+        self._keys[form_id] = keys
+        for key in keys:
+            self._postings.setdefault(key, set()).add(form_id)
+
+    def _unindex(self, form_id: str) -> None:
+        for key in self._keys.pop(form_id, ()):
+            postings = self._postings.get(key)
+            if postings is not None:
+                postings.discard(form_id)
+                if not postings:
+                    del self._postings[key]
+
+    def _cache_form(self, form: Dict[str, Any]) -> None:
+        self._cache[form['id']] = form
+        self._cache.move_to_end(form['id'])
+        while len(self._cache) > self.max_cached_forms:
+            self._cache.popitem(last=False)
+
+    def _load_file(self, path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Failed to load form submission '{os.path.basename(path)}': {e}")
+            return None
+
+    def get(self, form_id: str) -> Optional[Dict[str, Any]]:
+        """Full form body, read from disk if it isn't cached."""
+        with self._lock:
+            form = self._pinned.get(form_id) or self._cache.get(form_id)
+            if form is not None:
+                if form_id in self._cache:
+                    self._cache.move_to_end(form_id)
+                return form
+            meta = self._meta.get(form_id)
+        if not meta or not meta.get('path'):
+            return None
+
+        data = self._load_file(meta['path'])
+        if data is None:
+            return None
+        form = self._form(data, form_id, extract_answers(data))
+        with self._lock:
+            if form_id in self._meta:
+                self._cache_form(form)
+        return form
+
+    def _load_manifest(self) -> None:
+        if not self.manifest_path or not os.path.exists(self.manifest_path):
+            return
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except Exception as e:
+            logger.error(f"Failed to read filled forms manifest, rebuilding it: {e}")
+            return
+        version = manifest.get('version')
+        if version not in (1, MANIFEST_VERSION):
+            return
+        current = version == MANIFEST_VERSION
+        with self._lock:
+            # Files from an older manifest are parsed again by the first scan
+            for entry in manifest.get('forms', []) if current else []:
+                path = entry['path']
+                self._index_form(entry['id'], {'path': path, 'templateName': entry.get('templateName'),
+                                               'submittedAt': entry.get('submittedAt')}, set(entry['keys']))
+                self._files[path] = (entry['mtime'], entry['id'])
+            for entry in manifest.get('pinned', []):
+                # Posted forms exist only here; their keys are recomputed rather than dropped
+                form = entry['form']
+                keys = set(entry['keys']) if current else self.patient_keys(form)
+                self._index_form(form['id'], {'path': None, 'templateName': form.get('templateName'),
+                                              'submittedAt': form.get('submittedAt')}, keys)
+                self._pinned[form['id']] = form
+            self._dirty = not current
+        logger.info(f"Loaded filled forms manifest with {len(self._files)} submissions "
+                    f"and {len(self._pinned)} posted forms")
+
+    def _save_manifest(self) -> None:
+        if not self.manifest_path:
+            return
+        with self._lock:
+            forms = [
+                {
+                    'id': form_id,
+                    'path': path,
+                    'mtime': mtime,
+                    'templateName': self._meta[form_id].get('templateName'),
+                    'submittedAt': self._meta[form_id].get('submittedAt'),
+                    'keys': sorted(self._keys.get(form_id, ())),
+                }
+                for path, (mtime, form_id) in self._files.items()
+                if form_id in self._meta
+            ]
+            pinned = [
+                {'form': form, 'keys': sorted(self._keys.get(form_id, ()))}
+                for form_id, form in self._pinned.items()
+            ]
+        try:
+            os.makedirs(os.path.dirname(self.manifest_path) or ".", exist_ok=True)
+            tmp_path = f"{self.manifest_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': MANIFEST_VERSION, 'forms': forms, 'pinned': pinned}, f,
+                          separators=(',', ':'))
+            os.replace(tmp_path, self.manifest_path)
+        except Exception as e:
+            logger.error(f"Failed to write filled forms manifest: {e}")
+
+    def refresh(self, force: bool = False) -> None:
+        """Pick up new, changed and deleted files in the submissions directory."""
+        if not self.directory:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_refresh < self.refresh_interval:
+            return
+        if not self._refresh_lock.acquire(blocking=False):
+            return  # Another refresh is already scanning
+        try:
+            self._last_refresh = now
+            if not os.path.isdir(self.directory):
+                if force:
+                    logger.warning(f"Filled forms directory not found: {self.directory}")
+                return
+            added, removed = self._rescan()
+        finally:
+            self._refresh_lock.release()
+
+        if added or removed:
+            self._save_manifest()
+        if added or removed or force:
+            logger.info(f"Filled forms index: {added} loaded, {len(removed)} removed, {len(self._meta)} total")
+
+    def _rescan(self) -> Tuple[int, List[str]]:
+        with self._lock:
+            known_files = dict(self._files)
+
+        # List and parse without holding the lock, so lookups aren't blocked on disk
+        seen = set()
+        changed = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.json') or not entry.is_file():
+                    continue
+                seen.add(entry.path)
+                mtime = entry.stat().st_mtime
+                known = known_files.get(entry.path)
+                if known and known[0] == mtime:
+                    continue
+                data = self._load_file(entry.path)
+                if data is not None:
+                    changed.append((entry.path, os.path.splitext(entry.name)[0], mtime, data))
+
+        added = 0
+        with self._lock:
+            for path, name, mtime, data in changed:
+                known = self._files.pop(path, None)
+                if known:
+                    self.remove(known[1])
+                form_id = self.add(data, form_id=name, path=path)
+                if form_id:
+                    self._files[path] = (mtime, form_id)
+                    added += 1
+
+            removed = [path for path in self._files if path not in seen]
+            for path in removed:
+                self.remove(self._files.pop(path)[1])
+        return added, removed
+
+    def lookup(self, keys: Iterable[str]) -> List[Dict[str, Any]]:
+        """Forms indexed under every one of ``keys``."""
+        with self._lock:
+            postings = [self._postings.get(key, set()) for key in keys]
+            if not postings:
+                return []
+            postings.sort(key=len)
+            matches = set(postings[0]).intersection(*postings[1:])
+        forms = [self.get(form_id) for form_id in matches]
+        return [form for form in forms if form is not None]
+
+    def forms_for_patient(self, patient_name: str) -> List[Dict[str, Any]]:
+        """Forms mentioning every word of ``patient_name``, or an identifier such as an SSN or e-mail."""
+        if not patient_name:
+            return []
+        query = patient_name.strip()
+        for field in ("email", "ssn", "dateOfBirth", "subscriberId"):
+            key = identifier_key(field, query)
+            if not key:
+                continue
+            with self._lock:
+                # The refresh thread adds and removes postings concurrently
+                known = key in self._postings
+            if known:
+                return self.lookup([key])
+        return self.lookup(name_tokens(query))
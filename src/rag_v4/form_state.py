@@ -0,0 +1,167 @@
+"""
+Versioned server-side form state.
+
+Clients used to echo the whole form (every field id, label and value) with
+each request. A FormState keeps the current fields of one form session and a
+version number; after an initial snapshot clients only send deltas:
+
+    {"version": 3, "set": [{"id": "...", "value": "..."}], "remove": ["..."]}
+
+``version`` is the version the delta was computed against. A delta against a
+stale version is rejected with FormVersionConflict so the client can resend a
+full snapshot instead of silently diverging.
+
+For prompts, ``project_form_fields`` keeps the fields still MISSING plus the
+filled fields the question refers to, instead of the whole form.
+``form_field_keys`` lists every field's id and label without values, for
+prompts that only need to name fields.
+"""
+
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+from user_info_projection import tokenize
+
+logger = logging.getLogger(__name__)
+
+MISSING = "MISSING"
+# Forms up to this size are sent to prompts whole; projection isn't worth it
+SMALL_FORM_FIELDS = 30
+MAX_FORM_SESSIONS = 256
+
+
+class FormVersionConflict(Exception):
+    """A delta was computed against a version other than the current one."""
+
+    def __init__(self, expected: int, received: Optional[int]):
+        super().__init__(f"Form state is at version {expected}, delta was against {received}")
+        self.expected = expected
+        self.received = received
+
+
+def is_missing(value: Any) -> bool:
+    return value is None or value == "" or value == MISSING
+
+
+def parse_form_fields(form_fields: Union[str, Iterable[Dict[str, Any]], None]) -> List[Dict[str, Any]]:
+    """Form fields as a list of {id, label, value} dicts from a JSON string or list."""
+    if not form_fields:
+        return []
+    if isinstance(form_fields, str):
+        try:
+            form_fields = json.loads(form_fields)
+        except json.JSONDecodeError:
+            logger.warning("Form fields are not valid JSON")
+            return []
+    if isinstance(form_fields, dict):
+        form_fields = form_fields.get("fields", [])
+    return [field for field in form_fields if isinstance(field, dict) and field.get("id") is not None]
+
+
+class FormState:
+    """The fields of one form session and the version of the last change."""
+
+    def __init__(self, fields: Optional[Iterable[Dict[str, Any]]] = None):
+        self.version = 0
+        self.fields: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        if fields is not None:
+            self.replace(fields)
+
+    def replace(self, fields: Union[str, Iterable[Dict[str, Any]]]) -> int:
+        """Replace the state with a full snapshot."""
+        parsed = parse_form_fields(fields)
+        with self._lock:
+            self.fields = OrderedDict((str(field["id"]), {**field, "id": str(field["id"])}) for field in parsed)
+            self.version += 1
+            return self.version
+
+    def apply(self, delta: Union[str, Dict[str, Any]]) -> int:
+        """Apply a delta computed against ``delta["version"]`` and return the new version."""
+        if isinstance(delta, str):
+            delta = json.loads(delta)
+        with self._lock:
+            base = delta.get("version")
+            if base is not None and base != self.version:
+                raise FormVersionConflict(self.version, base)
+            for update in delta.get("set", []) or []:
+                field_id = str(update.get("id"))
+                field = self.fields.get(field_id)
+                if field is None:
+                    field = self.fields[field_id] = {"id": field_id, "label": update.get("label", ""), "value": MISSING}
+                elif "label" in update:
+                    field["label"] = update["label"]
+                field["value"] = update.get("value", MISSING)
+            for field_id in delta.get("remove", []) or []:
+                self.fields.pop(str(field_id), None)
+            self.version += 1
+            return self.version
+
+    def __len__(self) -> int:
+        return len(self.fields)
+
+    def as_list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(field) for field in self.fields.values()]
+
+    def missing(self) -> List[Dict[str, Any]]:
+        return [field for field in self.as_list() if is_missing(field["value"])]
+
+
+def project_form_fields(
+    form_fields: Union[FormState, str, Iterable[Dict[str, Any]], None],
+    question: str = "",
+    small_form: int = SMALL_FORM_FIELDS,
+) -> str:
+    """
+    Prompt text for the form: every MISSING field, plus filled fields whose label
+    or id shares a word with the question. Small forms are returned whole.
+    """
+    fields = form_fields.as_list() if isinstance(form_fields, FormState) else parse_form_fields(form_fields)
+    if not fields:
+        return form_fields if isinstance(form_fields, str) else ""
+    if len(fields) <= small_form:
+        return json.dumps(fields, ensure_ascii=False)
+
+    question_tokens = set(tokenize(question or ""))
+    selected = [
+        field for field in fields
+        if is_missing(field.get("value"))
+        or question_tokens & set(tokenize(f"{field.get('label', '')} {field['id']}"))
+    ]
+    logger.info(f"Projected form fields from {len(fields)} to {len(selected)} (missing or referenced)")
+    return json.dumps(selected, ensure_ascii=False)
+
+
+def form_field_keys(form_fields: Union[FormState, str, Iterable[Dict[str, Any]], None]) -> str:
+    """Prompt text listing the id and label of every field, without values."""
+    fields = form_fields.as_list() if isinstance(form_fields, FormState) else parse_form_fields(form_fields)
+    if not fields:
+        return form_fields if isinstance(form_fields, str) else ""
+    return json.dumps([{"id": field["id"], "label": field.get("label", "")} for field in fields], ensure_ascii=False)
+
+
+class FormStateStore:
+    """Form states per session, least recently used sessions dropped first."""
+
+    def __init__(self, max_sessions: int = MAX_FORM_SESSIONS):
+        self.max_sessions = max_sessions
+        self._states: "OrderedDict[str, FormState]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> FormState:
+        with self._lock:
+            state = self._states.get(session_id)
+            if state is None:
+                state = self._states[session_id] = FormState()
+            self._states.move_to_end(session_id)
+            while len(self._states) > self.max_sessions:
+                self._states.popitem(last=False)
+            return state
+
+    def drop(self, session_id: str) -> None:
+        with self._lock:
+            self._states.pop(session_id, None)
@@ -0,0 +1,395 @@
+"""
+Shared LLM client layer for the Quill RAG API.
+
+Every chat completion goes through ``LLMClient.chat`` so that call sites get
+the same behaviour: a per-call deadline, jittered exponential-backoff retries
+on transient errors, an optional hedged duplicate request when the first one
+is slow, and a circuit breaker that fails fast while the upstream is down.
+Inside a cancellation scope (see cancellation) a call stops waiting, hedging
+and retrying as soon as the scope is cancelled, and the providers close the
+upstream request so it stops generating. With ``on_delta`` the reply text is
+also handed to the caller piece by piece as it is generated.
+Latency and outcome counters are kept per endpoint for the metrics API.
+
+``LLMRouter`` holds one ``LLMClient`` per provider (see llm_providers) and
+sends each task to the provider its routing rule names, falling back to
+another provider when the routed one fails.
+"""
+
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional
+
+from cancellation import OperationCancelled, current_token, is_cancelled, raise_if_cancelled, run_in_scope, wait_cancelled
+from llm_providers import CompletionProvider, as_provider
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_MAX_RETRIES = 2
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 4.0
+# Hedge a request once it has been outstanding longer than this
+DEFAULT_HEDGE_AFTER = 2.5
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 30.0
+LATENCY_WINDOW = 500
+# How often a waiting call checks whether its cancellation scope was cancelled
+CANCEL_POLL_INTERVAL = 0.1
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {
+    "APITimeoutError", "APIConnectionError", "RateLimitError", "InternalServerError", "TimeoutError",
+    # httpx / socket errors raised by local providers such as Ollama
+    "ConnectError", "ConnectTimeout", "ReadTimeout", "ConnectionError", "ConnectionRefusedError",
+}
+
+
+class LLMCallError(Exception):
+    """Raised when a completion could not be obtained within its deadline."""
+
+
+class CircuitOpenError(LLMCallError):
+    """Raised without calling upstream while the circuit breaker is open."""
+
+
+def is_retryable(error: BaseException) -> bool:
+    """True for timeouts, connection errors, rate limits and 5xx responses."""
+    if type(error).__name__ in RETRYABLE_ERROR_NAMES:
+        return True
+    status = getattr(error, "status_code", None)
+    return status in RETRYABLE_STATUS_CODES
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures, then lets one trial call through."""
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        # Thread of the call holding the half-open trial
+        self._trial_owner: Optional[int] = None
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half_open"
+            return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            self._trial_owner = threading.get_ident()
+            return True
+
+    def release_trial(self) -> None:
+        """Give up the half-open trial held by this thread without judging the upstream."""
+        with self._lock:
+            if self._trial_in_flight and self._trial_owner == threading.get_ident():
+                self._trial_in_flight = False
+                self._trial_owner = None
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+            self._trial_owner = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            self._trial_owner = None
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(f"LLM circuit breaker opened after {self._failures} consecutive failures")
+                self._opened_at = time.monotonic()
+
+
+class EndpointMetrics:
+    """Latency samples and outcome counters for one logical endpoint."""
+
+    def __init__(self):
+        self.latencies: "deque[float]" = deque(maxlen=LATENCY_WINDOW)
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.rejected = 0
+        self.cancelled = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        samples = sorted(self.latencies)
+
+        def percentile(p: float) -> float:
+            if not samples:
+                return 0.0
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))], 3)
+
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "rejected": self.rejected,
+            "cancelled": self.cancelled,
+            "p50_s": percentile(0.50),
+            "p95_s": percentile(0.95),
+            "p99_s": percentile(0.99),
+        }
+
+
+class LLMClient:
+    """Deadline-bounded, retrying, hedging wrapper around a completion provider."""
+
+    def __init__(
+        self,
+        client: Any,
+        model: Optional[str] = None,
+        timeout: float = DEFAULT_TIMEOUT,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        hedge_after: Optional[float] = DEFAULT_HEDGE_AFTER,
+        breaker: Optional[CircuitBreaker] = None,
+        max_workers: int = 16,
+    ):
+        # Raw OpenAI-style clients are wrapped so every backend has the same interface
+        self.provider: CompletionProvider = as_provider(client, model)
+        self.model = model or self.provider.model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.hedge_after = hedge_after
+        self.breaker = breaker or CircuitBreaker()
+        self._metrics: Dict[str, EndpointMetrics] = {}
+        self._metrics_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-client")
+
+    def _endpoint(self, name: str) -> EndpointMetrics:
+        with self._metrics_lock:
+            return self._metrics.setdefault(name, EndpointMetrics())
+
+    def _create(self, remaining: float, **kwargs: Any) -> Any:
+        messages = kwargs.pop("messages")
+        return self.provider.create(messages, timeout=remaining, **kwargs)
+
+    @staticmethod
+    def _wait(futures, timeout: float):
+        """wait(FIRST_COMPLETED) that raises OperationCancelled once the caller's scope is cancelled."""
+        if current_token() is None:
+            return wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+        end = time.monotonic() + timeout
+        while True:
+            done, pending = wait(futures, timeout=max(0.0, min(CANCEL_POLL_INTERVAL, end - time.monotonic())),
+                                 return_when=FIRST_COMPLETED)
+            if done or time.monotonic() >= end:
+                return done, pending
+            if is_cancelled():
+                # Requests in flight see the same scope and close their stream (see llm_providers)
+                for future in pending:
+                    future.cancel()
+                raise OperationCancelled("LLM call cancelled")
+
+    def _attempt(self, metrics: EndpointMetrics, deadline: float, hedge: bool, kwargs: Dict[str, Any]) -> Any:
+        """One attempt, optionally raced against a delayed duplicate request."""
+        remaining = deadline - time.monotonic()
+        primary = self._executor.submit(run_in_scope(self._create), remaining, **kwargs)
+        # hedge_after=None disables hedging, e.g. for a single local GPU
+        if not hedge or self.hedge_after is None or remaining <= self.hedge_after:
+            done, _ = self._wait([primary], remaining)
+            if not done:
+                raise TimeoutError("LLM call exceeded its deadline")
+            return primary.result()
+
+        done, _ = self._wait([primary], self.hedge_after)
+        if done:
+            return primary.result()
+
+        metrics.hedges += 1
+        remaining = deadline - time.monotonic()
+        backup = self._executor.submit(run_in_scope(self._create), remaining, **kwargs)
+        pending = {primary, backup}
+        last_error: Optional[BaseException] = None
+        while pending:
+            done, pending = self._wait(pending, max(0.0, deadline - time.monotonic()))
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    if future is backup:
+                        metrics.hedge_wins += 1
+                    return future.result()
+                last_error = future.exception()
+        if last_error is not None:
+            raise last_error
+        raise TimeoutError("LLM call exceeded its deadline")
+
+    def chat(
+        self,
+        messages: List[Dict[str, str]],
+        endpoint: str = "default",
+        timeout: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        hedge: bool = False,
+        on_delta: Optional[Callable[[str], None]] = None,
+        **kwargs: Any,
+    ) -> Any:
+        """Create a chat completion, returning the raw response object.
+
+        ``on_delta`` is called with each piece of the reply text as it streams in,
+        on a worker thread. Text already handed out can't be taken back, so such a
+        call is never hedged and is not retried once the first piece arrived.
+
+        Raises ``LLMCallError`` once the deadline passes or retries are exhausted,
+        ``CircuitOpenError`` while the upstream is considered down, and
+        ``OperationCancelled`` when the caller's cancellation scope is cancelled.
+        """
+        metrics = self._endpoint(endpoint)
+        metrics.calls += 1
+        if not self.breaker.allow():
+            metrics.rejected += 1
+            raise CircuitOpenError(f"LLM circuit open, rejecting call for {endpoint}")
+
+        streamed: List[str] = []
+        if on_delta is not None:
+            hedge = False
+
+            def forward(delta: str) -> None:
+                streamed.append(delta)
+                on_delta(delta)
+
+            kwargs["on_delta"] = forward
+        kwargs["messages"] = messages
+        retries = self.max_retries if max_retries is None else max_retries
+        start = time.monotonic()
+        deadline = start + (timeout or self.timeout)
+
+        attempt = 0
+        while True:
+            try:
+                raise_if_cancelled()
+                response = self._attempt(metrics, deadline, hedge, kwargs)
+                self.breaker.record_success()
+                metrics.latencies.append(time.monotonic() - start)
+                return response
+            except OperationCancelled:
+                # Says nothing about the upstream's health, but a trial this call held must be
+                # handed back or the breaker would never close again
+                self.breaker.release_trial()
+                metrics.cancelled += 1
+                raise
+            except Exception as e:
+                remaining = deadline - time.monotonic()
+                retryable = is_retryable(e)
+                if retryable:
+                    self.breaker.record_failure()
+                else:
+                    # A client error still proves the upstream is reachable
+                    self.breaker.record_success()
+                if not retryable or streamed or attempt >= retries or remaining <= 0 or not self.breaker.allow():
+                    metrics.errors += 1
+                    metrics.latencies.append(time.monotonic() - start)
+                    logger.error(f"LLM call for {endpoint} failed after {attempt + 1} attempt(s): {e}")
+                    raise LLMCallError(f"LLM call for {endpoint} failed: {e}") from e
+                # Full jitter keeps concurrent retries from synchronising
+                delay = min(remaining, random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))))
+                attempt += 1
+                metrics.retries += 1
+                logger.warning(f"LLM call for {endpoint} failed ({e}), retry {attempt}/{retries} in {delay:.2f}s")
+                wait_cancelled(delay)
+
+    def complete_text(self, messages: List[Dict[str, str]], endpoint: str = "default", **kwargs: Any) -> str:
+        """Convenience wrapper returning the stripped content of the first choice."""
+        response = self.chat(messages, endpoint=endpoint, **kwargs)
+        return (response.choices[0].message.content or "").strip()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._metrics_lock:
+            endpoints = {name: m.snapshot() for name, m in self._metrics.items()}
+        return {"circuit": self.breaker.state, "endpoints": endpoints}
+
+
+class LLMRouter:
+    """Routes named tasks to providers, with fallback when the routed one fails."""
+
+    def __init__(
+        self,
+        clients: Dict[str, LLMClient],
+        routes: Optional[Dict[str, str]] = None,
+        default: str = "openai",
+        fallback: Optional[str] = None,
+    ):
+        if default not in clients:
+            raise ValueError(f"Default provider '{default}' is not configured")
+        self.clients = clients
+        self.routes = dict(routes or {})
+        self.default = default
+        self.fallback = fallback if fallback in clients else None
+
+    @staticmethod
+    def parse_routes(spec: str) -> Dict[str, str]:
+        """Parse ``task=provider,task=provider`` (e.g. from an environment variable)."""
+        routes = {}
+        for item in (spec or "").split(","):
+            if "=" in item:
+                task, provider = item.split("=", 1)
+                routes[task.strip()] = provider.strip()
+        return routes
+
+    def provider_for(self, task: str) -> str:
+        provider = self.routes.get(task, self.default)
+        if provider not in self.clients:
+            logger.warning(f"Route for {task} names unknown provider '{provider}', using {self.default}")
+            return self.default
+        return provider
+
+    def client_for(self, task: str) -> LLMClient:
+        return self.clients[self.provider_for(task)]
+
+    def chat(self, task: str, messages: List[Dict[str, str]], on_delta: Optional[Callable[[str], None]] = None,
+             **kwargs: Any) -> Any:
+        """Run a chat completion for ``task`` on its routed provider (see ``LLMClient.chat`` for ``on_delta``)."""
+        provider = self.provider_for(task)
+        streamed = []
+        if on_delta is not None:
+            def forward(delta: str) -> None:
+                streamed.append(delta)
+                on_delta(delta)
+
+            kwargs["on_delta"] = forward
+        try:
+            return self.clients[provider].chat(messages, endpoint=task, **kwargs)
+        except LLMCallError as e:
+            # A reply that was partly streamed can't be restarted on another provider
+            if not self.fallback or self.fallback == provider or streamed:
+                raise
+            logger.warning(f"{provider} failed for {task} ({e}), falling back to {self.fallback}")
+            return self.clients[self.fallback].chat(messages, endpoint=task, **kwargs)
+
+    def complete_text(self, task: str, messages: List[Dict[str, str]], **kwargs: Any) -> str:
+        response = self.chat(task, messages, **kwargs)
+        return (response.choices[0].message.content or "").strip()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "routes": {task: self.provider_for(task) for task in self.routes},
+            "default": self.default,
+            "fallback": self.fallback,
+            "providers": {name: client.metrics() for name, client in self.clients.items()},
+        }
@@ -0,0 +1,241 @@
+"""
+Provider-agnostic chat completion backends.
+
+Every provider takes OpenAI-style ``messages`` and keyword arguments
+(``temperature``, ``max_tokens``, ``response_format``...) and returns an
+OpenAI-shaped response (``response.choices[0].message.content`` and
+``response.usage``), so call sites and the prompt cache statistics do not
+care which backend served a request.
+
+- ``OpenAIProvider``: the hosted OpenAI API.
+- ``OllamaProvider``: a local model served by Ollama (langchain_ollama).
+- ``StubProvider``: deterministic offline stand-in for tests and demos.
+
+Inside a cancellation scope (see cancellation), or when the caller passes
+``on_delta``, the OpenAI and Ollama providers stream the reply. Each piece of
+text goes to ``on_delta`` as it arrives, and the scope is checked between
+chunks. A cancelled call closes the stream, so the upstream stops generating
+instead of finishing a reply nobody will read.
+"""
+
+import json
+import logging
+import math
+from typing import Any, Callable, Dict, List, Optional
+
+from cancellation import OperationCancelled, current_token, is_cancelled
+
+logger = logging.getLogger(__name__)
+
+try:
+    from langchain_ollama import ChatOllama
+    OLLAMA_AVAILABLE = True
+except ImportError:
+    ChatOllama = None
+    OLLAMA_AVAILABLE = False
+
+
+class ChatMessage:
+    def __init__(self, content: str, role: str = "assistant"):
+        self.role = role
+        self.content = content
+
+
+class ChatChoice:
+    def __init__(self, message: ChatMessage, index: int = 0, finish_reason: str = "stop"):
+        self.message = message
+        self.index = index
+        self.finish_reason = finish_reason
+
+
+class ChatUsage:
+    def __init__(self, prompt_tokens: int = 0, completion_tokens: int = 0):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.total_tokens = prompt_tokens + completion_tokens
+        # Local backends have no provider-side prompt cache
+        self.prompt_tokens_details = None
+
+
+class ChatResponse:
+    """Minimal OpenAI-compatible chat completion response."""
+
+    def __init__(self, content: str, model: str, usage: Optional[ChatUsage] = None):
+        self.model = model
+        self.choices = [ChatChoice(ChatMessage(content))]
+        self.usage = usage or ChatUsage()
+
+    def __repr__(self) -> str:
+        return f"ChatResponse(model={self.model!r}, content={self.choices[0].message.content!r})"
+
+
+class CompletionProvider:
+    """Base class for chat completion backends."""
+
+    name = "base"
+
+    def __init__(self, model: str):
+        self.model = model
+
+    def create(self, messages: List[Dict[str, str]], timeout: Optional[float] = None,
+               on_delta: Optional[Callable[[str], None]] = None, **kwargs: Any) -> Any:
+        raise NotImplementedError
+
+
+class OpenAIProvider(CompletionProvider):
+    name = "openai"
+
+    def __init__(self, client: Any, model: str):
+        super().__init__(model)
+        self.client = client
+
+    def create(self, messages: List[Dict[str, str]], timeout: Optional[float] = None,
+               on_delta: Optional[Callable[[str], None]] = None, **kwargs: Any) -> Any:
+        client = self.client
+        if timeout is not None and hasattr(client, "with_options"):
+            # The SDK's own retries would overrun the caller's deadline
+            client = client.with_options(timeout=timeout, max_retries=0)
+        kwargs.setdefault("model", self.model)
+        if (current_token() is None and on_delta is None) or "stream" in kwargs:
+            return client.chat.completions.create(messages=messages, **kwargs)
+        stream = client.chat.completions.create(
+            messages=messages, stream=True, stream_options={"include_usage": True}, **kwargs
+        )
+        return self._collect(stream, kwargs["model"], on_delta)
+
+    @staticmethod
+    def _collect(stream: Any, model: str, on_delta: Optional[Callable[[str], None]] = None) -> ChatResponse:
+        """Join a streamed completion, closing the connection as soon as the scope is cancelled."""
+        parts: List[str] = []
+        usage = None
+        finish_reason = "stop"
+        try:
+            for chunk in stream:
+                if is_cancelled():
+                    raise OperationCancelled("LLM call cancelled")
+                model = getattr(chunk, "model", None) or model
+                # The last chunk carries the usage, prompt cache details included, and no choices
+                usage = getattr(chunk, "usage", None) or usage
+                if chunk.choices:
+                    delta = chunk.choices[0].delta.content or ""
+                    parts.append(delta)
+                    if delta and on_delta is not None:
+                        on_delta(delta)
+                    finish_reason = chunk.choices[0].finish_reason or finish_reason
+        finally:
+            stream.close()
+        response = ChatResponse("".join(parts), model, usage)
+        response.choices[0].finish_reason = finish_reason
+        return response
+
+
+class OllamaProvider(CompletionProvider):
+    """Local inference through an Ollama server."""
+
+    name = "ollama"
+
+    def __init__(self, model: str, base_url: Optional[str] = None):
+        super().__init__(model)
+        self.base_url = base_url
+        self._models: Dict[tuple, Any] = {}
+
+    def _chat_model(self, temperature: float, max_tokens: Optional[int], output_format: Any, timeout: Optional[float]) -> Any:
+        if not OLLAMA_AVAILABLE:
+            raise RuntimeError("langchain_ollama is not installed")
+        # Callers pass the time left before their deadline; whole seconds keep the cache small
+        timeout = float(math.ceil(timeout)) if timeout else None
+        key = (temperature, max_tokens, json.dumps(output_format, sort_keys=True) if output_format else None, timeout)
+        chat_model = self._models.get(key)
+        if chat_model is None:
+            options: Dict[str, Any] = {"model": self.model, "temperature": temperature}
+            if self.base_url:
+                options["base_url"] = self.base_url
+            if max_tokens:
+                options["num_predict"] = max_tokens
+            if output_format:
+                options["format"] = output_format
+            if timeout:
+                options["client_kwargs"] = {"timeout": timeout}
+            chat_model = ChatOllama(**options)
+            self._models[key] = chat_model
+        return chat_model
+
+    @staticmethod
+    def _output_format(response_format: Any) -> Any:
+        """Translate an OpenAI ``response_format`` into Ollama's ``format``."""
+        if not isinstance(response_format, dict):
+            return None
+        if response_format.get("type") == "json_schema":
+            return response_format.get("json_schema", {}).get("schema") or "json"
+        if response_format.get("type") == "json_object":
+            return "json"
+        return None
+
+    def create(self, messages: List[Dict[str, str]], timeout: Optional[float] = None,
+               on_delta: Optional[Callable[[str], None]] = None, **kwargs: Any) -> Any:
+        chat_model = self._chat_model(
+            kwargs.get("temperature", 0.1),
+            kwargs.get("max_tokens"),
+            self._output_format(kwargs.get("response_format")),
+            timeout,
+        )
+        prompt = [(m["role"], m["content"]) for m in messages]
+        stop = kwargs.get("stop")
+        if current_token() is None and on_delta is None:
+            result = chat_model.invoke(prompt, stop=stop)
+        else:
+            result = None
+            chunks = chat_model.stream(prompt, stop=stop)
+            try:
+                for chunk in chunks:
+                    if is_cancelled():
+                        # Closing the generator drops the connection, which stops generation in Ollama
+                        raise OperationCancelled("LLM call cancelled")
+                    result = chunk if result is None else result + chunk
+                    if chunk.content and on_delta is not None:
+                        on_delta(str(chunk.content))
+            finally:
+                chunks.close()
+        usage_metadata = getattr(result, "usage_metadata", None) or {}
+        usage = ChatUsage(usage_metadata.get("input_tokens", 0), usage_metadata.get("output_tokens", 0))
+        return ChatResponse(str(result.content) if result is not None else "", self.model, usage)
+
+
+class StubProvider(CompletionProvider):
+    """Offline stand-in that never touches the network.
+
+    ``responder`` maps the messages to a reply; by default JSON-style prompts
+    get ``{}`` and yes/no classifications get ``NO``.
+    """
+
+    name = "stub"
+
+    def __init__(self, model: str = "stub", responder: Optional[Callable[[List[Dict[str, str]]], str]] = None):
+        super().__init__(model)
+        self.responder = responder or self.default_response
+        self.calls: List[List[Dict[str, str]]] = []
+
+    @staticmethod
+    def default_response(messages: List[Dict[str, str]]) -> str:
+        prompt = "\n".join(m.get("content", "") for m in messages)
+        if '"YES"' in prompt and '"NO"' in prompt:
+            return "NO"
+        if "JSON" in prompt or "json" in prompt:
+            return "{}"
+        return "I'm running in offline mode and can't answer that right now."
+
+    def create(self, messages: List[Dict[str, str]], timeout: Optional[float] = None,
+               on_delta: Optional[Callable[[str], None]] = None, **kwargs: Any) -> Any:
+        self.calls.append(messages)
+        content = self.responder(messages)
+        if on_delta is not None and content:
+            on_delta(content)
+        prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4
+        return ChatResponse(content, self.model, ChatUsage(prompt_tokens, len(content) // 4))
+
+
+def as_provider(client: Any, model: str) -> CompletionProvider:
+    """Wrap a raw OpenAI-style client so it can be used as a provider."""
+    if isinstance(client, CompletionProvider):
+        return client
+    return OpenAIProvider(client, model)
@@ -0,0 +1,294 @@
+"""
+Transactional user profile store.
+
+user_info used to live in a single JSON file that was re-read, updated and
+rewritten in full on every change, losing updates when requests overlapped.
+Profiles now live in an embedded SQLite key/value table: every changed key
+is upserted inside one transaction, concurrent writers are group-committed
+into a single transaction, and reads are served from an in-memory copy that
+is loaded once. An existing user_info.json is imported on first use.
+
+Profiles are keyed by a patient or session id, so concurrent patients never
+share a record. Recently used profiles stay in an LRU cache; with a
+write-behind interval, updates are applied to the cache immediately and
+persisted by a background flusher (and on shutdown).
+"""
+
+import atexit
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROFILE = "default"
+MAX_CACHED_PROFILES = 256
+
+_PROFILE_ID_PATTERN = re.compile(r'^[A-Za-z0-9_.@:-]{1,128}$')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profile_fields (
+    profile_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (profile_id, key)
+)
+"""
+
+
+def normalize_profile_id(profile_id: Optional[str]) -> str:
+    """Return a safe profile id, or the default profile when none is given."""
+    profile_id = (profile_id or "").strip()
+    if not profile_id:
+        return DEFAULT_PROFILE
+    if not _PROFILE_ID_PATTERN.match(profile_id):
+        raise ValueError(f"Invalid profile id: {profile_id!r}")
+    return profile_id
+
+
+class ProfileStore:
+    """SQLite-backed key/value profiles with a read cache and batched writes."""
+
+    def __init__(
+        self,
+        db_path: str,
+        legacy_json: Optional[str] = None,
+        mirror_json: bool = False,
+        max_cached_profiles: int = MAX_CACHED_PROFILES,
+        write_behind_seconds: float = 0.0,
+    ):
+        self.db_path = db_path
+        self.legacy_json = legacy_json
+        # Keep rewriting the legacy JSON file for readers that still open it directly
+        self.mirror_json = mirror_json and bool(legacy_json)
+        self.max_cached_profiles = max_cached_profiles
+        # 0 writes through on every update; otherwise a background thread flushes at this interval
+        self.write_behind_seconds = write_behind_seconds
+
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(SCHEMA)
+
+        self._lock = threading.Lock()          # guards the cache and pending writes
+        self._write_lock = threading.Lock()    # serializes use of the connection
+        self._flush_lock = threading.Lock()    # one group commit at a time
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._flusher: Optional[threading.Thread] = None
+        self._closed = False
+
+        self._import_legacy_json()
+        atexit.register(self.close)
+
+    def _import_legacy_json(self) -> None:
+        """Import user_info.json into the default profile the first time the store is opened."""
+        if not self.legacy_json or not os.path.exists(self.legacy_json):
+            return
+        with self._write_lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM profile_fields WHERE profile_id = ? LIMIT 1", (DEFAULT_PROFILE,)
+            ).fetchone()
+        if row:
+            return
+        try:
+            with open(self.legacy_json, "r") as f:
+                legacy = json.load(f)
+        except Exception as e:
+            logger.error(f"Could not import {self.legacy_json} into profile store: {e}")
+            return
+        if isinstance(legacy, dict) and legacy:
+            self._write({DEFAULT_PROFILE: legacy})
+            logger.info(f"Imported {len(legacy)} fields from {self.legacy_json} into {self.db_path}")
+
+    def _read_profile(self, profile_id: str) -> Dict[str, Any]:
+        with self._write_lock:
+            rows = self._conn.execute(
+                "SELECT key, value FROM profile_fields WHERE profile_id = ? ORDER BY rowid", (profile_id,)
+            ).fetchall()
+        profile = {}
+        for key, value in rows:
+            try:
+                profile[key] = json.loads(value)
+            except ValueError:
+                profile[key] = value
+        return profile
+
+    def _cached(self, profile_id: str) -> Dict[str, Any]:
+        """Return the cached profile, loading it from disk on a miss."""
+        with self._lock:
+            profile = self._cache.get(profile_id)
+            if profile is not None:
+                self._cache.move_to_end(profile_id)
+                return profile
+
+        # Read outside the cache lock so a cold profile doesn't stall other patients
+        loaded = self._read_profile(profile_id)
+        with self._lock:
+            profile = self._cache.get(profile_id)
+            if profile is None:
+                profile = loaded
+                # Unflushed writes are newer than what is on disk
+                profile.update(self._pending.get(profile_id, {}))
+                self._cache[profile_id] = profile
+            self._cache.move_to_end(profile_id)
+            self._evict()
+            return profile
+
+    def _evict(self) -> None:
+        """Drop least recently used profiles that have nothing left to flush. Caller holds ``_lock``."""
+        excess = len(self._cache) - self.max_cached_profiles
+        if excess <= 0:
+            return
+        # The most recently used entry is the one being returned, so it is never evicted
+        for profile_id in list(self._cache)[:-1]:
+            if excess <= 0:
+                break
+            if profile_id not in self._pending:
+                del self._cache[profile_id]
+                excess -= 1
+
+    def _write(self, batch: Dict[str, Dict[str, Any]]) -> None:
+        """Upsert every changed key of every profile in one transaction."""
+        now = time.time()
+        rows = [
+            (profile_id, key, json.dumps(value), now)
+            for profile_id, fields in batch.items()
+            for key, value in fields.items()
+        ]
+        if not rows:
+            return
+        with self._write_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO profile_fields (profile_id, key, value, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(profile_id, key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+                    rows,
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def flush(self) -> None:
+        """Write all pending changes.
+
+        Writers that arrive while another flush is running find their changes
+        already taken by it, so overlapping updates share one transaction.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return
+            try:
+                self._write(batch)
+            except Exception as e:
+                logger.error(f"Error writing profile store {self.db_path}: {e}")
+                with self._lock:
+                    # Put the batch back underneath anything written since
+                    for profile_id, fields in batch.items():
+                        self._pending[profile_id] = {**fields, **self._pending.get(profile_id, {})}
+                raise
+            with self._lock:
+                # Profiles held back from eviction by pending writes can go now
+                self._evict()
+            if self.mirror_json and DEFAULT_PROFILE in batch:
+                self.export_json(self.legacy_json)
+
+    def load(self, profile_id: str = DEFAULT_PROFILE) -> Dict[str, Any]:
+        """Return a copy of the profile."""
+        profile = self._cached(profile_id)
+        with self._lock:
+            return dict(profile)
+
+    def update(self, new_info: Dict[str, Any], profile_id: str = DEFAULT_PROFILE, sync: bool = False) -> None:
+        """Upsert only the keys in ``new_info``.
+
+        Durable when this returns unless write-behind is enabled and ``sync``
+        is False, in which case the background flusher persists it shortly.
+        """
+        if not new_info:
+            return
+        profile = self._cached(profile_id)
+        with self._lock:
+            profile.update(new_info)
+            self._pending.setdefault(profile_id, {}).update(new_info)
+        if sync or self.write_behind_seconds <= 0:
+            self.flush()
+        else:
+            self._ensure_flusher()
+
+    def _ensure_flusher(self) -> None:
+        with self._lock:
+            if self._flusher is not None and self._flusher.is_alive():
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name="profile-store-flusher", daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self) -> None:
+        while not self._closed:
+            time.sleep(self.write_behind_seconds)
+            try:
+                self.flush()
+            except Exception:
+                # Already logged; the batch stays pending for the next round
+                pass
+            with self._lock:
+                if not self._pending:
+                    self._flusher = None
+                    return
+
+    def evict(self, profile_id: str) -> None:
+        """Flush and drop a profile from memory, e.g. when its session ends."""
+        self.flush()
+        with self._lock:
+            self._cache.pop(profile_id, None)
+
+    def export_json(self, json_file: str, profile_id: str = DEFAULT_PROFILE) -> None:
+        """Write a profile out in the legacy user_info.json format."""
+        profile = self.load(profile_id)
+        tmp_file = f"{json_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(profile, f, indent=4)
+        os.replace(tmp_file, json_file)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.flush()
+        except Exception:
+            pass
+        with self._write_lock:
+            self._conn.close()
+
+
+_stores: Dict[str, ProfileStore] = {}
+_stores_lock = threading.Lock()
+
+
+def profile_store_for(json_file: str, mirror_json: bool = False, write_behind_seconds: float = 0.0) -> ProfileStore:
+    """Return the store that replaces ``json_file`` (``user_info.json`` -> ``user_info.db``)."""
+    path = os.path.abspath(json_file)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = ProfileStore(
+                os.path.splitext(path)[0] + ".db",
+                legacy_json=path,
+                mirror_json=mirror_json,
+                write_behind_seconds=write_behind_seconds,
+            )
+            _stores[path] = store
+        return store
@@ -0,0 +1,138 @@
+"""
+Prompt templates for the Quill RAG API.
+
+Providers cache the longest previously-seen prompt prefix, so every template
+keeps its static instructions first (as the system message) and interpolates
+the per-request data last (as the user message). Templates are versioned so
+that a wording change is visible in the cache statistics instead of silently
+resetting the hit rate.
+"""
+
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class PromptTemplate:
+    """A static instruction block followed by named variable sections."""
+
+    def __init__(
+        self,
+        name: str,
+        version: str,
+        instructions: str,
+        sections: List[Tuple[str, str]],
+        trailer: str = "",
+    ):
+        self.name = name
+        self.version = version
+        self.instructions = instructions
+        # (header, variable name) pairs rendered in order after the instructions
+        self.sections = sections
+        self.trailer = trailer
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}@{self.version}"
+
+    def render(self, **values: Any) -> List[Dict[str, str]]:
+        """Return chat messages with the cacheable prefix first."""
+        missing = [var for _, var in self.sections if var not in values]
+        if missing:
+            raise KeyError(f"Prompt template '{self.key}' is missing values for: {missing}")
+
+        parts = []
+        for header, var in self.sections:
+            value = values[var]
+            if value is None:
+                value = ""
+            parts.append(f"{header}:\n{value}" if header else str(value))
+        if self.trailer:
+            parts.append(self.trailer)
+
+        return [
+            {"role": "system", "content": self.instructions},
+            {"role": "user", "content": "\n\n".join(parts)},
+        ]
+
+
+class PromptCacheStats:
+    """Per-template counters of prompt tokens and provider-cached prompt tokens."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def record(self, template_key: str, usage: Any) -> None:
+        """Record the ``usage`` block of a chat completion response."""
+        if usage is None:
+            return
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", 0) or 0
+
+        with self._lock:
+            entry = self._stats.setdefault(
+                template_key, {"calls": 0, "cache_hits": 0, "prompt_tokens": 0, "cached_tokens": 0}
+            )
+            entry["calls"] += 1
+            entry["prompt_tokens"] += prompt_tokens
+            entry["cached_tokens"] += cached_tokens
+            if cached_tokens:
+                entry["cache_hits"] += 1
+
+        logger.debug(f"Prompt cache usage for {template_key}: {cached_tokens}/{prompt_tokens} cached tokens")
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Return a copy of the counters with hit rates filled in."""
+        with self._lock:
+            result = {}
+            for key, entry in self._stats.items():
+                result[key] = dict(entry)
+                result[key]["hit_rate"] = entry["cache_hits"] / entry["calls"] if entry["calls"] else 0.0
+                result[key]["cached_token_ratio"] = (
+                    entry["cached_tokens"] / entry["prompt_tokens"] if entry["prompt_tokens"] else 0.0
+                )
+            return result
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+prompt_cache_stats = PromptCacheStats()
+
+_REGISTRY: Dict[str, PromptTemplate] = {}
+
+
+def register_template(template: PromptTemplate) -> PromptTemplate:
+    """Register a template, replacing any previous version with the same name."""
+    previous = _REGISTRY.get(template.name)
+    if previous and previous.version != template.version:
+        logger.info(f"Prompt template '{template.name}' upgraded from {previous.version} to {template.version}")
+    _REGISTRY[template.name] = template
+    return template
+
+
+def get_template(name: str) -> PromptTemplate:
+    if name not in _REGISTRY:
+        raise KeyError(f"Unknown prompt template: {name}")
+    return _REGISTRY[name]
+
+
+def list_templates() -> Dict[str, str]:
+    """Map template names to their current versions."""
+    return {name: template.version for name, template in _REGISTRY.items()}
+
+
+def render_prompt(name: str, **values: Any) -> Tuple[str, List[Dict[str, str]]]:
+    """Render a registered template, returning its versioned key and messages."""
+    template = get_template(name)
+    return template.key, template.render(**values)
+
+
+def record_usage(template_key: str, response: Optional[Any]) -> None:
+    """Record cache statistics from a chat completion response."""
+    prompt_cache_stats.record(template_key, getattr(response, "usage", None))
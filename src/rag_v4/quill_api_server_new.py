@@ -17,13 +17,17 @@ from PIL import Image
 from pdf2image import convert_from_path
 #from unstructured.partition.pdf import partition_pdf
 import numpy as np
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks, WebSocket, WebSocketDisconnect, Header
 from fastapi.middleware.cors import CORSMiddleware
 from typing import Optional, List, Dict, Any, Union
 from pydantic import BaseModel
 import uvicorn
 from typing import Optional, Dict, List, Any
 import base64
+import io
+import asyncio
+import threading
+import time
 from dotenv import load_dotenv
 from openai import OpenAI
 from starlette.websockets import WebSocketState
@@ -39,19 +43,40 @@ from openai.types.chat.completion_create_params import ResponseFormat
 import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from mock_ehr.ehr_api import router as ehr_router
+from mock_ehr.ehr_api import router as ehr_router, add_submission_listener
 from mock_ehr.supabase_manager import SupabaseManager
 from mock_ehr.patient_queries import PatientDataQuery
 
+# Sibling modules of this server
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from prompt_templates import PromptTemplate, register_template, render_prompt, record_usage, prompt_cache_stats, list_templates
+from context_budget import ContextCompactor, ConversationContext
+from user_info_projection import project_user_info
+from llm_client import LLMClient, LLMCallError, LLMRouter
+from llm_providers import OpenAIProvider, OllamaProvider, StubProvider
+from profile_store import profile_store_for, normalize_profile_id, DEFAULT_PROFILE
+from field_ontology import merge_profiles, extract_labelled_fields
+from extraction_ledger import ExtractionLedger, document_units, conversation_units
+from filled_forms_store import FilledFormsStore
+from form_state import FormState, FormStateStore, FormVersionConflict, form_field_keys, project_form_fields
+from template_registry import TemplateRegistry, LAYOUT_DPI, content_hash, layout_hash, pdf_text
+from form_fingerprint import get_layout_index, layout_fingerprint
+from voice_stream import AudioStreamer, SpeechPipeline, collect_audio, speech_sentences, strip_boilerplate, wants_stream
+from asr_stream import StreamingTranscriber, is_usable_transcript
+from audio_preprocess import prepare_for_stt
+from voice_gateway import VoiceGateway, VoiceGatewayBusy, VoiceSession
+
 load_dotenv()
 
 # Use quick/cheap model that works with Structured Outputs
 OPENAI_MODEL_NAME = "gpt-4.1-nano"
 OPENAI_EMBEDDING_MODEL = "text-embedding-3-small"
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
+# Offline mode serves every completion from the local stub provider (tests, demos)
+LLM_OFFLINE = os.getenv("LLM_OFFLINE", "").lower() in ("1", "true", "yes")
+if not OPENAI_API_KEY and not LLM_OFFLINE:
     raise ValueError("OPENAI_API_KEY environment variable not set. Please set it to your OpenAI API key.")
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
+openai_client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
 
 Image.MAX_IMAGE_PIXELS = None  # Disable image size limit
 
@@ -65,74 +90,79 @@ logging.basicConfig(
 VECTOR_DB_DIR = "vector_db"       # Base directory for persisting vector DBs
 MODEL_NAME = "llama3.2-vision:11b"
 EMBEDDING_MODEL = "nomic-embed-text"
+# Local model for cheap, high-volume tasks such as classification and merging
+LOCAL_LLM_MODEL = os.getenv("LOCAL_LLM_MODEL", MODEL_NAME)
+
+# Tasks served by the local model; everything else goes to the hosted model.
+# Extend or override with LLM_ROUTES="task=provider,..." (providers: openai, local, stub)
+DEFAULT_LLM_ROUTES = {
+    "classify_update_request": "local",
+    "merge_user_info": "local",
+}
+
+# Deadlines, retries, hedging and circuit breaking for chat completions, per provider
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+llm_clients = {
+    "local": LLMClient(
+        OllamaProvider(LOCAL_LLM_MODEL, os.getenv("OLLAMA_BASE_URL")),
+        timeout=LLM_TIMEOUT_SECONDS,
+        max_retries=1,
+        hedge_after=None,
+    ),
+    "stub": LLMClient(StubProvider(), hedge_after=None),
+}
+if openai_client is not None:
+    llm_clients["openai"] = LLMClient(
+        OpenAIProvider(openai_client, OPENAI_MODEL_NAME),
+        timeout=LLM_TIMEOUT_SECONDS,
+        max_retries=LLM_MAX_RETRIES,
+        hedge_after=float(os.getenv("LLM_HEDGE_AFTER_SECONDS", "2.5")),
+    )
+
+if LLM_OFFLINE:
+    llm_router = LLMRouter(llm_clients, default="stub")
+else:
+    llm_router = LLMRouter(
+        llm_clients,
+        routes={**DEFAULT_LLM_ROUTES, **LLMRouter.parse_routes(os.getenv("LLM_ROUTES", ""))},
+        default="openai",
+        # Local inference is optional; fall back to the hosted model when it is down
+        fallback="openai",
+    )
 # USER_INFO_JSON = "../../uploads/user_info.json"
 USER_INFO_JSON = os.path.join('..', 'uploads', 'user_info.json')
+# user_info now lives in user_info.db next to it; the JSON file is imported once and,
+# when this is set, kept up to date for tools that still read it directly
+USER_INFO_JSON_MIRROR = os.getenv("USER_INFO_JSON_MIRROR", "").lower() in ("1", "true", "yes")
+# Profile updates are persisted in the background at this interval (0 = write through)
+PROFILE_WRITE_BEHIND_SECONDS = float(os.getenv("PROFILE_WRITE_BEHIND_SECONDS", "0.5"))
 # UPLOADS_DIR = "/../uploads"
 UPLOADS_DIR = os.path.join('..', 'uploads')
+# Content hashes of document pages / conversation turns already sent to extraction
+EXTRACTION_LEDGER_DB = os.path.join(UPLOADS_DIR, 'extraction_ledger.db')
+# Schemas of form templates already extracted, keyed by content and layout fingerprints
+TEMPLATE_REGISTRY_DB = os.path.join(UPLOADS_DIR, 'form_templates.db')
+# When set, /admin endpoints require this value in the X-Admin-Token header
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+# Sentences of one streamed voice reply synthesized concurrently
+VOICE_TTS_PARALLELISM = int(os.getenv("VOICE_TTS_PARALLELISM", "3"))
+# Threads running blocking STT/LLM/TTS calls for all voice sessions together
+VOICE_WORKERS = int(os.getenv("VOICE_WORKERS", "16"))
+# Utterances a session may queue behind the one being answered
+VOICE_MAX_PENDING = int(os.getenv("VOICE_MAX_PENDING", "2"))
 
 # Directory where the frontend saves submitted forms as JSON
 FILLED_FORMS_DIR = os.path.join('..', 'mockups', 'frontend2', 'temp', 'filled-forms')
+# Compact per-submission index so startup doesn't parse every submission
+FILLED_FORMS_MANIFEST = os.path.join(UPLOADS_DIR, 'filled_forms_manifest.json')
 
-def load_filled_forms(directory: str) -> List[Dict[str, Any]]:
-    forms: List[Dict[str, Any]] = []
-    if not os.path.isdir(directory):
-        logging.warning(f"Filled forms directory not found: {directory}")
-        return forms
-
-    for filename in os.listdir(directory):
-        if not filename.endswith('.json'):
-            continue
-        path = os.path.join(directory, filename)
-        try:
-            with open(path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-        except Exception as e:
-            logging.error(f"Failed to load form submission '{filename}': {e}")
-            continue
-
-        # Extract answers (non-empty values only)
-        answers: Dict[str, Any] = {}
-        if isinstance(data.get('formValues'), dict):
-            for k, v in data['formValues'].items():
-                if v not in (None, ""):
-                    answers[k] = v
-        else:
-            for field in data.get('fields', []):
-                val = field.get('value')
-                if val not in (None, ""):
-                    answers[field.get('label') or field.get('id')] = val
-
-        if not answers:
-            continue  # Ignore completely empty submissions
-
-        forms.append({
-            'id': data.get('id'),
-            'templateName': data.get('templateName'),
-            'submittedAt': data.get('submittedAt'),
-            'answers': answers
-        })
+# Indexed by patient and re-scanned in the background, so new submissions are visible without a restart
+filled_forms_store = FilledFormsStore(FILLED_FORMS_DIR, manifest_path=FILLED_FORMS_MANIFEST)
 
-    logging.info(f"Loaded {len(forms)} filled form submissions from '{directory}'.")
-    return forms
 
-
-# Cache loaded forms at startup so we don't hit the filesystem on every request
-FILLED_FORMS_DATA: List[Dict[str, Any]] = load_filled_forms(FILLED_FORMS_DIR)
-
-
-def get_forms_for_patient(patient_name: str, forms_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    if not patient_name:
-        return []
-    name_lower = patient_name.lower()
-    relevant = []
-    for form in forms_data:
-        try:
-            if any(name_lower in str(v).lower() for v in form['answers'].values()):
-                relevant.append(form)
-        except Exception:
-            # Defensive – skip malformed form entries
-            continue
-    return relevant
+def get_forms_for_patient(patient_name: str) -> List[Dict[str, Any]]:
+    return filled_forms_store.forms_for_patient(patient_name)
 
 # Initialize FastAPI app
 app = FastAPI(title="Quill RAG API", description="API for Quill RAG functionality")
@@ -148,6 +178,8 @@ app.add_middleware(
 
 # Include EHR router
 app.include_router(ehr_router)
+# Forms submitted through the EHR router are indexed as soon as they are accepted
+add_submission_listener(filled_forms_store.add)
 
 # Pydantic models for API
 class QueryRequest(BaseModel):
@@ -161,10 +193,15 @@ class UpdateRequest(BaseModel):
     documentName: Optional[str] = None
 
 class FormValuesRequest(BaseModel):
-    values: List[Dict[str, Any]]
+    # Full snapshot of the form values
+    values: Optional[List[Dict[str, Any]]] = None
+    # Or a delta against the server's form state: {"version": n, "set": [...], "remove": [...]}
+    delta: Optional[Dict[str, Any]] = None
+    sessionId: Optional[str] = None
 
 class UserInfoRequest(BaseModel):
     info: Dict[str, Any]
+    profileId: Optional[str] = None
 
 ## Helper Functions
 
@@ -318,9 +355,9 @@ def process_camera_image_for_form_structure(image_bytes):
         logging.info(f"Processing blank form structure with GPT")
 
         # Use GPT-4o nano for processing
-        response = openai_client.chat.completions.create(
-            model=OPENAI_MODEL_NAME,
-            messages=[
+        response = llm_router.chat(
+            "camera_form_structure",
+            [
                 {"role": "user", "content": prompt}
             ],
             temperature=0.1,
@@ -479,36 +516,72 @@ def split_documents(documents):
     logging.info(f"Documents split into {len(chunks)} chunks.")
     return chunks
 
+CONVERSATION_EXTRACTION_TEMPLATE = register_template(PromptTemplate(
+    name="extract_conversation_info",
+    version="2",
+    instructions=(
+        "You are a medical administrative assistant helping to extract patient information from conversations. Your role is to identify and organize patient information in a clear, structured way.\n\n"
+        "TASK: Extract ALL patient information mentioned in this conversation as a clean JSON object with key-value pairs.\n\n"
+        "GUIDELINES:\n"
+        "- Identify information shared in natural language (e.g., 'My name is John' → {'name': 'John'})\n"
+        "- Look for medical and personal details like:\n"
+        "  * Personal info: name, date of birth, contact details\n"
+        "  * Insurance info: provider, policy number, group number\n"
+        "  * Medical info: conditions, allergies, medications\n"
+        "  * Family history: relevant medical conditions\n"
+        "- Use normalized key names in camelCase format (e.g., 'phoneNumber' not 'phone_number')\n"
+        "- For complex values, combine relevant information (e.g., '123 Main St, Boston MA' → {'address': '123 Main St, Boston MA'})\n"
+        "- Only extract information actually provided by the patient, not hypothetical or example text\n"
+        "- Exclude pleasantries, questions, and non-informational content\n"
+        "- If the same information is mentioned multiple times, use the most recent or complete version\n\n"
+        "EXAMPLES:\n"
+        "1. 'Hi, I'm John Smith and I'm 45 years old' → {'name': 'John Smith', 'age': 45}\n"
+        "2. 'My insurance is Blue Cross, policy number 123-456-789' → {'insuranceProvider': 'Blue Cross', 'insurancePolicyNumber': '123-456-789'}\n"
+        "3. 'I have allergies to penicillin and seasonal allergies' → {'allergies': ['penicillin', 'seasonal']}\n"
+        "4. 'I take 10mg of Lisinopril daily for blood pressure' → {'medications': [{'name': 'Lisinopril', 'dosage': '10mg', 'frequency': 'daily', 'purpose': 'blood pressure'}]}\n\n"
+        "IMPORTANT: Do NOT include any data from these examples. Only extract information from the CONVERSATION TEXT."
+    ),
+    sections=[("CONVERSATION TEXT", "text")],
+    trailer="OUTPUT (JSON only):",
+))
+
+DOCUMENT_EXTRACTION_TEMPLATE = register_template(PromptTemplate(
+    name="extract_document_info",
+    version="2",
+    instructions=(
+        "You are a medical administrative assistant processing patient documents. Your task is to extract and organize patient information into a structured format.\n\n"
+        "TASK: Extract ALL relevant patient information into a FLAT (non-nested) JSON object with simple key-value pairs.\n\n"
+        "GUIDELINES:\n"
+        "- Create a SINGLE-LEVEL JSON only - NO nested objects or arrays\n"
+        "- For structured or hierarchical data, flatten using combined keys:\n"
+        "  INSTEAD OF: {'address': {'street': '123 Main', 'city': 'Austin'}} \n"
+        "  USE: {'addressStreet': '123 Main', 'addressCity': 'Austin'}\n"
+        "- Extract all patient information:\n"
+        "  * Personal details (name, DOB, contact info)\n"
+        "  * Insurance information (provider, policy numbers)\n"
+        "  * Medical information (conditions, allergies, medications)\n"
+        "  * Family medical history\n"
+        "- Standardize all key names to camelCase format\n"
+        "- Ensure keys are specific and self-explanatory (e.g., 'primaryPhoneNumber' vs 'phone')\n"
+        "- Preserve the original values exactly as they appear - don't normalize values\n"
+        "- EXCLUDE metadata, schema information, vector embeddings, or system fields\n"
+        "- EXCLUDE empty fields, placeholder text, or fields without clear values\n"
+        "- If identical information appears multiple times, use the most recent or complete version\n\n"
+        "EXAMPLES OF PROPER FLATTENING:\n"
+        "1. {'patient': {'name': 'John', 'contact': {'email': 'j@example.com'}}} → {'patientName': 'John', 'patientContactEmail': 'j@example.com'}\n"
+        "2. {'medications': [{'name': 'Lisinopril', 'dosage': '10mg'}]} → {'medicationName': 'Lisinopril', 'medicationDosage': '10mg'}"
+    ),
+    sections=[("DATABASE CONTENT", "text")],
+    trailer="OUTPUT (FLAT JSON ONLY, NO OTHER TEXT):",
+))
+
 def extract_key_value_info(chunks, text, llm):
     """Extract key-value pairs from document chunks or text using enhanced prompts."""
     try:
         if text is not None:
             full_text = text
             logging.info(f'Full text for extraction: {full_text}')
-            prompt = (
-                "You are a medical administrative assistant helping to extract patient information from conversations. Your role is to identify and organize patient information in a clear, structured way.\n\n"
-                "TASK: Extract ALL patient information mentioned in this conversation as a clean JSON object with key-value pairs.\n\n"
-                "GUIDELINES:\n"
-                "- Identify information shared in natural language (e.g., 'My name is John' → {'name': 'John'})\n"
-                "- Look for medical and personal details like:\n"
-                "  * Personal info: name, date of birth, contact details\n"
-                "  * Insurance info: provider, policy number, group number\n"
-                "  * Medical info: conditions, allergies, medications\n"
-                "  * Family history: relevant medical conditions\n"
-                "- Use normalized key names in camelCase format (e.g., 'phoneNumber' not 'phone_number')\n"
-                "- For complex values, combine relevant information (e.g., '123 Main St, Boston MA' → {'address': '123 Main St, Boston MA'})\n"
-                "- Only extract information actually provided by the patient, not hypothetical or example text\n"
-                "- Exclude pleasantries, questions, and non-informational content\n"
-                "- If the same information is mentioned multiple times, use the most recent or complete version\n\n"
-                "EXAMPLES:\n"
-                "1. 'Hi, I'm John Smith and I'm 45 years old' → {'name': 'John Smith', 'age': 45}\n"
-                "2. 'My insurance is Blue Cross, policy number 123-456-789' → {'insuranceProvider': 'Blue Cross', 'insurancePolicyNumber': '123-456-789'}\n"
-                "3. 'I have allergies to penicillin and seasonal allergies' → {'allergies': ['penicillin', 'seasonal']}\n"
-                "4. 'I take 10mg of Lisinopril daily for blood pressure' → {'medications': [{'name': 'Lisinopril', 'dosage': '10mg', 'frequency': 'daily', 'purpose': 'blood pressure'}]}\n\n"
-                "IMPORTANT: Do NOT include any data from these examples. Only extract information from the CONVERSATION TEXT."
-                f"CONVERSATION TEXT:\n{full_text}\n\n"
-                "OUTPUT (JSON only):"
-            )
+            template_key, messages = render_prompt(CONVERSATION_EXTRACTION_TEMPLATE.name, text=full_text)
         else:
             logging.info("Extracting key-value pairs from document chunks")
             if not chunks:
@@ -517,46 +590,21 @@ def extract_key_value_info(chunks, text, llm):
 
             full_text = " ".join([chunk.page_content for chunk in chunks])
             logging.info(f'Full text for extraction: {full_text}')
-            prompt = (
-                "You are a medical administrative assistant processing patient documents. Your task is to extract and organize patient information into a structured format.\n\n"
-                "TASK: Extract ALL relevant patient information into a FLAT (non-nested) JSON object with simple key-value pairs.\n\n"
-                "GUIDELINES:\n"
-                "- Create a SINGLE-LEVEL JSON only - NO nested objects or arrays\n"
-                "- For structured or hierarchical data, flatten using combined keys:\n"
-                "  INSTEAD OF: {'address': {'street': '123 Main', 'city': 'Austin'}} \n"
-                "  USE: {'addressStreet': '123 Main', 'addressCity': 'Austin'}\n"
-                "- Extract all patient information:\n"
-                "  * Personal details (name, DOB, contact info)\n"
-                "  * Insurance information (provider, policy numbers)\n"
-                "  * Medical information (conditions, allergies, medications)\n"
-                "  * Family medical history\n"
-                "- Standardize all key names to camelCase format\n"
-                "- Ensure keys are specific and self-explanatory (e.g., 'primaryPhoneNumber' vs 'phone')\n"
-                "- Preserve the original values exactly as they appear - don't normalize values\n"
-                "- EXCLUDE metadata, schema information, vector embeddings, or system fields\n"
-                "- EXCLUDE empty fields, placeholder text, or fields without clear values\n"
-                "- If identical information appears multiple times, use the most recent or complete version\n\n"
-                "EXAMPLES OF PROPER FLATTENING:\n"
-                "1. {'patient': {'name': 'John', 'contact': {'email': 'j@example.com'}}} → {'patientName': 'John', 'patientContactEmail': 'j@example.com'}\n"
-                "2. {'medications': [{'name': 'Lisinopril', 'dosage': '10mg'}]} → {'medicationName': 'Lisinopril', 'medicationDosage': '10mg'}\n\n"
-                f"DATABASE CONTENT:\n{full_text}\n\n"
-                "OUTPUT (FLAT JSON ONLY, NO OTHER TEXT):"
-            )
+            template_key, messages = render_prompt(DOCUMENT_EXTRACTION_TEMPLATE.name, text=full_text)
 
         # result = llm.invoke(input=prompt)
         # raw_output = result.content.strip()
 
-        logging.info(f"Prompt text: {prompt}")
+        logging.info(f"Prompt messages ({template_key}): {messages}")
 
-        response = openai_client.chat.completions.create(
-            model=OPENAI_MODEL_NAME,
-            messages=[
-                {"role": "user", "content": prompt}
-            ],
+        response = llm_router.chat(
+            "extract_key_value_info",
+            messages,
             temperature=0.1,
             n=1,
             stop=None
         )
+        record_usage(template_key, response)
 
         logging.info(f"OpenAI response: {response}")
 
@@ -652,40 +700,7 @@ class ExtractedFormData(RootModel[Dict[str, FormSection]]):
             raise ValueError("Should contain exactly one form at the root level")
         return v
 
-def extract_template_key_value_info(elements, used_pdf_ocr=False):
-    """Extract key-value pairs from document elements using enhanced prompts with structured outputs."""
-    try:
-        logging.info("Extracting key-value pairs from template document elements")
-        if not elements:
-            logging.warning("No chunks provided for extraction")
-            return {}
-
-        # Stringify JSON object representation of the elements
-        if not used_pdf_ocr:
-            elements = [element.to_dict() for element in elements]
-            def get_coords(element):
-                # Print JSON representation of the element
-                print(f"Element JSON: {json.dumps(element, indent=2)}")
-                page_num = element['metadata'].get('page_number', 0)
-                coords = element['metadata']['coordinates']
-                if coords:
-                    x1, y1 = coords['points'][0]
-                    # sort top to bottom, then left to right
-                    return  (page_num, y1, x1) 
-                else:
-                    return float("inf"), float("inf")  # put elements with no coordinates at the end
-
-            # Sort elements by their coordinates (top to bottom, then left to right)
-            elements = sorted(elements, key=get_coords)
-            # only take 'type' and 'text' fields from the elements
-            elements = [{"type": element["type"], "text": element["text"]} for element in elements]
-            full_text = json.dumps(elements, indent=2)
-        else:
-            # elements is actually the chunks of the result of normal OCR extraction
-            full_text = " ".join([chunk.page_content for chunk in elements])
-        logging.info(f'Full text for extraction: {full_text}')
-
-        example_full_text = """
+TEMPLATE_EXTRACTION_EXAMPLE_ELEMENTS = """
 [
     {
         "type": "Header",
@@ -862,7 +877,7 @@ def extract_template_key_value_info(elements, used_pdf_ocr=False):
 ]
 """
 
-        example_full_text_response = """
+TEMPLATE_EXTRACTION_EXAMPLE_RESPONSE = """
 {
     "Medical history form": {
         "Patient": {
@@ -997,61 +1012,96 @@ def extract_template_key_value_info(elements, used_pdf_ocr=False):
 }
 """
 
-        prompt = (
-            "You are a medical administrative assistant processing patient documents. Your task is to extract and organize fields from digitized medical form data.\n\n"
-            "TASK: Extract and organize ALL form fields (and values if they have any pre-filled) into a nested JSON object with typed key-value pairs.\n\n"
-            "GUIDELINES:\n"
-            "- For data that is semantically or explicitly structured in a hierarchical fashion, keep that hierarchical format in the output JSON:\n"
-            "  INSTEAD OF: {{'text1': {'Patient name': ''}}, {'text2': {'Patient phone number': ''}}} \n"
-            "  USE: {'Patient': {{'text1': {'Name': ''}}, {'text2': {'Phone number': ''}}}}\n"
-            "- Use common sense to make judgements about the structure of the data.\n"
-            "- The whole point of the hierarchical structure is so that when we construct a form based on the JSON, we can visually group fields that belong together.\n"
-            "- Ensure keys are specific and self-explanatory (e.g., 'Primary phone number' vs 'phone')\n"
-            "- If there are multiple instances of the same field in different sections of the document, keep all of them\n"
-            "- If there is no prefilled value, the value should be an empty string\n"
-            "- EXCLUDE metadata, schema information, vector embeddings, or system fields\n"
-            "- Indicate each field's type (text, boolean, date, etc.) as a parent JSON key followed by a number representing the field's position in that particular JSON element (e.g., 'text1', 'boolean2')\n"
-            "- You can use ANY number after the type - text1, text2, text3... text50, text100, etc. There are no limits.\n"
-            "- Even if there are multiple fields with the same type, they each need to be typed with a unique key\n"
-            "- For example, use {{'text1': {'First name': ''}}, {'text2': {'Last name': ''}}} for text/string fields\n"
-            "- For example, use {'boolean1': {'hasAllergies': false}} or {'date1': {'vaccinationDate': ''}} for checkboxes or date fields\n"
-            "- Moreover, if it seems as though a set of fields is representing the columns of a table that can have multiple entries, AFTER the table name key, precede the table column fields with a parent JSON key indicating the 'table' type just as we did for booleans/dates/etc.\n"
-            "EXAMPLES OF PROPER TRANSFORMATIONS:\n"
-                "1. [{'type': 'Title', 'text': 'CURRENT and PAST MEDICATIONS'},{'type': 'Title', 'text': 'MEDICATION NAME'},{'type': 'Title', 'text': 'DOSAGE'}] → {'Current and past medications': {'table1': {{'text1': {'Medication name': ''}}, {'text2': {'Dosage': ''}}}}\n"
-                "2. [{'type': 'Title', 'text': 'VACCINATIONS'},{'type': 'Title', 'text': 'NAME'},{'type': 'Title', 'text': 'DATE'},{'type': 'Title', 'text': 'NAME'},{'type': 'Title', 'text': 'DATE'},{'type': 'Title', 'text': 'TETANUS'},{'type': 'Title', 'text': 'MENINGITIS'},{'type': 'Title', 'text': 'INFLUENZA VACCINE'},{'type': 'Title', 'text': 'YELLOW FEVER'}] → {'Vaccinations': {{'date1': {'Tetanus date': ''}}, {'date2': {'Meningitis date': ''}}, {'date3': {'Influenza vaccine date': ''}}, {'date4': {'Yellow fever date': ''}}}}\n\n"
-            "Notice how the second example wasn't a table with multiple entries to add in for each vaccination, but rather a set of fields that were semantically grouped together. There's only one entry per vaccination type.\n"
-            "REMEMBER to ALWAYS precede a table type JSON element with a parent JSON element indicating the table name—this is the only way for the table name to be included (as a subheader), as all table type child elements are column names.\n"
-            "IMPORTANT: Keep in mind that the given raw form text was obtained from OCR processing of a digitized form, so it may contain some noise or artifacts from the OCR process that you should ignore.\n"
-            "The text may not be perfectly structured, so do your best to infer the intended fields, possible values, and their relationships/structure.\n\n"
-            "Tables may be represented by a simple sequence of their column names right after each other. Identify possible tables and form their fields accordingly.\n"
-            "If there are checkboxes, represent them as boolean fields (e.g., {'boolean1': {'hasAllergies': false}}).\n"
-            "Don't output JSON arrays.\n"
-            "If there are ever any parts of the form that are just read-only text, like a disclaimer or instructions, include them as direct string values under a descriptive key.\n"
-            "Always include an 'Other comments' field at the very end of the output JSON for the patient to fill in any additional information they want to provide.\n\n"
-            "Only use double quotes for JSON keys, and provide a properly formatted JSON object.\n"
-            "Create sections/subheaders as you see fit, and if you think some fields should exist but are not clearly defined in the raw text, feel free to add them with empty values.\n\n"
-            "Moreover, if it seems like a given field should be a certain data type (e.g., date, boolean, etc.), use that data type rather than just a string.\n"
-            "Also, find opportunities to make fields booleans if they are checkboxes or yes/no questions. For example, a field like 'Abnormal result?' should be a boolean even if it is not indicated as such.\n\n"
-            "Furthermore, the ONLY types that you can use are 'text', 'boolean', 'date', and 'table'. Don't use types such as 'NarrativeText' , 'Header', 'Footer', etc. because they are not valid JSON types.\n\n"
-            "That is, a field should never be Header*, Footer*, NarrativeText*, UncategorizedText*, or any other type that is not one of the four valid types.\n"
-            "Finally, if there is any data that seems like it would not make sense when formatting it as a JSON object for displaying in a form, do NOT include it in the output JSON.\n\n"
-            "Here's an example correct output based on the below raw form text:\n"
-            f"RAW FORM CONTENT:\n{example_full_text}\n\n"
-            "OUTPUT (NESTED JSON ONLY, NO OTHER TEXT):"
-            f"{example_full_text_response}\n\n"
-            "Now, you're turn:\n"
-            f"RAW FORM CONTENT:\n{full_text}\n\n"
-            "OUTPUT (NESTED JSON ONLY, NO OTHER TEXT):"
-        )
-            
-        logging.info(f"Prompt text: {prompt}")
+TEMPLATE_EXTRACTION_TEMPLATE = register_template(PromptTemplate(
+    name="extract_template_fields",
+    version="2",
+    instructions=(
+        "You are a medical administrative assistant processing patient documents. Your task is to extract and organize fields from digitized medical form data.\n\n"
+        "TASK: Extract and organize ALL form fields (and values if they have any pre-filled) into a nested JSON object with typed key-value pairs.\n\n"
+        "GUIDELINES:\n"
+        "- For data that is semantically or explicitly structured in a hierarchical fashion, keep that hierarchical format in the output JSON:\n"
+        "  INSTEAD OF: {{'text1': {'Patient name': ''}}, {'text2': {'Patient phone number': ''}}} \n"
+        "  USE: {'Patient': {{'text1': {'Name': ''}}, {'text2': {'Phone number': ''}}}}\n"
+        "- Use common sense to make judgements about the structure of the data.\n"
+        "- The whole point of the hierarchical structure is so that when we construct a form based on the JSON, we can visually group fields that belong together.\n"
+        "- Ensure keys are specific and self-explanatory (e.g., 'Primary phone number' vs 'phone')\n"
+        "- If there are multiple instances of the same field in different sections of the document, keep all of them\n"
+        "- If there is no prefilled value, the value should be an empty string\n"
+        "- EXCLUDE metadata, schema information, vector embeddings, or system fields\n"
+        "- Indicate each field's type (text, boolean, date, etc.) as a parent JSON key followed by a number representing the field's position in that particular JSON element (e.g., 'text1', 'boolean2')\n"
+        "- You can use ANY number after the type - text1, text2, text3... text50, text100, etc. There are no limits.\n"
+        "- Even if there are multiple fields with the same type, they each need to be typed with a unique key\n"
+        "- For example, use {{'text1': {'First name': ''}}, {'text2': {'Last name': ''}}} for text/string fields\n"
+        "- For example, use {'boolean1': {'hasAllergies': false}} or {'date1': {'vaccinationDate': ''}} for checkboxes or date fields\n"
+        "- Moreover, if it seems as though a set of fields is representing the columns of a table that can have multiple entries, AFTER the table name key, precede the table column fields with a parent JSON key indicating the 'table' type just as we did for booleans/dates/etc.\n"
+        "EXAMPLES OF PROPER TRANSFORMATIONS:\n"
+        "1. [{'type': 'Title', 'text': 'CURRENT and PAST MEDICATIONS'},{'type': 'Title', 'text': 'MEDICATION NAME'},{'type': 'Title', 'text': 'DOSAGE'}] → {'Current and past medications': {'table1': {{'text1': {'Medication name': ''}}, {'text2': {'Dosage': ''}}}}\n"
+        "2. [{'type': 'Title', 'text': 'VACCINATIONS'},{'type': 'Title', 'text': 'NAME'},{'type': 'Title', 'text': 'DATE'},{'type': 'Title', 'text': 'NAME'},{'type': 'Title', 'text': 'DATE'},{'type': 'Title', 'text': 'TETANUS'},{'type': 'Title', 'text': 'MENINGITIS'},{'type': 'Title', 'text': 'INFLUENZA VACCINE'},{'type': 'Title', 'text': 'YELLOW FEVER'}] → {'Vaccinations': {{'date1': {'Tetanus date': ''}}, {'date2': {'Meningitis date': ''}}, {'date3': {'Influenza vaccine date': ''}}, {'date4': {'Yellow fever date': ''}}}}\n\n"
+        "Notice how the second example wasn't a table with multiple entries to add in for each vaccination, but rather a set of fields that were semantically grouped together. There's only one entry per vaccination type.\n"
+        "REMEMBER to ALWAYS precede a table type JSON element with a parent JSON element indicating the table name—this is the only way for the table name to be included (as a subheader), as all table type child elements are column names.\n"
+        "IMPORTANT: Keep in mind that the given raw form text was obtained from OCR processing of a digitized form, so it may contain some noise or artifacts from the OCR process that you should ignore.\n"
+        "The text may not be perfectly structured, so do your best to infer the intended fields, possible values, and their relationships/structure.\n\n"
+        "Tables may be represented by a simple sequence of their column names right after each other. Identify possible tables and form their fields accordingly.\n"
+        "If there are checkboxes, represent them as boolean fields (e.g., {'boolean1': {'hasAllergies': false}}).\n"
+        "Don't output JSON arrays.\n"
+        "If there are ever any parts of the form that are just read-only text, like a disclaimer or instructions, include them as direct string values under a descriptive key.\n"
+        "Always include an 'Other comments' field at the very end of the output JSON for the patient to fill in any additional information they want to provide.\n\n"
+        "Only use double quotes for JSON keys, and provide a properly formatted JSON object.\n"
+        "Create sections/subheaders as you see fit, and if you think some fields should exist but are not clearly defined in the raw text, feel free to add them with empty values.\n\n"
+        "Moreover, if it seems like a given field should be a certain data type (e.g., date, boolean, etc.), use that data type rather than just a string.\n"
+        "Also, find opportunities to make fields booleans if they are checkboxes or yes/no questions. For example, a field like 'Abnormal result?' should be a boolean even if it is not indicated as such.\n\n"
+        "Furthermore, the ONLY types that you can use are 'text', 'boolean', 'date', and 'table'. Don't use types such as 'NarrativeText' , 'Header', 'Footer', etc. because they are not valid JSON types.\n\n"
+        "That is, a field should never be Header*, Footer*, NarrativeText*, UncategorizedText*, or any other type that is not one of the four valid types.\n"
+        "Finally, if there is any data that seems like it would not make sense when formatting it as a JSON object for displaying in a form, do NOT include it in the output JSON.\n\n"
+        "Here's an example correct output based on the below raw form text:\n"
+        "RAW FORM CONTENT:\n" + TEMPLATE_EXTRACTION_EXAMPLE_ELEMENTS + "\n\n"
+        "OUTPUT (NESTED JSON ONLY, NO OTHER TEXT):" + TEMPLATE_EXTRACTION_EXAMPLE_RESPONSE
+    ),
+    sections=[("Now, you're turn:\nRAW FORM CONTENT", "text")],
+    trailer="OUTPUT (NESTED JSON ONLY, NO OTHER TEXT):",
+))
+
+def extract_template_key_value_info(elements, used_pdf_ocr=False):
+    """Extract key-value pairs from document elements using enhanced prompts with structured outputs."""
+    try:
+        logging.info("Extracting key-value pairs from template document elements")
+        if not elements:
+            logging.warning("No chunks provided for extraction")
+            return {}
+
+        # Stringify JSON object representation of the elements
+        if not used_pdf_ocr:
+            elements = [element.to_dict() for element in elements]
+            def get_coords(element):
+                # Print JSON representation of the element
+                print(f"Element JSON: {json.dumps(element, indent=2)}")
+                page_num = element['metadata'].get('page_number', 0)
+                coords = element['metadata']['coordinates']
+                if coords:
+                    x1, y1 = coords['points'][0]
+                    # sort top to bottom, then left to right
+                    return  (page_num, y1, x1) 
+                else:
+                    return float("inf"), float("inf")  # put elements with no coordinates at the end
+
+            # Sort elements by their coordinates (top to bottom, then left to right)
+            elements = sorted(elements, key=get_coords)
+            # only take 'type' and 'text' fields from the elements
+            elements = [{"type": element["type"], "text": element["text"]} for element in elements]
+            full_text = json.dumps(elements, indent=2)
+        else:
+            # elements is actually the chunks of the result of normal OCR extraction
+            full_text = " ".join([chunk.page_content for chunk in elements])
+        logging.info(f'Full text for extraction: {full_text}')
+
+        template_key, messages = render_prompt(TEMPLATE_EXTRACTION_TEMPLATE.name, text=full_text)
+
+        logging.info(f"Prompt messages ({template_key}): {messages}")
         
         # Use structured outputs with the defined schema
-        response = openai_client.chat.completions.create(
-            model=OPENAI_MODEL_NAME,
-            messages=[
-                {"role": "user", "content": prompt}
-            ],
+        response = llm_router.chat(
+            "extract_template_fields",
+            messages,
             temperature=0.1,
             # response_format={
             #     "type": "json_schema",
@@ -1061,6 +1111,7 @@ def extract_template_key_value_info(elements, used_pdf_ocr=False):
             #     }
             # }
         )
+        record_usage(template_key, response)
 
         logging.info(f"OpenAI response: {response}")
 
@@ -1144,52 +1195,111 @@ def create_vector_db(chunks, collection_name):
         logging.error(f"Error creating vector database: {e}")
         return None
 
-def update_user_info_json(new_info, json_file=USER_INFO_JSON):
-    """Update the user_info JSON file with new key-value pairs."""
-    # Create directory if it doesn't exist
-    os.makedirs(os.path.dirname(json_file), exist_ok=True)
-
-    if os.path.exists(json_file):
-        try:
-            with open(json_file, "r") as f:
-                user_info = json.load(f)
-        except json.JSONDecodeError as e:
-            logging.error(f"Error decoding JSON from {json_file}: {e}. Initializing empty user_info.")
-            user_info = {}
-    else:
-        user_info = {}
-
-    user_info.update(new_info)
+def get_profile_store(json_file=USER_INFO_JSON):
+    return profile_store_for(
+        json_file,
+        mirror_json=USER_INFO_JSON_MIRROR,
+        write_behind_seconds=PROFILE_WRITE_BEHIND_SECONDS,
+    )
 
+def update_user_info_json(new_info, json_file=USER_INFO_JSON, profile_id=DEFAULT_PROFILE):
+    """Upsert new key-value pairs into a patient's/session's profile."""
     try:
-        with open(json_file, "w") as f:
-            json.dump(user_info, f, indent=4)
-        logging.info(f"User info JSON updated with {len(new_info)} new key-value pairs.")
+        get_profile_store(json_file).update(new_info, profile_id=profile_id)
+        logging.info(f"User info for profile '{profile_id}' updated with {len(new_info)} new key-value pairs.")
     except Exception as e:
-        logging.error(f"Error writing to {json_file}: {e}")
+        logging.error(f"Error updating user info store for {json_file}: {e}")
 
-def load_user_info(json_file=USER_INFO_JSON):
-    """Load and return user information from the JSON file."""
-    if os.path.exists(json_file):
-        try:
-            with open(json_file, "r") as f:
-                user_info = json.load(f)
-            return user_info
-        except Exception as e:
-            logging.error(f"Error reading {json_file}: {e}")
+def load_user_info(json_file=USER_INFO_JSON, profile_id=DEFAULT_PROFILE):
+    """Load and return a patient's/session's user information (served from memory when hot)."""
+    try:
+        return get_profile_store(json_file).load(profile_id)
+    except Exception as e:
+        logging.error(f"Error reading user info store for {json_file}: {e}")
     return {}
 
-def format_chat_history(chat_history_json):
-    """Format chat history for the prompt."""
+def changed_fields(current_info: dict, merged: dict) -> dict:
+    """Keys of merged that are new or differ from current_info."""
+    return {k: v for k, v in merged.items() if k not in current_info or current_info[k] != v}
+
+def resolve_profile_id(profile_id: Optional[str]) -> str:
+    """Validate a client-supplied profile id, raising HTTP 400 when it is malformed."""
+    try:
+        return normalize_profile_id(profile_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Current form per client session, so clients can send deltas instead of the whole form
+form_state_store = FormStateStore()
+# Session used by /update-form-values when the client doesn't name one
+FORM_VALUES_SESSION = "form_values"
+
+def resolve_form_state(session_id: Optional[str], form_fields=None, form_delta=None) -> Optional[FormState]:
+    """
+    Apply a full snapshot or a delta to the session's form state.
+    Raises HTTP 409 with the current version when a delta is stale, so the client resends the full form.
+    """
+    if not session_id:
+        return None
+    state = form_state_store.get(session_id)
+    try:
+        # An empty list is a valid snapshot (a cleared form); only an absent one means "use the delta"
+        if form_fields is not None and form_fields != "":
+            state.replace(form_fields)
+        elif form_delta:
+            state.apply(form_delta)
+    except FormVersionConflict as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "formVersion": e.expected})
+    except (ValueError, TypeError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid form delta: {e}")
+    return state
+
+CONVERSATION_SUMMARY_TEMPLATE = register_template(PromptTemplate(
+    name="summarize_conversation",
+    version="1",
+    instructions=(
+        "You maintain a running summary of a conversation between a patient and a medical form assistant.\n\n"
+        "GUIDELINES:\n"
+        "- Merge the new conversation turns into the existing summary\n"
+        "- Keep decisions, open questions, corrections and the patient's stated preferences (e.g., fields they don't want filled)\n"
+        "- Keep which form sections have already been covered\n"
+        "- Leave out pleasantries and anything already answered in full\n"
+        "- Write at most 120 words of plain text, no lists or JSON"
+    ),
+    sections=[
+        ("EXISTING SUMMARY", "summary"),
+        ("NEW CONVERSATION TURNS", "turns"),
+    ],
+    trailer="UPDATED SUMMARY:",
+))
+
+def summarize_conversation(previous_summary: str, turns_text: str) -> str:
+    """Fold a block of older conversation turns into the rolling summary."""
+    template_key, messages = render_prompt(
+        CONVERSATION_SUMMARY_TEMPLATE.name,
+        summary=previous_summary or "(none)",
+        turns=turns_text,
+    )
+    response = llm_router.chat(
+        "summarize_conversation",
+        messages,
+        temperature=0.1,
+        max_tokens=300,
+    )
+    record_usage(template_key, response)
+    return response.choices[0].message.content.strip()
+
+# Token budget for the CHAT HISTORY section of every prompt
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "1200"))
+chat_context_compactor = ContextCompactor(summarize_conversation, token_budget=CHAT_HISTORY_TOKEN_BUDGET)
+
+def format_chat_history(chat_history_json, user_info=None):
+    """Format chat history for the prompt, compacted to the chat history token budget."""
     if not chat_history_json:
         return ""
     try:
         chat_history = json.loads(chat_history_json)
-        formatted = "\n"
-        for msg in chat_history:
-            role = "User" if msg['type'] == 'user' else "Assistant"
-            formatted += f"{role}: {msg['content']}\n"
-        return formatted
+        return chat_context_compactor.render(chat_history, user_info)
     except Exception as e:
         logging.error(f"Error reading chat history: {e}")
         return ""
@@ -1208,9 +1318,127 @@ def create_retriever(vector_db):
         logging.error(f"Error creating retriever: {e}")
         return None
 
-def answer_query(llm, question, user_info="", chat_history="", new_form=None, form_fields=None, allow_field_updates: bool = True, language: str = "en"):
+ANSWER_FORM_DOCUMENT_TEMPLATE = register_template(PromptTemplate(
+    name="answer_form_document",
+    version="2",
+    instructions=(
+        "You are a friendly and helpful medical administrative assistant at a clinic. Your role is to help patients understand and complete their medical forms.\n\n"
+        "INSTRUCTIONS:\n"
+        "1. FIELD EXPLANATION:\n"
+        "   - Explain each field in clear, patient-friendly language\n"
+        "   - Use simple terms to explain medical concepts\n"
+        "   - Suggest relevant documents where information can be found\n"
+        "   - Explain why each piece of information is needed\n\n"
+        "2. VALUE DETERMINATION:\n"
+        "   - For each field, find the most relevant information from patient data\n"
+        "   - If information is unavailable, explain what's needed and why\n"
+        "   - Suggest where to find missing information\n\n"
+        "3. DATA FORMATTING:\n"
+        "   - Dates: Use MM/DD/YYYY format unless specified otherwise\n"
+        "   - Addresses: Format as single strings with appropriate separators\n"
+        "   - Phone numbers: Use (XXX) XXX-XXXX format\n"
+        "   - Medical values: Use standard medical terminology\n"
+        "   - Boolean values: Use Yes/No unless form specifies other values\n\n"
+        "4. RESPONSE GUIDELINES:\n"
+        "   - Be warm and professional\n"
+        "   - Explain medical terms in simple language\n"
+        "   - Keep responses concise but informative\n"
+        "   - If unsure, offer to help find the information\n"
+        "   - Always maintain patient privacy and confidentiality"
+    ),
+    sections=[
+        ("LANGUAGE INSTRUCTION", "language_instruction"),
+        ("FORM TO COMPLETE", "new_form_context"),
+        ("PATIENT INFORMATION", "user_info"),
+        ("CHAT HISTORY", "chat_history"),
+        ("QUESTION", "question"),
+    ],
+    trailer="ANSWER (DO NOT USE ANY NESTED STRUCTURE IN JSON. USE ONLY FLAT, ONE-LEVEL JSON. ANSWER ONLY JSON, NOTHING ELSE):",
+))
+
+ANSWER_QUERY_GUIDELINES = (
+    "You are a friendly and helpful medical administrative assistant at a clinic. Your role is to help patients understand and complete their medical forms.\n\n"
+    "GUIDELINES:\n"
+    "1. Be warm and professional\n"
+    "2. Explain medical terms in simple language\n"
+    "3. Keep responses concise but informative\n"
+    "4. If unsure, offer to help find the information\n"
+    "5. Always maintain patient privacy and confidentiality\n"
+    "6. If asked about information not in our records, suggest relevant documents they can provide\n"
+    "7. When guiding a patient through the form, focus on smaller subsections in separate responses so as not to overwhelm them.\n"
+)
+
+ANSWER_QUERY_UPDATE_INSTRUCTIONS = (
+    "7. IMPORTANT: If you can determine values for ANY form fields based on the conversation and the PATIENT INFORMATION that currently have a value of MISSING, include AS MANY of them as possible in a well-formed JSON object at the end of your response with the format:\n"
+    "   {'field_updates': [{'id': '<field id>', 'value': '<new value>'}]}\n\n"
+    "   For example:\n"
+    "   Based on the information I have, I was able to fill out some of the form for you!"
+    "   {'field_updates': [{'id': 'Medical history form-Patient-text1', 'value': 'John Markovich'}, {'id': 'Medical history form-Patient-text2', 'value': 'jm23@gmail.com'}]}\n"
+    "   IMPORTANT: Use the exact field IDs from the form fields provided in CURRENT MEDICAL FORM FIELDS AND VALUES. DON'T use labels; rather use the IDs themselves for updates. Otherwise, the update will not work.\n"
+    "   Provide field_updates for any field the patient explicitly asked to fill or change, OR for fields that are in the form AND are currently marked MISSING and for which you have reliable information. Use the associated IDs.\n"
+    "   Any dates must be provided in the format yyyy-mm-dd (e.g., 2023-10-01).\n"
+    "   If a patient has suggested that they don't want certain fields updated, do NOT include those fields in the field_updates.\n"
+    "   If guiding a patient through filling out the form, perform the field updates as soon as you can.\n"
+    "   Only update field values if you have the actual new value. Don't use placeholders.\n"
+    "   Do NOT include any field in field_updates if you don't have actual data for it.\n"
+    "   Do NOT include fields with values like 'MISSING', 'unknown', 'N/A', or placeholders.\n"
+    "   Do NOT ask the patient to confirm this information in the chat. Just provide the new values in the JSON object at the end with its 'field_updates' key as specified.\n"
+    "   Do NOT reference this JSON object in the chat, just print it out as specified above. It will be filtered out later.\n"
+    "   Rather than summarize your changes, just provide the accurate, properly-formatted JSON for the field updates.\n"
+    "   Also, the fields from the PATIENT INFORMATION section don't have to be exactly the same as the fields in the form. You can use the PATIENT INFORMATION to determine the new values for the associated form fields.\n"
+    "   ONLY return the JSON object at the end if you have new values to provide (this will be filtered out later when the overall message is presented to the user)."
+)
+
+ANSWER_QUERY_SECTIONS = [
+    ("LANGUAGE INSTRUCTION", "language_instruction"),
+    ("PATIENT INFORMATION", "user_info"),
+    ("CURRENT MEDICAL FORM FIELDS AND VALUES", "form_fields"),
+    ("CHAT HISTORY", "chat_history"),
+    ("QUESTION", "question"),
+]
+
+ANSWER_QUERY_TEMPLATE = register_template(PromptTemplate(
+    name="answer_query",
+    version="2",
+    instructions=ANSWER_QUERY_GUIDELINES.rstrip(),
+    sections=ANSWER_QUERY_SECTIONS,
+))
+
+ANSWER_QUERY_WITH_UPDATES_TEMPLATE = register_template(PromptTemplate(
+    name="answer_query_with_updates",
+    version="2",
+    instructions=ANSWER_QUERY_GUIDELINES + ANSWER_QUERY_UPDATE_INSTRUCTIONS,
+    sections=ANSWER_QUERY_SECTIONS,
+    trailer="Remember to provide the answer in this format all in one line: {'field_updates': [{'id': '<field id>', 'value': '<new value>'}]}",
+))
+
+FIX_FIELD_KEYS_TEMPLATE = register_template(PromptTemplate(
+    name="fix_field_update_keys",
+    version="3",
+    instructions=(
+        "You are a medical form expert. Review this response and ensure all field_updates use the EXACT field IDs from CURRENT MEDICAL FORM FIELDS.\n\n"
+        "IMPORTANT:\n"
+        "- Only modify the JSON object with field_updates if present\n"
+        "- Keep all other text exactly the same\n"
+        "- That is, if there is any text before the JSON object, keep it there before the revised JSON object in the response\n"
+        "- Ensure field IDs match exactly what's in the form fields\n"
+        "- Do not add or remove any fields\n"
+        "- Only change the IDs to match the IDs in the form fields based on what you think is the correct mapping"
+    ),
+    sections=[
+        ("CURRENT MEDICAL FORM FIELDS", "form_fields"),
+        ("RESPONSE TO FIX", "response"),
+    ],
+    trailer="Return the response with corrected field IDs if needed, otherwise return it unchanged.",
+))
+
+def answer_query(llm, question, user_info="", chat_history="", new_form=None, form_fields=None, allow_field_updates: bool = True, language: str = "en", on_delta=None):
     """
     Answer a query using stored data and vector DBs of uploaded forms.
+
+    ``on_delta`` receives the answer text as it is generated (from a worker thread).
+    Only the answer pass is streamed: the key-fixing pass keeps its text and
+    only corrects the field_updates JSON.
     """
     # Language-specific prompt instructions
     language_instructions = {
@@ -1231,6 +1459,17 @@ def answer_query(llm, question, user_info="", chat_history="", new_form=None, fo
         logging.error(f"Error parsing user_info: {e}")
         return "I apologize, but I'm having trouble accessing your information. Please let me know how I can help you with the form."
 
+    new_form_context = "\n".join(doc.page_content for doc in new_form) if new_form else ""
+
+    # The key-fixing pass must be able to name any field, filled or not, but needs no values
+    field_keys = form_field_keys(form_fields)
+    # Only MISSING fields and the filled fields the question refers to go into the answer prompt
+    form_fields = project_form_fields(form_fields, question)
+
+    # Only pass the patient fields relevant to this form/question into the prompt
+    if isinstance(user_info_dict, dict):
+        user_info = project_user_info(user_info_dict, form_fields, question, extra_text=new_form_context)
+
     logging.info(f"Question: {question}")
     logging.info(f"User info: {user_info}")
     logging.info(f"Chat history: {chat_history}")
@@ -1238,105 +1477,40 @@ def answer_query(llm, question, user_info="", chat_history="", new_form=None, fo
     logging.info(f"Form fields: {form_fields}")
 
     if new_form:
-        new_form_context = "\n".join(doc.page_content for doc in new_form)
-
-        template = (
-            "You are a friendly and helpful medical administrative assistant at a clinic. Your role is to help patients understand and complete their medical forms.\n\n"
-            "LANGUAGE INSTRUCTION: {language_instruction}\n\n"
-            "FORM TO COMPLETE:\n{new_form_context}\n\n"
-            "PATIENT INFORMATION:\n{user_info}\n\n"
-            "CHAT HISTORY:\n{chat_history}\n\n"
-            "INSTRUCTIONS:\n"
-            "1. FIELD EXPLANATION:\n"
-            "   - Explain each field in clear, patient-friendly language\n"
-            "   - Use simple terms to explain medical concepts\n"
-            "   - Suggest relevant documents where information can be found\n"
-            "   - Explain why each piece of information is needed\n\n"
-            "2. VALUE DETERMINATION:\n"
-            "   - For each field, find the most relevant information from patient data\n"
-            "   - If information is unavailable, explain what's needed and why\n"
-            "   - Suggest where to find missing information\n\n"
-            "3. DATA FORMATTING:\n"
-            "   - Dates: Use MM/DD/YYYY format unless specified otherwise\n"
-            "   - Addresses: Format as single strings with appropriate separators\n"
-            "   - Phone numbers: Use (XXX) XXX-XXXX format\n"
-            "   - Medical values: Use standard medical terminology\n"
-            "   - Boolean values: Use Yes/No unless form specifies other values\n\n"
-            "4. RESPONSE GUIDELINES:\n"
-            "   - Be warm and professional\n"
-            "   - Explain medical terms in simple language\n"
-            "   - Keep responses concise but informative\n"
-            "   - If unsure, offer to help find the information\n"
-            "   - Always maintain patient privacy and confidentiality\n\n"
-            "QUESTION: {question}\n\n"
-            "ANSWER (DO NOT USE ANY NESTED STRUCTURE IN JSON. USE ONLY FLAT, ONE-LEVEL JSON. ANSWER ONLY JSON, NOTHING ELSE):"
-        ).format(new_form_context=new_form_context, user_info=user_info, chat_history=chat_history, question=question, language_instruction=language_instruction)
-
-        prompt_text = template
-    else:
-        base_prompt = (
-            "You are a friendly and helpful medical administrative assistant at a clinic. Your role is to help patients understand and complete their medical forms.\n\n"
-            "LANGUAGE INSTRUCTION: {language_instruction}\n\n"
-            "PATIENT INFORMATION:\n{user_info}\n\n"
-            "CHAT HISTORY:\n{chat_history}\n\n"
-            "CURRENT MEDICAL FORM FIELDS AND VALUES:\n{form_fields}\n\n"
-            "GUIDELINES:\n"
-            "1. Be warm and professional\n"
-            "2. Explain medical terms in simple language\n"
-            "3. Keep responses concise but informative\n"
-            "4. If unsure, offer to help find the information\n"
-            "5. Always maintain patient privacy and confidentiality\n"
-            "6. If asked about information not in our records, suggest relevant documents they can provide\n"
-            "7. When guiding a patient through the form, focus on smaller subsections in separate responses so as not to overwhelm them.\n"
+        template_key, messages = render_prompt(
+            ANSWER_FORM_DOCUMENT_TEMPLATE.name,
+            language_instruction=language_instruction,
+            new_form_context=new_form_context,
+            user_info=user_info,
+            chat_history=chat_history,
+            question=question,
         )
-
-        update_instructions = (
-            "7. IMPORTANT: If you can determine values for ANY form fields based on the conversation and the PATIENT INFORMATION that currently have a value of MISSING, include AS MANY of them as possible in a well-formed JSON object at the end of your response with the format:\n"
-            "   {{'field_updates': [{{'id': '<field id>', 'value': '<new value>'}}]}}\n\n"
-            "   For example:\n"
-            "   Based on the information I have, I was able to fill out some of the form for you!"
-            "   {{'field_updates': [{{'id': 'Medical history form-Patient-text1', 'value': 'John Markovich'}}, {{'id': 'Medical history form-Patient-text2', 'value': 'jm23@gmail.com'}}]}}\n"
-            "   IMPORTANT: Use the exact field IDs from the form fields provided in CURRENT MEDICAL FORM FIELDS AND VALUES. DON'T use labels; rather use the IDs themselves for updates. Otherwise, the update will not work.\n"
-            "   Provide field_updates for any field the patient explicitly asked to fill or change, OR for fields that are in the form AND are currently marked MISSING and for which you have reliable information. Use the associated IDs.\n"
-            "   Any dates must be provided in the format yyyy-mm-dd (e.g., 2023-10-01).\n"
-            "   If a patient has suggested that they don't want certain fields updated, do NOT include those fields in the field_updates.\n"
-            "   If guiding a patient through filling out the form, perform the field updates as soon as you can.\n"
-            "   Only update field values if you have the actual new value. Don't use placeholders.\n"
-            "   Do NOT include any field in field_updates if you don't have actual data for it.\n"
-            "   Do NOT include fields with values like 'MISSING', 'unknown', 'N/A', or placeholders.\n"
-            "   Do NOT ask the patient to confirm this information in the chat. Just provide the new values in the JSON object at the end with its 'field_updates' key as specified.\n"
-            "   Do NOT reference this JSON object in the chat, just print it out as specified above. It will be filtered out later.\n"
-            "   Rather than summarize your changes, just provide the accurate, properly-formatted JSON for the field updates.\n"
-            "   Also, the fields from the PATIENT INFORMATION section don't have to be exactly the same as the fields in the form. You can use the PATIENT INFORMATION to determine the new values for the associated form fields.\n"
-            "   ONLY return the JSON object at the end if you have new values to provide (this will be filtered out later when the overall message is presented to the user).\n\n"
+    else:
+        template = ANSWER_QUERY_WITH_UPDATES_TEMPLATE if allow_field_updates else ANSWER_QUERY_TEMPLATE
+        template_key, messages = render_prompt(
+            template.name,
+            language_instruction=language_instruction,
+            user_info=user_info,
+            form_fields=form_fields,
+            chat_history=chat_history,
+            question=question,
         )
 
-        prompt_text = base_prompt
-        if allow_field_updates:
-            prompt_text += update_instructions
-
-        prompt_text += "QUESTION: {question}\n\n"
-
-        if allow_field_updates:
-            prompt_text += "Remember to provide the answer in this format all in one line: {{'field_updates': [{{'id': '<field id>', 'value': '<new value>'}}]}}\n\n"
-
-        prompt_text = prompt_text.format(user_info=user_info, chat_history=chat_history, form_fields=form_fields, question=question, language_instruction=language_instruction)
-
-
-    logging.info(f"Prompt text: {prompt_text}")
+    logging.info(f"Prompt messages ({template_key}): {messages}")
 
     logging.info('Using OpenAI model for completion')
     # Use the OpenAI API to get the response. Edit later to handle conversation history properly.
-    response = openai_client.chat.completions.create(
-        model=OPENAI_MODEL_NAME,
-        messages=[
-            {"role": "user", "content": prompt_text}
-        ],
+    response = llm_router.chat(
+        "answer_query",
+        messages,
+        hedge=True,
         temperature=0.1,
         max_tokens=1500,
         n=1,
-        stop=None
+        stop=None,
+        on_delta=on_delta,
     )
+    record_usage(template_key, response)
 
     logging.info(f"OpenAI response 1st pass: {response}")
 
@@ -1346,46 +1520,31 @@ def answer_query(llm, question, user_info="", chat_history="", new_form=None, fo
     first_pass = response
 
     # Create prompt to fix field update keys
-    fix_keys_prompt = (
-        "You are a medical form expert. Review this response and ensure all field_updates use the EXACT field IDs from CURRENT MEDICAL FORM FIELDS AND VALUES.\n\n"
-        "IMPORTANT:\n"
-        "- Only modify the JSON object with field_updates if present\n" 
-        "- Keep all other text exactly the same\n"
-        "- That is, if there is any text before the JSON object, keep it there before the revised JSON object in the response\n"
-        "- Ensure field IDs match exactly what's in the form fields\n"
-        "- Do not add or remove any fields\n"
-        "- Only change the IDs to match the IDs in the form fields based on what you think is the correct mapping\n\n"
-        f"CURRENT MEDICAL FORM FIELDS AND VALUES:\n{form_fields}\n\n"
-        f"RESPONSE TO FIX:\n{first_pass}\n\n"
-        "Return the response with corrected field IDs if needed, otherwise return it unchanged."
-    )
-
-    # Get corrected response
-    corrected = openai_client.chat.completions.create(
-        model=OPENAI_MODEL_NAME,
-        messages=[
-            {"role": "user", "content": fix_keys_prompt}
-        ],
-        temperature=0.1,
-    )
+    fix_key, fix_messages = render_prompt(FIX_FIELD_KEYS_TEMPLATE.name, form_fields=field_keys, response=first_pass)
 
-    response = corrected.choices[0].message.content.strip()
+    # Get corrected response; the first pass is still a usable answer if this fails
+    try:
+        corrected = llm_router.chat(
+            "answer_query_fix_keys",
+            fix_messages,
+            hedge=True,
+            temperature=0.1,
+        )
+        record_usage(fix_key, corrected)
+        response = corrected.choices[0].message.content.strip()
+    except LLMCallError as e:
+        logging.warning(f"Field key correction failed, using first pass: {e}")
+        response = first_pass
 
     # response = llm.invoke(input=prompt_text)
     logging.info(f"LLM response 2nd pass: {response}")
     return response
 
-def merge_user_info(current_info: dict, new_info: dict, llm) -> dict:
-    """Merge new_info into current_info using LLM-generated mapping."""
-    # If either dictionary is empty, handle the simple cases
-    if not current_info:
-        return new_info.copy()
-    if not new_info:
-        return current_info.copy()
-
+def llm_field_mapping(new_fields: dict, candidate_fields: dict) -> dict:
+    """Ask the LLM which existing field (if any) each ambiguous new field corresponds to."""
     # Format the dictionaries for better LLM comprehension
-    current_json = json.dumps(current_info, indent=2)
-    new_json = json.dumps(new_info, indent=2)
+    current_json = json.dumps(candidate_fields, indent=2)
+    new_json = json.dumps(new_fields, indent=2)
 
     # Create a prompt that asks the LLM to analyze both sets of fields at once
     prompt = f"""
@@ -1439,65 +1598,101 @@ Output: {{"mapping": {{"homeAddress": "address", "taxpayerID": "ssn", "employer"
 YOUR MAPPING OUTPUT:
 """
 
-    try:
-        # Get the LLM's analysis
-        response = llm.invoke(input=prompt)
-        result_text = response.content.strip()
-
-        # Extract the JSON object (handle potential formatting issues)
-        json_match = re.search(r'\{[\s\S]*\}', result_text)
-        if not json_match:
-            logging.warning("Could not extract JSON from LLM response, falling back to simple merge")
-            return {**current_info, **new_info}
-
-        mapping_json = json_match.group(0)
-
-        try:
-            mapping = json.loads(mapping_json)
-        except json.JSONDecodeError as e:
-            logging.warning(f"Error parsing mapping JSON: {e}, attempting to fix")
-            # Try to fix common JSON issues
-            mapping_json = mapping_json.replace("'", "\"")
-            mapping_json = re.sub(r'([{,])\s*([a-zA-Z0-9_]+)\s*:', r'\1"\2":', mapping_json)
-
-            try:
-                mapping = json.loads(mapping_json)
-            except Exception as e2:
-                logging.error(f"Failed to fix mapping JSON: {e2}, falling back to simple merge")
-                return {**current_info, **new_info}
-
-        if "mapping" not in mapping:
-            logging.warning("Invalid mapping format (no 'mapping' key), falling back to simple merge")
-            return {**current_info, **new_info}
+    # Get the LLM's analysis
+    result_text = llm_router.complete_text(
+        "merge_user_info",
+        [{"role": "user", "content": prompt}],
+        temperature=0.1,
+    )
 
-        # Initialize the merged result with the current info
-        merged = current_info.copy()
+    # Extract the JSON object (handle potential formatting issues)
+    json_match = re.search(r'\{[\s\S]*\}', result_text)
+    if not json_match:
+        logging.warning("Could not extract JSON from LLM field mapping response")
+        return {}
 
-        # Apply the mapping
-        for new_field, current_field in mapping["mapping"].items():
-            if new_field not in new_info:
-                logging.warning(f"Mapping includes '{new_field}', not in new_info. Skipping.")
-                continue
+    mapping_json = json_match.group(0)
 
-            if current_field is not None:
-                if current_field in merged:
-                    merged[current_field] = new_info[new_field]
-                    logging.info(f"Updated field '{current_field}' with value from '{new_field}'")
-                else:
-                    merged[new_field] = new_info[new_field]
-                    logging.info(f"Added new field '{new_field}' (mapped field '{current_field}' doesn't exist)")
-            else:
-                merged[new_field] = new_info[new_field]
-                logging.info(f"Added new field '{new_field}'")
+    try:
+        mapping = json.loads(mapping_json)
+    except json.JSONDecodeError as e:
+        logging.warning(f"Error parsing mapping JSON: {e}, attempting to fix")
+        # Try to fix common JSON issues
+        mapping_json = mapping_json.replace("'", "\"")
+        mapping_json = re.sub(r'([{,])\s*([a-zA-Z0-9_]+)\s*:', r'\1"\2":', mapping_json)
+        mapping = json.loads(mapping_json)
+
+    if not isinstance(mapping, dict) or not isinstance(mapping.get("mapping"), dict):
+        logging.warning("Invalid mapping format (no 'mapping' key)")
+        return {}
+    return mapping["mapping"]
 
-        return merged
+def merge_user_info(current_info: dict, new_info: dict, llm) -> dict:
+    """
+    Merge new_info into current_info using the shared field ontology.
+    Keys are matched locally; the LLM is only asked about genuinely ambiguous keys.
+    """
+    # If either dictionary is empty, handle the simple cases
+    if not current_info:
+        return new_info.copy()
+    if not new_info:
+        return current_info.copy()
 
+    try:
+        result = merge_profiles(current_info, new_info, resolver=llm_field_mapping)
+        for new_field, current_fields in result.mapped.items():
+            logging.info(f"Updated field(s) {current_fields} with value from '{new_field}'")
+        for new_field in result.added:
+            logging.info(f"Added new field '{new_field}'")
+        return result.merged
     except Exception as e:
         logging.error(f"Error in field mapping: {e}")
         # Fallback to simple merge in case of errors
         return {**current_info, **new_info}
 
-def update_user_info_from_doc_fast(file_path, current_info: dict):
+extraction_ledger = ExtractionLedger(EXTRACTION_LEDGER_DB)
+
+def extract_new_key_value_info(documents=None, text=None, profile_id=DEFAULT_PROFILE):
+    """
+    Run key-value extraction only over document pages not extracted before / conversation turns
+    not in the previous submission.
+    For documents, results already extracted from the unchanged pages are returned alongside.
+    Labelled document fields that validate (SSN, phone, DOB, email, ...) are filled by pattern
+    matching and only the remaining text is sent to the LLM.
+    """
+    is_document = documents is not None
+    if is_document:
+        units = document_units(documents)
+        new_units, previous = extraction_ledger.plan(profile_id, units)
+    else:
+        units = conversation_units(text)
+        new_units, previous = extraction_ledger.plan_conversation(profile_id, units), {}
+    if not new_units:
+        logging.info("No new content to extract, reusing previous extraction results")
+        return previous if is_document else {}
+
+    if is_document:
+        patterns = extract_labelled_fields("\n\n".join(new_units))
+        llm_info = {}
+        if patterns.has_residual:
+            llm_info = extract_key_value_info([Document(page_content=patterns.residual_text)], None, None)
+        else:
+            logging.info("All document content matched locally, skipping LLM extraction")
+        # The model sees the surrounding context, so its reading wins where both found a field
+        new_info = {**patterns.fields, **llm_info}
+        llm_ok = bool(llm_info) or not patterns.has_residual
+    else:
+        new_info = extract_key_value_info(None, "\n".join(new_units), None)
+        llm_ok = bool(new_info)
+
+    # Failed or empty extractions are not recorded so the content is retried next time
+    if is_document and new_info and llm_ok:
+        extraction_ledger.record(profile_id, new_units, new_info)
+    elif not is_document and llm_ok:
+        extraction_ledger.record_conversation(profile_id, units)
+    return {**previous, **new_info} if is_document else new_info
+
+def update_user_info_from_doc_fast(file_path, current_info: dict, profile_id=DEFAULT_PROFILE):
     """
     Fast version of update_user_info_from_doc that skips vector database creation.
     Used for voice uploads where we only need user info extraction for immediate auto-fill.
@@ -1507,8 +1702,7 @@ def update_user_info_from_doc_fast(file_path, current_info: dict):
         logging.error(f"Failed to ingest document from {file_path}")
         return current_info
 
-    chunks = split_documents(data)
-    new_info = extract_key_value_info(chunks, None, None)  # Skip LLM for speed
+    new_info = extract_new_key_value_info(documents=data, profile_id=profile_id)
     logging.info(f"New info extracted from document: {new_info}")
 
     # Flatten the new info before merging
@@ -1517,14 +1711,14 @@ def update_user_info_from_doc_fast(file_path, current_info: dict):
 
     # Simple merge without LLM (faster)
     merged = {**current_info, **flat_new_info}
-    update_user_info_json(merged)
+    update_user_info_json(changed_fields(current_info, merged), profile_id=profile_id)
 
     # Skip vector DB creation for speed
     logging.info("Skipped vector DB creation for fast voice upload")
 
     return merged
 
-def update_user_info_from_doc(file_path, llm, current_info: dict):
+def update_user_info_from_doc(file_path, llm, current_info: dict, profile_id=DEFAULT_PROFILE):
     """
     Update user_info by processing a new document.
     Also creates and persists a vector database for the update document.
@@ -1535,7 +1729,7 @@ def update_user_info_from_doc(file_path, llm, current_info: dict):
         return current_info
 
     chunks = split_documents(data)
-    new_info = extract_key_value_info(chunks, None, llm)
+    new_info = extract_new_key_value_info(documents=data, profile_id=profile_id)
     logging.info(f"New info extracted from document: {new_info}")
 
     # Flatten the new info before merging
@@ -1544,7 +1738,7 @@ def update_user_info_from_doc(file_path, llm, current_info: dict):
 
     # Use the efficient merging function
     merged = merge_user_info(current_info, flat_new_info, llm)
-    update_user_info_json(merged)
+    update_user_info_json(changed_fields(current_info, merged), profile_id=profile_id)
 
     # Create and persist a vector DB for the document
     filename = os.path.basename(file_path)
@@ -1552,11 +1746,11 @@ def update_user_info_from_doc(file_path, llm, current_info: dict):
     vector_db = create_vector_db(chunks, collection_name)
     if vector_db:
         vector_db_path = os.path.join(VECTOR_DB_DIR, collection_name)
-        update_user_info_json({collection_name: vector_db_path})
+        update_user_info_json({collection_name: vector_db_path}, profile_id=profile_id)
 
     return merged
 
-def update_user_info_from_conversation(text, llm, current_info: dict):
+def update_user_info_from_conversation(text, llm, current_info: dict, profile_id=DEFAULT_PROFILE):
     """
     Update user_info by processing conversation text.
     """
@@ -1564,8 +1758,10 @@ def update_user_info_from_conversation(text, llm, current_info: dict):
         logging.warning("Empty conversation text provided, no update performed")
         return current_info
 
-    new_info = extract_key_value_info(None, text, llm)
+    new_info = extract_new_key_value_info(text=text, profile_id=profile_id)
     logging.info(f"New info extracted from conversation: {new_info}")
+    if not new_info:
+        return current_info
 
     # Flatten the new info before merging
     flat_new_info = flatten_json(new_info)
@@ -1573,7 +1769,7 @@ def update_user_info_from_conversation(text, llm, current_info: dict):
 
     # Use the efficient merging function
     merged = merge_user_info(current_info, flat_new_info, llm)
-    update_user_info_json(merged)
+    update_user_info_json(changed_fields(current_info, merged), profile_id=profile_id)
 
     return merged
 
@@ -1594,8 +1790,9 @@ def save_uploaded_file(file_content, file_name):
 
 # API Endpoints
 @app.post("/ingest")
-async def ingest_document(file: UploadFile = File(...)):
+async def ingest_document(file: UploadFile = File(...), profileId: Optional[str] = Form(None)):
     """Process document and update user info."""
+    profile_id = resolve_profile_id(profileId)
     try:
         logging.info(f"Processing file: {file.filename}")
         content = await file.read()
@@ -1610,11 +1807,11 @@ async def ingest_document(file: UploadFile = File(...)):
 
         chunks = split_documents(data)
         # llm = ChatOllama(model=MODEL_NAME, temperature=0.1)
-        key_value_info = extract_key_value_info(chunks, None, None)
+        key_value_info = extract_new_key_value_info(documents=data, profile_id=profile_id)
 
         # Flatten any nested structures before saving
         flat_key_value_info = flatten_json(key_value_info)
-        update_user_info_json(flat_key_value_info)
+        update_user_info_json(flat_key_value_info, profile_id=profile_id)
 
         # Create and store vector DB
         collection_name = sanitize_collection_name(os.path.splitext(file.filename)[0])
@@ -1622,7 +1819,7 @@ async def ingest_document(file: UploadFile = File(...)):
 
         if vector_db:
             vector_db_path = os.path.join(VECTOR_DB_DIR, collection_name)
-            update_user_info_json({collection_name: vector_db_path})
+            update_user_info_json({collection_name: vector_db_path}, profile_id=profile_id)
 
             return {
                 "status": "success",
@@ -1639,6 +1836,20 @@ async def ingest_document(file: UploadFile = File(...)):
         logging.error(f"Error in ingest endpoint: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to process document: {str(e)}")
 
+template_registry = TemplateRegistry(TEMPLATE_REGISTRY_DB)
+
+def template_layout_hash(file_path):
+    """Layout fingerprint of a PDF or image template from low-resolution page renders ([] if unsupported)."""
+    ext = os.path.splitext(file_path)[1].lower()
+    try:
+        if ext == ".pdf":
+            return layout_hash(convert_from_path(file_path, dpi=LAYOUT_DPI))
+        if ext in [".png", ".jpg", ".jpeg"]:
+            return layout_hash([Image.open(file_path)])
+    except Exception as e:
+        logging.warning(f"Could not compute layout hash for {file_path}: {e}")
+    return []
+
 @app.post("/ingest-form-template")
 async def ingest_form_template(file: UploadFile = File(...)):
     """Ingest a form template and extract key-value pairs."""
@@ -1646,9 +1857,30 @@ async def ingest_form_template(file: UploadFile = File(...)):
         logging.info(f"Processing form template: {file.filename}")
         content = await file.read()
 
+        # Same bytes as a template seen before: no OCR, no LLM
+        fingerprint = content_hash(content)
+        template = template_registry.lookup_content(fingerprint)
+
         # Save the file
         file_path = save_uploaded_file(content, file.filename)
 
+        layout = []
+        if template is None:
+            # A rescan or re-export of a known template, confirmed by its text layer when it has one
+            layout = template_layout_hash(file_path)
+            text = pdf_text(file_path) if file_path.lower().endswith(".pdf") else None
+            template = template_registry.lookup_layout(layout, content=fingerprint, text=text, filename=file.filename)
+
+        if template is not None:
+            logging.info(f"Form template cache hit: {template.template_id}")
+            return {
+                "status": "success",
+                "message": "Form template processed",
+                "extracted_info": template.schema,
+                "templateId": template.template_id,
+                "cached": True
+            }
+
         # Process document
         data, used_pdf_ocr = ingest_file(file_path, get_native_elements=True)
         if data is None:
@@ -1661,12 +1893,20 @@ async def ingest_form_template(file: UploadFile = File(...)):
         # Flatten any nested structures before saving
         # flat_key_value_info = flatten_json(key_value_info)
 
+        template_id = None
+        if key_value_info:
+            template_id = template_registry.register(fingerprint, layout, key_value_info, filename=file.filename).template_id
+
         # Create and store vector DB
         return {
             "status": "success",
             "message": "Form template processed",
-            "extracted_info": key_value_info
+            "extracted_info": key_value_info,
+            "templateId": template_id,
+            "cached": False
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error in ingest form template endpoint: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to process form template: {str(e)}")
@@ -1677,17 +1917,25 @@ async def query_endpoint(
     documentName: Optional[str] = Form(None),
     chatHistory: Optional[str] = Form(None),
     formFields: Optional[str] = Form(None),
-    language: Optional[str] = Form("en")
+    language: Optional[str] = Form("en"),
+    profileId: Optional[str] = Form(None),
+    formSessionId: Optional[str] = Form(None),
+    formDelta: Optional[str] = Form(None)
 ):
     """Answer a query using stored data."""
+    profile_id = resolve_profile_id(profileId)
+    # With a form session the client sends formFields once, then only formDelta
+    form_state = resolve_form_state(formSessionId, formFields, formDelta)
+    if form_state is not None:
+        formFields = form_state
     try:
         # Load stored user info
-        user_info = load_user_info()
+        user_info = load_user_info(profile_id=profile_id)
 
         # Format chat history if provided
         chat_history_formatted = ""
         if chatHistory:
-            chat_history_formatted = format_chat_history(chatHistory)
+            chat_history_formatted = format_chat_history(chatHistory, user_info)
 
         # Initialize LLM
         # llm = ChatOllama(model=MODEL_NAME, temperature=0.1)
@@ -1730,6 +1978,8 @@ async def query_endpoint(
                 language=language
             )
 
+        if form_state is not None:
+            return {"content": response, "formVersion": form_state.version}
         return {"content": response}
     except Exception as e:
         logging.error(f"Error in query endpoint: {e}")
@@ -1739,22 +1989,25 @@ async def query_endpoint(
 async def update_endpoint(
     message: str = Form(...),
     documentName: Optional[str] = Form(None),
+    profileId: Optional[str] = Form(None),
 ):
     """Update user info from a document or conversation."""
+    profile_id = resolve_profile_id(profileId)
     try:
         # Load current user info
-        current_info = load_user_info()
+        current_info = load_user_info(profile_id=profile_id)
         if not current_info:
             current_info = {}
 
-        llm = ChatOllama(model=MODEL_NAME, temperature=0.1)
+        # Completions are routed by llm_router (local model for merging, hosted for answers)
+        llm = None
 
         if documentName:
             # Update via document
             file_path = os.path.join(UPLOADS_DIR, documentName)
             logging.info(f"Processing document for update: {file_path}")
             logging.info(f"Cwd absolute path: {os.path.abspath(os.getcwd())}")
-            updated_info = update_user_info_from_doc(file_path, llm, current_info)
+            updated_info = update_user_info_from_doc(file_path, llm, current_info, profile_id=profile_id)
             return {
                 "status": "success",
                 "message": "Your info has been updated from your document.",
@@ -1764,7 +2017,7 @@ async def update_endpoint(
             }
         else:
             # Update via conversation text
-            updated_info = update_user_info_from_conversation(message, llm, current_info)
+            updated_info = update_user_info_from_conversation(message, llm, current_info, profile_id=profile_id)
             return {
                 "status": "success",
                 "message": "Your info has been updated from our conversation.",
@@ -1794,8 +2047,8 @@ async def process_blank_form(
 
         questionPrompt = f"You are a helpful, form-filling assistant. The user will provide you with an image of a blank or partially-filled form. For each field, your task is to generate the answer to the question, 'What is the value of the field?' and add the field label and its answer as a key-value pair to a .JSON file. If the answer to the field is not already in the form, check if you can find the answer in the chat history. Here is an example response: {sample_json} ONLY RESPOND WITH THE OUTPUT OF A .JSON FILE WITH NO ADDITIONAL TEXT"
 
-        # Initialize LLM
-        llm = ChatOllama(model=MODEL_NAME, temperature=0.1)
+        # Completions are routed by llm_router (local model for merging, hosted for answers)
+        llm = None
 
         # Process the form
         data, _ = ingest_file(file_path)
@@ -1852,18 +2105,26 @@ async def process_blank_form(
 
 @app.post("/update-form-values")
 async def update_form_values(request: FormValuesRequest):
-    """Update form values."""
+    """Update form values from a full snapshot or a delta."""
+    if request.values is None and request.delta is None:
+        raise HTTPException(status_code=400, detail="Either values or delta is required")
+    state = resolve_form_state(request.sessionId or FORM_VALUES_SESSION, request.values, request.delta)
     try:
         # Create directory if it doesn't exist
         form_values_path = os.path.join(UPLOADS_DIR, "form_values.json")
         os.makedirs(os.path.dirname(form_values_path), exist_ok=True)
 
+        values = state.as_list()
         with open(form_values_path, "w") as f:
-            json.dump(request.values, f, indent=2)
+            json.dump(values, f, indent=2)
 
+        if request.delta is not None:
+            # Don't echo the whole form back for a delta
+            return {"message": "Form values updated successfully", "formVersion": state.version}
         return {
             "message": "Form values updated successfully",
-            "values": request.values
+            "values": values,
+            "formVersion": state.version
         }
     except Exception as e:
         logging.error(f"Error updating form values: {e}")
@@ -1887,8 +2148,9 @@ async def get_form_values():
 @app.post("/update-user-info")
 async def update_user_info_endpoint(request: UserInfoRequest):
     """Update user info."""
+    profile_id = resolve_profile_id(request.profileId)
     try:
-        update_user_info_json(request.info)
+        update_user_info_json(request.info, profile_id=profile_id)
         return {
             "message": "User info updated successfully",
             "info": request.info
@@ -1898,15 +2160,67 @@ async def update_user_info_endpoint(request: UserInfoRequest):
         raise HTTPException(status_code=500, detail=f"Failed to update user info: {str(e)}")
 
 @app.get("/get-user-info")
-async def get_user_info():
+async def get_user_info(profileId: Optional[str] = None):
     """Get user info."""
+    profile_id = resolve_profile_id(profileId)
     try:
-        info = load_user_info()
+        info = load_user_info(profile_id=profile_id)
         return {"info": info}
     except Exception as e:
         logging.error(f"Error getting user info: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to get user info: {str(e)}")
 
+@app.get("/metrics/prompt-cache")
+async def get_prompt_cache_metrics():
+    """Report prompt template versions and provider prompt-cache hit rates."""
+    return {
+        "templates": list_templates(),
+        "stats": prompt_cache_stats.snapshot()
+    }
+
+@app.get("/metrics/llm")
+async def get_llm_metrics():
+    """Return LLM routes plus per-provider latency percentiles, retry/hedge counts and circuit state."""
+    return llm_router.metrics()
+
+def require_admin(token: Optional[str]):
+    if ADMIN_TOKEN and token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@app.get("/admin/form-templates")
+async def list_form_templates(x_admin_token: Optional[str] = Header(None)):
+    """List cached form templates with their hit counts."""
+    require_admin(x_admin_token)
+    return {"templates": template_registry.templates()}
+
+@app.delete("/admin/form-templates/{template_id}")
+async def invalidate_form_template(template_id: str, x_admin_token: Optional[str] = Header(None)):
+    """Drop one cached template so its next upload is extracted again."""
+    require_admin(x_admin_token)
+    if not template_registry.invalidate(template_id):
+        raise HTTPException(status_code=404, detail=f"Unknown form template: {template_id}")
+    return {"status": "success", "templateId": template_id}
+
+@app.delete("/admin/form-templates")
+async def clear_form_templates(x_admin_token: Optional[str] = Header(None)):
+    """Drop every cached template."""
+    require_admin(x_admin_token)
+    return {"status": "success", "removed": template_registry.clear()}
+
+@app.get("/admin/form-layouts")
+async def list_form_layouts(x_admin_token: Optional[str] = Header(None)):
+    """List forms recognisable from their layout fingerprint."""
+    require_admin(x_admin_token)
+    return {"forms": get_layout_index().forms()}
+
+@app.delete("/admin/form-layouts/{form_key}")
+async def remove_form_layout(form_key: str, x_admin_token: Optional[str] = Header(None)):
+    """Forget a form layout so its next photo goes through OCR and the LLM again."""
+    require_admin(x_admin_token)
+    if not get_layout_index().remove(form_key):
+        raise HTTPException(status_code=404, detail=f"Unknown form layout: {form_key}")
+    return {"status": "success", "formKey": form_key}
+
 @app.post("/vision/detect-document")
 async def detect_document_endpoint(file: UploadFile = File(...)):
     """Detect document boundaries in camera feed."""
@@ -1923,6 +2237,24 @@ async def detect_document_endpoint(file: UploadFile = File(...)):
         logging.error(f"Error detecting document: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def ocr_label_coordinates(image, form_fields):
+    """Pixel coordinates (left, top) of each field's label as found by OCR."""
+    data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
+    words = [
+        (re.sub(r'[^a-z0-9]', '', word.lower()), data['left'][i], data['top'][i])
+        for i, word in enumerate(data['text']) if word.strip()
+    ]
+    coordinates = {}
+    for field in form_fields:
+        label_words = [w for w in (re.sub(r'[^a-z0-9]', '', part.lower()) for part in str(field.get('label', '')).split()) if w]
+        if not label_words:
+            continue
+        for i in range(len(words) - len(label_words) + 1):
+            if all(words[i + j][0] == label_words[j] for j in range(len(label_words))):
+                coordinates[field.get('id') or field['label']] = (words[i][1], words[i][2])
+                break
+    return coordinates
+
 @app.post("/vision/process-camera-image")  
 async def process_camera_image_endpoint(file: UploadFile = File(...)):
     """Process camera-captured blank form image and create form structure."""
@@ -1933,8 +2265,32 @@ async def process_camera_image_endpoint(file: UploadFile = File(...)):
         # Enhance image quality
         enhanced_image = enhance_document_image(image_bytes)
 
-        # Extract form structure from blank form
-        form_fields = process_camera_image_for_form_structure(enhanced_image)
+        # A form seen before is recognised from its layout alone: no OCR, no LLM
+        layout_index = get_layout_index()
+        image = Image.open(io.BytesIO(enhanced_image))
+        fingerprint = None
+        try:
+            fingerprint = layout_fingerprint(image)
+        except Exception as e:
+            logging.warning(f"Could not fingerprint camera image: {e}")
+        # PDF writer templates store a different schema shape; only camera-learned forms apply here
+        match = layout_index.nearest(fingerprint, kind="camera") if fingerprint is not None else None
+
+        if match is not None:
+            form_fields = match.schema
+            field_coordinates = match.coordinates_for(image.size)
+        else:
+            # Extract form structure from blank form
+            form_fields = process_camera_image_for_form_structure(enhanced_image)
+            field_coordinates = {}
+            if form_fields and fingerprint is not None:
+                try:
+                    field_coordinates = ocr_label_coordinates(image, form_fields)
+                except Exception as e:
+                    logging.warning(f"Could not locate field labels: {e}")
+                layout_index.learn(f"camera-{content_hash(enhanced_image)[:12]}", fingerprint,
+                                   schema=form_fields, coordinates=field_coordinates, size=image.size,
+                                   kind="camera")
 
         if not form_fields:
             return {"success": False, "message": "No form fields could be detected in the image"}
@@ -1962,7 +2318,9 @@ async def process_camera_image_endpoint(file: UploadFile = File(...)):
             "success": True,
             "message": f"Successfully created form with {len(form_fields)} fields",
             "form_path": curr_form_path,
-            "form_structure": form_structure
+            "form_structure": form_structure,
+            "field_coordinates": field_coordinates,
+            "recognized_form": match.form_key if match else None
         }
 
     except Exception as e:
@@ -1980,9 +2338,73 @@ except Exception:
         sys.path.append(str(voice_module_path))
     voice_helper = importlib.import_module("voice")
 
+# Fixed voice replies: their audio is synthesized once in the background at startup
+# and kept in the TTS cache (on disk too), so they play without a TTS round trip
+VOICE_FALLBACK_REPLY = "Yes, I can hear you perfectly! I'm here to help you with your medical form. What would you like me to help you with?"
+UPLOAD_PROCESSED_SENTENCE = "The document has been processed and is now available for questions."
+UPLOAD_PROFILE_UPDATED_SENTENCE = "I've also updated your personal information based on the document contents."
+UPLOAD_AMBIGUOUS_REPLY = "I found some PDF files but couldn't determine which one you meant. Please be more specific."
+CLINIC_PATIENT_NEEDED_REPLY = "I need to know which patient you're asking about. Please say something like 'Tell me about patient John Doe' or 'What are the allergies for Jane Smith?'"
+CLINIC_PATIENT_NEEDED_TYPED_REPLY = "I need to know which patient you're asking about. Please specify the patient's name."
+CLINIC_QUERY_ERROR_REPLY = "I encountered an error retrieving the patient information. Please try again."
+CLINIC_TYPED_QUERY_ERROR_REPLY = "I encountered an error while processing your question. Please try again."
+
+
+def fields_updated_reply(count: int) -> str:
+    return f"I've updated {count} field{'s' if count != 1 else ''} in your form for you."
+
+
+VOICE_CANNED_REPLIES = [
+    VOICE_FALLBACK_REPLY,
+    UPLOAD_PROCESSED_SENTENCE,
+    UPLOAD_PROFILE_UPDATED_SENTENCE,
+    UPLOAD_AMBIGUOUS_REPLY,
+    CLINIC_PATIENT_NEEDED_REPLY,
+    CLINIC_PATIENT_NEEDED_TYPED_REPLY,
+    CLINIC_QUERY_ERROR_REPLY,
+    CLINIC_TYPED_QUERY_ERROR_REPLY,
+] + [fields_updated_reply(count) for count in range(1, 11)]
+# Streamed replies are synthesized sentence by sentence, so those are the cache keys that get hit
+VOICE_CANNED_SPEECH = list(dict.fromkeys(
+    text for reply in VOICE_CANNED_REPLIES for text in [reply, *speech_sentences(reply)]
+))
+
+if os.getenv("TTS_PREWARM", "1").lower() in ("1", "true", "yes"):
+    threading.Thread(target=voice_helper.warm_tts_cache, args=(VOICE_CANNED_SPEECH,), name="tts-prewarm", daemon=True).start()
+
+@app.get("/metrics/tts-cache")
+async def get_tts_cache_metrics():
+    """TTS cache size and hit counts."""
+    return voice_helper.tts_cache.stats()
+
+# Where voice uploads look for PDFs ("upload my W-2"), after any location the user named
+VOICE_UPLOAD_LOCATIONS = [
+    "~/Desktop", "~/Downloads", "~/Documents",
+    ".", "./uploads"  # Current directory and uploads folder
+]
+
+# PDFs in those locations are indexed in the background, so an upload request scores
+# candidates from cached features instead of parsing every file
+if os.getenv("DOCUMENT_INDEX", "1").lower() in ("1", "true", "yes"):
+    voice_helper.document_index.refresh_interval = float(os.getenv("DOCUMENT_INDEX_REFRESH_SECONDS", "60"))
+    voice_helper.document_index.watch(VOICE_UPLOAD_LOCATIONS)
+    voice_helper.document_index.start()
+
+@app.get("/metrics/document-index")
+async def get_document_index_metrics():
+    """Indexed PDFs for voice uploads and how often lookups were served from the index."""
+    return voice_helper.document_index.stats()
+
+voice_gateway = VoiceGateway(workers=VOICE_WORKERS, max_pending=VOICE_MAX_PENDING)
+
+@app.get("/metrics/voice")
+async def get_voice_metrics():
+    """Voice worker pool backlog plus per-session latency percentiles (asr, llm, tts...)."""
+    return voice_gateway.metrics()
+
 def is_update_request_py(message: str, chat_history: str = "", form_fields: str = "") -> bool:
     """
-    Use a small, fast OpenAI model to determine if the user wants to update the form.
+    Use a small, fast model to determine if the user wants to update the form.
     
     Args:
         message: The current user message
@@ -1993,8 +2415,8 @@ def is_update_request_py(message: str, chat_history: str = "", form_fields: str
         bool: True if the user wants to update the form, False otherwise
     """
     try:
-        # Use a very small, fast model for this classification task
-        # gpt-4.1-nano is the smallest and fastest GPT-4 model
+        # Use a very small, fast model for this classification task. The router
+        # sends it to the local model; gpt-4.1-nano is used when it falls back to OpenAI
         fast_model = "gpt-4.1-nano"
         
         # Build context for the model
@@ -2004,7 +2426,7 @@ def is_update_request_py(message: str, chat_history: str = "", form_fields: str
             context_parts.append(f"CONVERSATION HISTORY:\n{chat_history}")
         
         if form_fields:
-            context_parts.append(f"CURRENT FORM FIELDS:\n{form_fields}")
+            context_parts.append(f"CURRENT FORM FIELDS:\n{project_form_fields(form_fields, message)}")
         
         context = "\n\n".join(context_parts) if context_parts else "No previous context available."
         
@@ -2033,11 +2455,13 @@ NON-MODIFY indicators:
 
 RESPONSE: Answer with ONLY "YES" (if form should be modified) or "NO" (if no modification needed) - no other text."""
 
-        response = openai_client.chat.completions.create(
-            model=fast_model,
-            messages=[
+        response = llm_router.chat(
+            "classify_update_request",
+            [
                 {"role": "user", "content": prompt}
             ],
+            model=fast_model,
+            timeout=5,
             temperature=0.1,
             max_tokens=5,  # Very short response
         )
@@ -2093,10 +2517,7 @@ async def handle_voice_file_upload(upload_request: dict) -> dict:
             search_locations.append(upload_request["file_location"])
 
         # Add common locations as fallback
-        search_locations.extend([
-            "~/Desktop", "~/Downloads", "~/Documents", 
-            ".", "./uploads"  # Current directory and uploads folder
-        ])
+        search_locations.extend(VOICE_UPLOAD_LOCATIONS)
 
         # Search for PDF files
         found_files = []
@@ -2111,13 +2532,13 @@ async def handle_voice_file_upload(upload_request: dict) -> dict:
                 "message": f"I couldn't find any PDF files in {locations_str}. Please make sure the file exists and try again."
             }
 
-        # Select the best match
-        selected_file = voice_helper.select_best_pdf_match(found_files, upload_request)
+        # Select the best match (may parse PDFs the index hasn't seen yet, so off the event loop)
+        selected_file = await asyncio.to_thread(voice_helper.select_best_pdf_match, found_files, upload_request)
 
         if not selected_file:
             return {
                 "success": False,
-                "message": "I found some PDF files but couldn't determine which one you meant. Please be more specific."
+                "message": UPLOAD_AMBIGUOUS_REPLY
             }
 
         # Copy the file to uploads directory
@@ -2161,17 +2582,266 @@ async def voice_ws(websocket: WebSocket):
 
     await websocket.accept()
 
-    # Conversation memory (mirrors UI chat) – list of {type, content}
-    conversation = []  # type: list[dict[str, str]]
+    # Conversation memory (mirrors UI chat) – older turns are compacted into a rolling summary
+    conversation = ConversationContext(chat_context_compactor)
 
     audio_chunks: list[bytes] = []
 
-    # Store form fields for context (will be sent by frontend)
-    current_form_fields = None
+    # Store form fields for context (sent by frontend as FORM_FIELDS snapshots or FORM_DELTA diffs)
+    current_form_fields = FormState()
 
     # Store user's selected language (default to English)
     selected_language = "en"
 
+    # Patient/session whose profile this connection reads and updates
+    try:
+        profile_id = normalize_profile_id(websocket.query_params.get("profileId"))
+    except ValueError:
+        profile_id = DEFAULT_PROFILE
+
+    # Clients that opt in get TTS audio framed as audio_start / chunks / audio_end
+    stream_audio = wants_stream(websocket.query_params.get("ttsStream"))
+    # TTS synthesis runs as jobs on the shared voice pool, so it counts towards its backlog
+    audio_streamer = AudioStreamer(websocket, voice_helper.tts_format(), run_blocking=voice_gateway.run)
+
+    # Utterances run off the receive loop, their blocking stages on the shared voice worker pool
+    session = voice_gateway.open("voice")
+
+    # Streaming ASR: raw 16 kHz PCM in, partial transcripts out, server-side VAD ends utterances
+    async def send_partial_transcript(text: str) -> None:
+        await websocket.send_json({"type": "partial_transcript", "content": text})
+
+    def streaming_asr() -> StreamingTranscriber:
+        return StreamingTranscriber(
+            lambda audio: voice_helper.transcribe(audio, filename="audio.wav"),
+            on_partial=send_partial_transcript,
+            # Talking over the assistant cancels its reply before the new utterance is even transcribed
+            on_speech=lambda: barge_in(websocket, session, "speech"),
+            run_blocking=voice_gateway.run,
+        )
+
+    asr_stream = streaming_asr() if wants_stream(websocket.query_params.get("asrStream")) else None
+
+    async def respond_streamed(transcript: Optional[str]) -> None:
+        if not is_usable_transcript(transcript):
+            await websocket.send_json({"type": "error", "content": "Could not understand the audio. Please try speaking more clearly."})
+            return
+        logging.info("voice_ws: streamed transcript='%s'", transcript)
+        await websocket.send_json({"type": "final_transcript", "content": transcript})
+        await respond(transcript)
+
+    async def respond(transcript: str) -> None:
+        """Answer one transcribed utterance with text and speech."""
+        # Append user message to conv memory (server-side only)
+        conversation.append("user", transcript)
+
+        # Check if this is a file upload request
+        upload_request = voice_helper.detect_file_upload_request(transcript)
+        # Speech already streaming while the reply is generated, if any
+        speech: Optional[SpeechPipeline] = None
+
+        if upload_request["is_upload_request"]:
+            # Handle voice-controlled file upload
+            try:
+                upload_result = await handle_voice_file_upload(upload_request)
+
+                if upload_result["success"]:
+                    # File uploaded successfully - provide feedback
+                    reply_text = upload_result["message"]
+
+                    # Process the uploaded file through existing RAG pipeline
+                    file_path = upload_result["file_path"]
+                    filename = os.path.basename(file_path)
+
+                    # Ingest the file into the RAG system
+                    data, _ = await session.run("ingest", ingest_file, file_path)
+
+                    if data:
+                        reply_text += f" {UPLOAD_PROCESSED_SENTENCE} You can ask me about the contents of {filename}."
+
+                        # Update user info from the document (faster than vector DB)
+                        try:
+                            current_info = load_user_info(profile_id=profile_id) or {}
+                            updated_info = await session.run("llm", update_user_info_from_doc_fast, file_path, current_info, profile_id=profile_id)
+                            if updated_info != current_info:
+                                reply_text += f" {UPLOAD_PROFILE_UPDATED_SENTENCE}"
+                        except Exception as e:
+                            logging.warning(f"Could not update user info from uploaded document: {e}")
+
+                        # AUTO-FILL: Automatically try to fill form fields after successful upload
+                        if current_form_fields:
+                            try:
+                                auto_fill_message = "Fill out any form fields you can from the uploaded document. Only include fields you have actual data for - do NOT include fields with placeholder or missing values."
+
+                                # TODO: How do we figure out when to autofill? Because the user will never ask for it. They will expect it.
+
+                                auto_fill_user_info = load_user_info(profile_id=profile_id)
+                                auto_fill_response = await session.run(
+                                    "llm",
+                                    answer_query,
+                                    None,
+                                    auto_fill_message,
+                                    user_info=auto_fill_user_info,
+                                    chat_history=conversation.render(auto_fill_user_info),
+                                    form_fields=current_form_fields,
+                                    language=selected_language
+                                )
+
+                                # Check if auto-fill response contains field updates
+                                field_updates_match = re.search(r'\{[\'"]field_updates[\'"]:\s*\[[\s\S]*?\]\}', auto_fill_response)
+                                if field_updates_match:
+                                    # Append the field updates to the main response so frontend can process them
+                                    reply_text += " " + field_updates_match.group(0)
+                                    logging.info(f"Voice upload: Auto-fill generated field updates: {field_updates_match.group(0)}")
+
+                            except Exception as e:
+                                logging.warning(f"Voice upload auto-fill failed: {e}")
+
+                    else:
+                        reply_text += " However, there was an issue processing the document content. You may need to upload it again."
+                else:
+                    # File upload failed
+                    reply_text = upload_result["message"]
+
+            except Exception as e:
+                logging.error(f"Voice file upload error: {e}")
+                reply_text = f"I encountered an error while trying to upload the file: {str(e)}"
+
+        else:
+            # Regular query processing (existing logic)
+            # Determine intent & call existing endpoints directly (function)
+            user_info = load_user_info(profile_id=profile_id)
+            chat_history = conversation.render(user_info)
+            is_update = await session.run("llm", is_update_request_py, transcript, chat_history, current_form_fields)
+            explanation_only = is_field_explanation_request_py(transcript)
+            allow_updates = (
+                is_update
+                or is_auto_fill_request_py(transcript)
+            ) and not explanation_only
+
+            # Streaming clients hear the answer while it is still being generated
+            speech = await start_speech(audio_streamer) if stream_audio else None
+            try:
+                logging.debug("voice_ws: calling answer_query (update=%s)", is_update)
+                reply_text = await session.run(
+                    "llm",
+                    answer_query,
+                    None,
+                    transcript,
+                    user_info=user_info,
+                    chat_history=chat_history,
+                    form_fields=current_form_fields,  # Include form fields for context
+                    allow_field_updates=allow_updates,
+                    language=selected_language,
+                    on_delta=speech.feeder() if speech else None,
+                )
+            except asyncio.CancelledError:
+                if speech:
+                    speech.cancel()
+                raise
+            except Exception as e:
+                if speech:
+                    # Ends the audio stream with whatever was already spoken
+                    await speech.finish()
+                await websocket.send_json({"type": "error", "content": f"LLM error: {e}"})
+                return
+
+        # Add assistant message to conv memory
+        conversation.append("assistant", reply_text)
+
+        # Clean the response for TTS (remove field update JSON)
+        cleaned_reply_text = clean_response_for_voice(reply_text)
+        logging.info("voice_ws: Original response: '%s'", reply_text)
+        logging.info("voice_ws: Cleaned response for TTS: '%s'", cleaned_reply_text)
+
+        if stream_audio:
+            # Audio goes out sentence by sentence as the TTS engine produces it; for answered
+            # queries it started while the model was still writing, before this text is complete
+            await websocket.send_text(json.dumps({
+                "type": "assistant_text",
+                "content": reply_text,
+                "user_transcript": transcript
+            }))
+            with session.timed("tts"):
+                if speech is None:
+                    await speak_streamed(audio_streamer, reply_text, fallback=cleaned_reply_text)
+                else:
+                    if not speech.fed:
+                        # Replies answer_query makes up without the model, e.g. on unreadable user info
+                        speech.feed(reply_text)
+                    await speech.finish(fallback=cleaned_reply_text)
+            return
+
+        # TTS
+        logging.debug("voice_ws: synthesizing TTS for reply (len=%d chars)", len(cleaned_reply_text))
+        try:
+            logging.info("voice_ws: calling TTS synthesis...")
+            audio_reply = await session.run("tts", collect_audio, lambda: voice_helper.synthesize_stream(cleaned_reply_text))
+            logging.info("voice_ws: TTS synthesis completed, got %d bytes", len(audio_reply))
+        except Exception as e:
+            logging.error("voice_ws: TTS synthesis failed: %s", e)
+            await websocket.send_json({"type": "error", "content": f"TTS failed: {e}"})
+            return
+
+        # Stream assistant text as JSON, then TTS audio
+        response_json = json.dumps({
+            "type": "assistant_text",
+            "content": reply_text,  # Send full response with JSON for frontend processing
+            "user_transcript": transcript  # Add the user's transcript
+        })
+        logging.debug("voice_ws: sending assistant text JSON")
+        await websocket.send_text(response_json)
+        logging.debug("voice_ws: assistant text sent, now streaming audio (%d bytes)", len(audio_reply))
+        # Send audio bytes
+        logging.info("voice_ws: sending audio bytes to client...")
+        await websocket.send_bytes(audio_reply)
+        logging.info("voice_ws: audio bytes sent successfully")
+
+    async def transcribe_and_respond(audio_bytes: bytes) -> None:
+        # Decode, trim silence and compress before the STT upload; silence never leaves the server
+        prepared = await session.run("preprocess", prepare_for_stt, audio_bytes)
+        if prepared is None:
+            await websocket.send_json({"type": "error", "content": "No speech detected. Please try speaking again."})
+            return
+
+        logging.debug("voice_ws: running ASR on %d bytes", len(prepared.audio))
+        # Speech-to-Text
+        try:
+            transcript = await session.run("asr", voice_helper.transcribe, prepared.audio, filename=prepared.filename)
+            logging.info("voice_ws: transcript='%s'", transcript)
+
+            # Check if transcription failed or is empty
+            if not transcript or transcript.strip() in ["[No speech detected]", "[Transcription failed", ""] or transcript.startswith("[Transcription failed"):
+                logging.warning("voice_ws: transcription failed or empty")
+                await websocket.send_json({"type": "error", "content": "Could not understand the audio. Please try speaking more clearly."})
+                return
+
+        except Exception as e:
+            logging.error("voice_ws: ASR exception: %s", e)
+            await websocket.send_json({"type": "error", "content": f"ASR failed: {e}"})
+            return
+
+        await respond(transcript)
+
+    async def submit_utterance(handler, supersede: bool = False, stages: Optional[Dict[str, float]] = None) -> bool:
+        try:
+            session.submit(handler, supersede=supersede, stages=stages)
+            return True
+        except VoiceGatewayBusy as e:
+            logging.warning(f"voice_ws: {session.name} rejected utterance: {e}")
+            await websocket.send_json({"type": "error", "content": str(e)})
+            return False
+
+    async def submit_transcription(transcription: asyncio.Task) -> None:
+        """Answer a streamed utterance once its final transcription (already running) completes."""
+        async def answer_transcription() -> None:
+            with session.timed("asr"):
+                transcript = await transcription
+            await respond_streamed(transcript)
+
+        if not await submit_utterance(answer_transcription, supersede=True):
+            transcription.cancel()
+
     try:
         while True:
             msg = await websocket.receive()
@@ -2181,6 +2851,17 @@ async def voice_ws(websocket: WebSocket):
                 audio_data = msg["bytes"]
                 logging.debug("voice_ws: received %d audio bytes", len(audio_data))
 
+                if asr_stream is not None:
+                    # Once VAD has seen the end of the utterance its transcription starts; it is
+                    # awaited by the utterance task, so this loop keeps reading frames and CANCEL
+                    transcription = await asr_stream.push(audio_data)
+                    if transcription is not None:
+                        await submit_transcription(transcription)
+                    continue
+
+                # A new recording means the user is talking again: drop the reply in progress
+                await barge_in(websocket, session, "audio")
+
                 # For the new single-blob approach, we expect larger chunks
                 if len(audio_data) > 1000:  # Substantial audio data
                     audio_chunks = [audio_data]  # Replace any previous chunks
@@ -2199,13 +2880,26 @@ async def voice_ws(websocket: WebSocket):
                 if text_msg.startswith("FORM_FIELDS:"):
                     try:
                         form_fields_json = text_msg[12:]  # Remove "FORM_FIELDS:" prefix
-                        current_form_fields = form_fields_json
+                        version = current_form_fields.replace(form_fields_json)
+                        await websocket.send_json({"type": "form_state", "version": version})
                         logging.debug("voice_ws: received form fields update")
                         continue
                     except Exception as e:
                         logging.error("voice_ws: error parsing form fields: %s", e)
                         continue
 
+                # Incremental form update against the last acknowledged version
+                if text_msg.startswith("FORM_DELTA:"):
+                    try:
+                        version = current_form_fields.apply(text_msg[11:])  # Remove "FORM_DELTA:" prefix
+                        await websocket.send_json({"type": "form_state", "version": version})
+                    except FormVersionConflict as e:
+                        # Client must resend a full FORM_FIELDS snapshot
+                        await websocket.send_json({"type": "form_state_conflict", "version": e.expected})
+                    except Exception as e:
+                        logging.error("voice_ws: error applying form delta: %s", e)
+                    continue
+
                 # Check for language preference update
                 if text_msg.startswith("LANGUAGE:"):
                     try:
@@ -2217,22 +2911,57 @@ async def voice_ws(websocket: WebSocket):
                         logging.error("voice_ws: error parsing language: %s", e)
                         continue
 
+                # Check for profile (patient/session) selection
+                if text_msg.startswith("PROFILE:"):
+                    try:
+                        profile_id = normalize_profile_id(text_msg[8:])  # Remove "PROFILE:" prefix
+                        logging.debug(f"voice_ws: profile set to {profile_id}")
+                    except ValueError as e:
+                        logging.error("voice_ws: error parsing profile: %s", e)
+                        await websocket.send_json({"type": "error", "content": "Invalid profile id"})
+                    continue
+
+                # Opt in to (or out of) streamed TTS audio
+                if text_msg.startswith("TTS_STREAM:"):
+                    stream_audio = wants_stream(text_msg[11:])  # Remove "TTS_STREAM:" prefix
+                    logging.debug(f"voice_ws: TTS streaming {'on' if stream_audio else 'off'}")
+                    continue
+
+                # Switch between streamed PCM with server-side VAD and END-delimited blobs
+                if text_msg.startswith("ASR_STREAM:"):
+                    asr_stream = streaming_asr() if wants_stream(text_msg[11:]) else None
+                    audio_chunks = []
+                    logging.debug(f"voice_ws: streaming ASR {'on' if asr_stream else 'off'}")
+                    continue
+
                 # Check for chat history update
                 if text_msg.startswith("CHAT_HISTORY:"):
                     try:
                         chat_history_json = text_msg[13:]  # Remove "CHAT_HISTORY:" prefix
                         chat_history_data = json.loads(chat_history_json)
-                        conversation = chat_history_data  # Restore conversation history
+                        conversation.replace(chat_history_data)  # Restore conversation history
                         logging.debug(f"voice_ws: restored chat history with {len(conversation)} messages")
                         continue
                     except Exception as e:
                         logging.error("voice_ws: error parsing chat history: %s", e)
                         continue
 
+                # Client asked to stop the current reply (e.g. a stop button)
+                if text_msg.upper() == "CANCEL":
+                    await barge_in(websocket, session, "client")
+                    continue
+
                 if text_msg.upper() != "END":
                     # Ignore other control messages for now
                     continue
 
+                if asr_stream is not None:
+                    # Client stopped recording mid-utterance: transcribe what was said so far
+                    transcription = asr_stream.flush()
+                    if transcription is not None:
+                        await submit_transcription(transcription)
+                    continue
+
                 # We have full audio → run ASR
                 if not audio_chunks:
                     await websocket.send_json({"type": "error", "content": "No audio received"})
@@ -2254,150 +2983,8 @@ async def voice_ws(websocket: WebSocket):
                     await websocket.send_json({"type": "error", "content": "Audio recording too large. Please try a shorter recording."})
                     continue
 
-                logging.debug("voice_ws: running ASR on %d bytes", len(audio_bytes))
-                # Speech-to-Text
-                try:
-                    transcript = voice_helper.transcribe(audio_bytes)
-                    logging.info("voice_ws: transcript='%s'", transcript)
-
-                    # Check if transcription failed or is empty
-                    if not transcript or transcript.strip() in ["[No speech detected]", "[Transcription failed", ""] or transcript.startswith("[Transcription failed"):
-                        logging.warning("voice_ws: transcription failed or empty")
-                        await websocket.send_json({"type": "error", "content": "Could not understand the audio. Please try speaking more clearly."})
-                        continue
-
-                except Exception as e:
-                    logging.error("voice_ws: ASR exception: %s", e)
-                    await websocket.send_json({"type": "error", "content": f"ASR failed: {e}"})
-                    continue
-
-                # Append user message to conv memory (server-side only)
-                conversation.append({"type": "user", "content": transcript})
-
-                # Check if this is a file upload request
-                upload_request = voice_helper.detect_file_upload_request(transcript)
-
-                if upload_request["is_upload_request"]:
-                    # Handle voice-controlled file upload
-                    try:
-                        upload_result = await handle_voice_file_upload(upload_request)
-
-                        if upload_result["success"]:
-                            # File uploaded successfully - provide feedback
-                            reply_text = upload_result["message"]
-
-                            # Process the uploaded file through existing RAG pipeline
-                            file_path = upload_result["file_path"]
-                            filename = os.path.basename(file_path)
-
-                            # Ingest the file into the RAG system
-                            data, _ = ingest_file(file_path)
-
-                            if data:
-                                reply_text += f" The document has been processed and is now available for questions. You can ask me about the contents of {filename}."
-
-                                # Update user info from the document (faster than vector DB)
-                                try:
-                                    current_info = load_user_info() or {}
-                                    updated_info = update_user_info_from_doc_fast(file_path, current_info)
-                                    if updated_info != current_info:
-                                        reply_text += " I've also updated your personal information based on the document contents."
-                                except Exception as e:
-                                    logging.warning(f"Could not update user info from uploaded document: {e}")
-
-                                # AUTO-FILL: Automatically try to fill form fields after successful upload
-                                if current_form_fields:
-                                    try:
-                                        auto_fill_message = "Fill out any form fields you can from the uploaded document. Only include fields you have actual data for - do NOT include fields with placeholder or missing values."
-
-                                        # TODO: How do we figure out when to autofill? Because the user will never ask for it. They will expect it.
-
-                                        auto_fill_response = answer_query(
-                                            None,
-                                            auto_fill_message,
-                                            user_info=load_user_info(),
-                                            chat_history="\n".join([f"{m['type']}: {m['content']}" for m in conversation]),
-                                            form_fields=current_form_fields,
-                                            language=selected_language
-                                        )
-
-                                        # Check if auto-fill response contains field updates
-                                        field_updates_match = re.search(r'\{[\'"]field_updates[\'"]:\s*\[[\s\S]*?\]\}', auto_fill_response)
-                                        if field_updates_match:
-                                            # Append the field updates to the main response so frontend can process them
-                                            reply_text += " " + field_updates_match.group(0)
-                                            logging.info(f"Voice upload: Auto-fill generated field updates: {field_updates_match.group(0)}")
-
-                                    except Exception as e:
-                                        logging.warning(f"Voice upload auto-fill failed: {e}")
-
-                            else:
-                                reply_text += " However, there was an issue processing the document content. You may need to upload it again."
-                        else:
-                            # File upload failed
-                            reply_text = upload_result["message"]
-
-                    except Exception as e:
-                        logging.error(f"Voice file upload error: {e}")
-                        reply_text = f"I encountered an error while trying to upload the file: {str(e)}"
-
-                else:
-                    # Regular query processing (existing logic)
-                    # Determine intent & call existing endpoints directly (function)
-                    is_update = is_update_request_py(transcript, "\n".join([f"{m['type']}: {m['content']}" for m in conversation]), current_form_fields)
-                    explanation_only = is_field_explanation_request_py(transcript)
-                    allow_updates = (
-                        is_update
-                        or is_auto_fill_request_py(transcript)
-                    ) and not explanation_only
-
-                    try:
-                        logging.debug("voice_ws: calling answer_query (update=%s)", is_update)
-                        reply_text = answer_query(
-                            None,
-                            transcript,
-                            user_info=load_user_info(),
-                            chat_history="\n".join([f"{m['type']}: {m['content']}" for m in conversation]),
-                            form_fields=current_form_fields,  # Include form fields for context
-                            allow_field_updates=allow_updates,
-                            language=selected_language
-                        )
-                    except Exception as e:
-                        await websocket.send_json({"type": "error", "content": f"LLM error: {e}"})
-                        continue
-
-                # Add assistant message to conv memory
-                conversation.append({"type": "assistant", "content": reply_text})
-
-                # Clean the response for TTS (remove field update JSON)
-                cleaned_reply_text = clean_response_for_voice(reply_text)
-                logging.info("voice_ws: Original response: '%s'", reply_text)
-                logging.info("voice_ws: Cleaned response for TTS: '%s'", cleaned_reply_text)
-
-                # TTS
-                logging.debug("voice_ws: synthesizing TTS for reply (len=%d chars)", len(cleaned_reply_text))
-                try:
-                    logging.info("voice_ws: calling TTS synthesis...")
-                    audio_reply = voice_helper.synthesize(cleaned_reply_text)
-                    logging.info("voice_ws: TTS synthesis completed, got %d bytes", len(audio_reply))
-                except Exception as e:
-                    logging.error("voice_ws: TTS synthesis failed: %s", e)
-                    await websocket.send_json({"type": "error", "content": f"TTS failed: {e}"})
-                    continue
-
-                # Stream assistant text as JSON, then TTS audio
-                response_json = json.dumps({
-                    "type": "assistant_text",
-                    "content": reply_text,  # Send full response with JSON for frontend processing
-                    "user_transcript": transcript  # Add the user's transcript
-                })
-                logging.debug("voice_ws: sending assistant text JSON")
-                await websocket.send_text(response_json)
-                logging.debug("voice_ws: assistant text sent, now streaming audio (%d bytes)", len(audio_reply))
-                # Send audio bytes
-                logging.info("voice_ws: sending audio bytes to client...")
-                await websocket.send_bytes(audio_reply)
-                logging.info("voice_ws: audio bytes sent successfully")
+                # The utterance runs on the session's queue; a new one cancels it (barge-in)
+                await submit_utterance(lambda audio=audio_bytes: transcribe_and_respond(audio), supersede=True)
 
     except WebSocketDisconnect:
         # Clean disconnect
@@ -2417,6 +3004,31 @@ async def voice_ws(websocket: WebSocket):
                 await websocket.close()
         except Exception as close_error:
             logging.error("voice_ws: Failed to close WebSocket: %s", close_error)
+    finally:
+        # Nobody is listening for replies still in flight
+        await session.close()
+
+async def barge_in(websocket: WebSocket, session: VoiceSession, reason: str) -> None:
+    """Cancel the session's queued and in-flight replies and tell the client, if there were any."""
+    if session.cancel():
+        logging.info(f"{session.name}: reply cancelled ({reason})")
+        await websocket.send_json({"type": "reply_cancelled", "reason": reason})
+
+async def start_speech(audio_streamer: AudioStreamer) -> SpeechPipeline:
+    """Open a sentence-by-sentence speech stream; feed it text, then ``finish`` it."""
+    speech = SpeechPipeline(audio_streamer, voice_helper.synthesize_stream, max_parallel=VOICE_TTS_PARALLELISM)
+    await speech.start()
+    return speech
+
+async def speak_streamed(audio_streamer: AudioStreamer, reply_text: str, fallback: Optional[str] = None) -> None:
+    """
+    Stream a reply as speech: sentences are synthesized ahead in parallel and
+    sent in order, with any field_updates JSON left out. ``fallback`` is spoken
+    when nothing speakable remains.
+    """
+    speech = await start_speech(audio_streamer)
+    speech.feed(reply_text)
+    await speech.finish(fallback=fallback)
 
 def clean_response_for_voice(response_text: str) -> str:
     """
@@ -2430,9 +3042,8 @@ def clean_response_for_voice(response_text: str) -> str:
         # Remove the field updates JSON from the response
         cleaned_response = response_text.replace(field_updates_match.group(0), "").strip()
 
-        # Clean up any redundant text that might be left
-        cleaned_response = re.sub(r'\s*Based on the information I have, I was able to fill out some of the form for you!\s*', '', cleaned_response)
-        cleaned_response = re.sub(r'\s*Here\'s the updated information:\s*', '', cleaned_response)
+        # Clean up any redundant text that might be left (streamed replies drop the same lead-ins)
+        cleaned_response = strip_boilerplate(cleaned_response)
 
         # If we're left with an empty response after cleaning, provide a fallback
         if not cleaned_response.strip():
@@ -2444,20 +3055,63 @@ def clean_response_for_voice(response_text: str) -> str:
                 field_updates = updates_obj.get('field_updates', [])
 
                 if field_updates:
-                    return f"I've updated {len(field_updates)} field{'s' if len(field_updates) != 1 else ''} in your form for you."
+                    return fields_updated_reply(len(field_updates))
                 else:
-                    return "Yes, I can hear you perfectly! I'm here to help you with your medical form. What would you like me to help you with?"
+                    return VOICE_FALLBACK_REPLY
             except:
-                return "Yes, I can hear you perfectly! I'm here to help you with your medical form. What would you like me to help you with?"
+                return VOICE_FALLBACK_REPLY
 
         return cleaned_response
 
     # If no JSON found, return the original response (but ensure it's not empty)
     if not response_text.strip():
-        return "Yes, I can hear you perfectly! I'm here to help you with your medical form. What would you like me to help you with?"
+        return VOICE_FALLBACK_REPLY
 
     return response_text
 
+FORM_GENERATION_TEMPLATE = register_template(PromptTemplate(
+    name="generate_form",
+    version="2",
+    instructions=(
+        "You are a medical form design expert. Your task is to create a comprehensive medical form based on a description provided by a healthcare professional.\n\n"
+        "TASK: Generate a complete form structure in JSON format that matches the description provided.\n\n"
+        "GUIDELINES:\n"
+        "- Create a SINGLE-LEVEL JSON structure with proper nesting for logical grouping\n"
+        "- Use the same field type system as existing forms: 'text', 'boolean', 'date', 'table'\n"
+        "- For data that is semantically structured, maintain hierarchical organization:\n"
+        "  INSTEAD OF: {'text1': {'Patient name': ''}}, {'text2': {'Patient phone': ''}}\n"
+        "  USE: {'Patient': {'text1': {'Name': ''}, 'text2': {'Phone number': ''}}}\n"
+        "- Include ALL fields that would be relevant for the described form\n"
+        "- Add any standard medical fields that would typically be included\n"
+        "- Use common sense to group related fields together\n"
+        "- Ensure keys are specific and self-explanatory\n"
+        "- If there are multiple instances of similar fields, keep all of them\n"
+        "- For table-type data (like medications, procedures, etc.), use the 'table' type\n"
+        "- For checkboxes or yes/no questions, use 'boolean' type\n"
+        "- For date fields, use 'date' type\n"
+        "- For text input, use 'text' type\n"
+        "- Indicate each field's type as a parent JSON key followed by a number (e.g., 'text1', 'boolean2')\n"
+        "- You can use ANY number after the type - text1, text2, text3... text50, text100, etc.\n"
+        "- Each field needs a unique typed key, even if there are multiple fields of the same type\n"
+        "- For tables, precede the table column fields with a parent JSON key indicating 'table' type\n"
+        "- Include disclaimers, instructions, or read-only text as direct string values under descriptive keys\n"
+        "- Always include an 'Other comments' field at the very end for additional information\n\n"
+        "EXAMPLES OF PROPER STRUCTURE:\n"
+        "1. Patient intake form: {'Patient Information': {'text1': {'Full Name': ''}, 'date1': {'Date of Birth': ''}, 'text2': {'Phone Number': ''}}}\n"
+        "2. Medication list: {'Current Medications': {'table1': {'text1': {'Medication Name': ''}, 'text2': {'Dosage': ''}, 'text3': {'Frequency': ''}, 'date1': {'Start Date': ''}}}}\n"
+        "3. Allergy section: {'Allergies': {'boolean1': {'Has Allergies': false}, 'text1': {'Allergy Details': ''}}}\n\n"
+        "IMPORTANT: Only use double quotes for JSON keys and provide a properly formatted JSON object.\n"
+        "Create sections/subheaders as you see fit, and add any fields that would be relevant but not explicitly mentioned.\n"
+        "The ONLY types you can use are 'text', 'boolean', 'date', and 'table'. Don't use other types.\n"
+        "If there is any data that wouldn't make sense as a form field, do NOT include it in the output JSON."
+    ),
+    sections=[
+        ("FORM DESCRIPTION", "description"),
+        ("CONTEXT", "context_info"),
+    ],
+    trailer="OUTPUT (NESTED JSON ONLY, NO OTHER TEXT):",
+))
+
 def generate_form_from_description(description: str, category: str = "", audience: str = ""):
     """Generate a form template from a description using AI."""
     try:
@@ -2470,52 +3124,21 @@ def generate_form_from_description(description: str, category: str = "", audienc
         if audience:
             context_info += f"Primary Audience: {audience}\n"
         
-        prompt = (
-            "You are a medical form design expert. Your task is to create a comprehensive medical form based on a description provided by a healthcare professional.\n\n"
-            "TASK: Generate a complete form structure in JSON format that matches the description provided.\n\n"
-            "GUIDELINES:\n"
-            "- Create a SINGLE-LEVEL JSON structure with proper nesting for logical grouping\n"
-            "- Use the same field type system as existing forms: 'text', 'boolean', 'date', 'table'\n"
-            "- For data that is semantically structured, maintain hierarchical organization:\n"
-            "  INSTEAD OF: {'text1': {'Patient name': ''}}, {'text2': {'Patient phone': ''}}\n"
-            "  USE: {'Patient': {'text1': {'Name': ''}, 'text2': {'Phone number': ''}}}\n"
-            "- Include ALL fields that would be relevant for the described form\n"
-            "- Add any standard medical fields that would typically be included\n"
-            "- Use common sense to group related fields together\n"
-            "- Ensure keys are specific and self-explanatory\n"
-            "- If there are multiple instances of similar fields, keep all of them\n"
-            "- For table-type data (like medications, procedures, etc.), use the 'table' type\n"
-            "- For checkboxes or yes/no questions, use 'boolean' type\n"
-            "- For date fields, use 'date' type\n"
-            "- For text input, use 'text' type\n"
-            "- Indicate each field's type as a parent JSON key followed by a number (e.g., 'text1', 'boolean2')\n"
-            "- You can use ANY number after the type - text1, text2, text3... text50, text100, etc.\n"
-            "- Each field needs a unique typed key, even if there are multiple fields of the same type\n"
-            "- For tables, precede the table column fields with a parent JSON key indicating 'table' type\n"
-            "- Include disclaimers, instructions, or read-only text as direct string values under descriptive keys\n"
-            "- Always include an 'Other comments' field at the very end for additional information\n\n"
-            "EXAMPLES OF PROPER STRUCTURE:\n"
-            "1. Patient intake form: {'Patient Information': {'text1': {'Full Name': ''}, 'date1': {'Date of Birth': ''}, 'text2': {'Phone Number': ''}}}\n"
-            "2. Medication list: {'Current Medications': {'table1': {'text1': {'Medication Name': ''}, 'text2': {'Dosage': ''}, 'text3': {'Frequency': ''}, 'date1': {'Start Date': ''}}}}\n"
-            "3. Allergy section: {'Allergies': {'boolean1': {'Has Allergies': false}, 'text1': {'Allergy Details': ''}}}\n\n"
-            "IMPORTANT: Only use double quotes for JSON keys and provide a properly formatted JSON object.\n"
-            "Create sections/subheaders as you see fit, and add any fields that would be relevant but not explicitly mentioned.\n"
-            "The ONLY types you can use are 'text', 'boolean', 'date', and 'table'. Don't use other types.\n"
-            "If there is any data that wouldn't make sense as a form field, do NOT include it in the output JSON.\n\n"
-            f"FORM DESCRIPTION:\n{description}\n\n"
-            f"CONTEXT:\n{context_info}\n\n"
-            "OUTPUT (NESTED JSON ONLY, NO OTHER TEXT):"
+        template_key, messages = render_prompt(
+            FORM_GENERATION_TEMPLATE.name,
+            description=description,
+            context_info=context_info,
         )
         
-        logging.info(f"Prompt text: {prompt}")
+        logging.info(f"Prompt messages ({template_key}): {messages}")
         
-        response = openai_client.chat.completions.create(
-            model=OPENAI_MODEL_NAME,
-            messages=[
-                {"role": "user", "content": prompt}
-            ],
+        response = llm_router.chat(
+            "generate_form",
+            messages,
+            timeout=60,
             temperature=0.1,
         )
+        record_usage(template_key, response)
         
         logging.info(f"OpenAI response: {response}")
         
@@ -2595,64 +3218,43 @@ async def clinic_voice_ws(websocket: WebSocket):
     current_patient = None  # Track which patient we're discussing
     
     audio_chunks: list[bytes] = []
-    
-    try:
-        while True:
-            msg = await websocket.receive()
-            
-            # Binary frame – append to buffer
-            if "bytes" in msg and msg["bytes"] is not None:
-                audio_data = msg["bytes"]
-                logging.debug("clinic_voice_ws: received %d audio bytes", len(audio_data))
-                
-                if len(audio_data) > 1000:  # Substantial audio data
-                    audio_chunks = [audio_data]
-                    logging.debug("clinic_voice_ws: received substantial audio blob")
-                else:
-                    audio_chunks.append(audio_data)
-                continue
-            
-            # Text frame acts as control
-            if "text" in msg and msg["text"]:
-                text_msg = msg["text"].strip()
-                
-                # ---------------- Handle manual typed queries ----------------
-                try:
-                    data_json = json.loads(text_msg)
-                except ValueError:
-                    data_json = None
 
-                if isinstance(data_json, dict) and data_json.get("type") == "text_query":
-                    transcript = str(data_json.get("transcript", "")).strip()
-                    if not transcript:
-                        await websocket.send_json({"type": "error", "content": "Empty query received"})
-                        continue
+    stream_audio = wants_stream(websocket.query_params.get("ttsStream"))
+    # TTS synthesis runs as jobs on the shared voice pool, so it counts towards its backlog
+    audio_streamer = AudioStreamer(websocket, voice_helper.tts_format(), run_blocking=voice_gateway.run)
 
-                    # Add to conversation
-                    conversation.append({"type": "doctor", "content": transcript})
+    # Queries run off the receive loop, their blocking EHR/LLM/STT/TTS calls on the shared voice
+    # worker pool, so a new recording or CANCEL can interrupt a reply in progress
+    session = voice_gateway.open("clinic")
 
-                    # Process the doctor's query (reuse logic)
-                    try:
-                        import re
-                        patient_pattern = r"(?:patient|about|for|regarding)\s+([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)"
-                        match = re.search(patient_pattern, transcript, re.IGNORECASE)
+    async def answer_typed(transcript: str) -> None:
+        """Answer a typed doctor query with text and speech."""
+        nonlocal current_patient
+        # Add to conversation
+        conversation.append({"type": "doctor", "content": transcript})
 
-                        if match:
-                            current_patient = match.group(1).strip()
-                            logging.info(f"clinic_voice_ws (typed): Identified patient: {current_patient}")
+        # Process the doctor's query (reuse logic)
+        try:
+            import re
+            patient_pattern = r"(?:patient|about|for|regarding)\s+([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)"
+            match = re.search(patient_pattern, transcript, re.IGNORECASE)
+
+            if match:
+                current_patient = match.group(1).strip()
+                logging.info(f"clinic_voice_ws (typed): Identified patient: {current_patient}")
 
-                        if not current_patient:
-                            reply_text = "I need to know which patient you're asking about. Please specify the patient's name."
-                        else:
-                            patient_data = patient_query.get_patient_summary(current_patient)
+            if not current_patient:
+                reply_text = CLINIC_PATIENT_NEEDED_TYPED_REPLY
+            else:
+                patient_data = await session.run("ehr", patient_query.get_patient_summary, current_patient)
 
-                            patient_forms = get_forms_for_patient(current_patient, FILLED_FORMS_DATA)
-                            forms_summary = json.dumps(patient_forms, indent=2) if patient_forms else "No relevant form submissions found."
+                patient_forms = await session.run("ehr", get_forms_for_patient, current_patient)
+                forms_summary = json.dumps(patient_forms, indent=2) if patient_forms else "No relevant form submissions found."
 
-                            if "error" in patient_data:
-                                reply_text = f"I couldn't find {current_patient} in our system. Please check the patient name and try again."
-                            else:
-                                prompt = f"""You are a knowledgeable medical assistant helping a doctor access patient information from the EHR system.
+                if "error" in patient_data:
+                    reply_text = f"I couldn't find {current_patient} in our system. Please check the patient name and try again."
+                else:
+                    prompt = f"""You are a knowledgeable medical assistant helping a doctor access patient information from the EHR system.
 
 PATIENT DATA:
 {json.dumps(patient_data, indent=2)}
@@ -2673,109 +3275,112 @@ INSTRUCTIONS:
 
 RESPONSE:"""
 
-                                response = openai_client.chat.completions.create(
-                                    model=OPENAI_MODEL_NAME,
-                                    messages=[
-                                        {"role": "system", "content": "You are a helpful medical assistant retrieving patient information from an EHR system."},
-                                        {"role": "user", "content": prompt}
-                                    ],
-                                    temperature=0.1,
-                                    max_tokens=500
-                                )
+                    response = await session.run(
+                        "llm",
+                        llm_router.chat,
+                        "clinic_voice_ws",
+                        [
+                            {"role": "system", "content": "You are a helpful medical assistant retrieving patient information from an EHR system."},
+                            {"role": "user", "content": prompt}
+                        ],
+                        timeout=15,
+                        hedge=True,
+                        temperature=0.1,
+                        max_tokens=500
+                    )
+
+                    reply_text = response.choices[0].message.content.strip()
 
-                                reply_text = response.choices[0].message.content.strip()
+        except Exception as e:
+            logging.error(f"clinic_voice_ws (typed): Error processing query: {e}")
+            reply_text = CLINIC_TYPED_QUERY_ERROR_REPLY
+
+        # Add assistant response
+        conversation.append({"type": "assistant", "content": reply_text})
+
+        if stream_audio:
+            await websocket.send_text(json.dumps({
+                "type": "assistant_text",
+                "content": reply_text,
+                "current_patient": current_patient,
+                "user_transcript": transcript
+            }))
+            with session.timed("tts"):
+                await speak_streamed(audio_streamer, reply_text)
+            return
+
+        # TTS reply
+        try:
+            audio_reply = await session.run("tts", collect_audio, lambda: voice_helper.synthesize_stream(reply_text))
+        except Exception as e:
+            logging.error("clinic_voice_ws (typed): TTS synthesis failed: %s", e)
+            await websocket.send_json({"type": "error", "content": f"TTS failed: {e}"})
+            return
+
+        # Send response (text then audio)
+        await websocket.send_text(json.dumps({
+            "type": "assistant_text",
+            "content": reply_text,
+            "current_patient": current_patient,
+            "user_transcript": transcript
+        }))
+        await websocket.send_bytes(audio_reply)
+
+    async def transcribe_and_answer(audio_bytes: bytes) -> None:
+        """Transcribe a recorded doctor query and answer it with text and speech."""
+        nonlocal current_patient
+        prepared = await session.run("preprocess", prepare_for_stt, audio_bytes)
+        if prepared is None:
+            await websocket.send_json({"type": "error", "content": "No speech detected. Please try again."})
+            return
+
+        # Speech-to-Text
+        try:
+            transcript = await session.run("asr", voice_helper.transcribe, prepared.audio, filename=prepared.filename)
+            logging.info("clinic_voice_ws: transcript='%s'", transcript)
 
-                    except Exception as e:
-                        logging.error(f"clinic_voice_ws (typed): Error processing query: {e}")
-                        reply_text = "I encountered an error while processing your question. Please try again."
+            if not transcript or transcript.strip() in ["[No speech detected]", "[Transcription failed", ""]:
+                await websocket.send_json({"type": "error", "content": "Could not understand. Please try again."})
+                return
 
-                    # Add assistant response
-                    conversation.append({"type": "assistant", "content": reply_text})
+        except Exception as e:
+            logging.error("clinic_voice_ws: ASR exception: %s", e)
+            await websocket.send_json({"type": "error", "content": f"ASR failed: {e}"})
+            return
 
-                    # TTS reply
-                    try:
-                        audio_reply = voice_helper.synthesize(reply_text)
-                    except Exception as e:
-                        logging.error("clinic_voice_ws (typed): TTS synthesis failed: %s", e)
-                        await websocket.send_json({"type": "error", "content": f"TTS failed: {e}"})
-                        continue
+        # Add to conversation
+        conversation.append({"type": "doctor", "content": transcript})
 
-                    # Send response (text then audio)
-                    await websocket.send_text(json.dumps({
-                        "type": "assistant_text",
-                        "content": reply_text,
-                        "current_patient": current_patient,
-                        "user_transcript": transcript
-                    }))
-                    await websocket.send_bytes(audio_reply)
+        # Process the doctor's query
+        try:
+            # Extract patient name if mentioned
+            import re
+            patient_pattern = r"(?:patient|about|for|regarding)\s+([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)"
+            match = re.search(patient_pattern, transcript, re.IGNORECASE)
 
-                    # Ready for next message
-                    continue
+            if match:
+                current_patient = match.group(1).strip()
+                logging.info(f"clinic_voice_ws: Identified patient: {current_patient}")
 
-                if text_msg.upper() != "END":
-                    continue
-                
-                # Process audio
-                if not audio_chunks:
-                    await websocket.send_json({"type": "error", "content": "No audio received"})
-                    continue
-                
-                logging.debug("clinic_voice_ws: END received – processing %d audio chunks", len(audio_chunks))
-                audio_bytes = b"".join(audio_chunks)
-                audio_chunks = []
-                
-                # Validate audio
-                if len(audio_bytes) < 1000:
-                    await websocket.send_json({"type": "error", "content": "Audio too short. Please speak clearly."})
-                    continue
-                
-                # Speech-to-Text
-                try:
-                    transcript = voice_helper.transcribe(audio_bytes)
-                    logging.info("clinic_voice_ws: transcript='%s'", transcript)
-                    
-                    if not transcript or transcript.strip() in ["[No speech detected]", "[Transcription failed", ""]:
-                        await websocket.send_json({"type": "error", "content": "Could not understand. Please try again."})
-                        continue
-                    
-                except Exception as e:
-                    logging.error("clinic_voice_ws: ASR exception: %s", e)
-                    await websocket.send_json({"type": "error", "content": f"ASR failed: {e}"})
-                    continue
-                
-                # Add to conversation
-                conversation.append({"type": "doctor", "content": transcript})
-                
-                # Process the doctor's query
-                try:
-                    # Extract patient name if mentioned
-                    import re
-                    patient_pattern = r"(?:patient|about|for|regarding)\s+([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)"
-                    match = re.search(patient_pattern, transcript, re.IGNORECASE)
-                    
-                    if match:
-                        current_patient = match.group(1).strip()
-                        logging.info(f"clinic_voice_ws: Identified patient: {current_patient}")
-                    
-                    if not current_patient:
-                        reply_text = "I need to know which patient you're asking about. Please say something like 'Tell me about patient John Doe' or 'What are the allergies for Jane Smith?'"
-                    else:
-                        # Get patient data
-                        patient_data = patient_query.get_patient_summary(current_patient)
-                        
-                        # ---------------- Include filled form submissions ----------------
-                        patient_forms = get_forms_for_patient(current_patient, FILLED_FORMS_DATA)
-                        if patient_forms:
-                            forms_summary = json.dumps(patient_forms, indent=2)
-                        else:
-                            forms_summary = "No relevant form submissions found."
-                        # ----------------------------------------------------------------
-                        
-                        if "error" in patient_data:
-                            reply_text = f"I couldn't find {current_patient} in our system. Please check the patient name and try again."
-                        else:
-                            # Create prompt for medical assistant
-                            prompt = f"""You are a knowledgeable medical assistant helping a doctor access patient information from the EHR system.
+            if not current_patient:
+                reply_text = CLINIC_PATIENT_NEEDED_REPLY
+            else:
+                # Get patient data
+                patient_data = await session.run("ehr", patient_query.get_patient_summary, current_patient)
+
+                # ---------------- Include filled form submissions ----------------
+                patient_forms = await session.run("ehr", get_forms_for_patient, current_patient)
+                if patient_forms:
+                    forms_summary = json.dumps(patient_forms, indent=2)
+                else:
+                    forms_summary = "No relevant form submissions found."
+                # ----------------------------------------------------------------
+
+                if "error" in patient_data:
+                    reply_text = f"I couldn't find {current_patient} in our system. Please check the patient name and try again."
+                else:
+                    # Create prompt for medical assistant
+                    prompt = f"""You are a knowledgeable medical assistant helping a doctor access patient information from the EHR system.
 
 PATIENT DATA:
 {json.dumps(patient_data, indent=2)}
@@ -2796,47 +3401,135 @@ INSTRUCTIONS:
 
 RESPONSE:"""
 
-                            # Get response from OpenAI
-                            response = openai_client.chat.completions.create(
-                                model=OPENAI_MODEL_NAME,
-                                messages=[
-                                    {"role": "system", "content": "You are a helpful medical assistant retrieving patient information from an EHR system."},
-                                    {"role": "user", "content": prompt}
-                                ],
-                                temperature=0.1,
-                                max_tokens=500
-                            )
-                            
-                            reply_text = response.choices[0].message.content.strip()
-                    
-                except Exception as e:
-                    logging.error(f"clinic_voice_ws: Error processing query: {e}")
-                    reply_text = "I encountered an error retrieving the patient information. Please try again."
+                    # Get response from OpenAI
+                    response = await session.run(
+                        "llm",
+                        llm_router.chat,
+                        "clinic_voice_ws",
+                        [
+                            {"role": "system", "content": "You are a helpful medical assistant retrieving patient information from an EHR system."},
+                            {"role": "user", "content": prompt}
+                        ],
+                        timeout=15,
+                        hedge=True,
+                        temperature=0.1,
+                        max_tokens=500
+                    )
+
+                    reply_text = response.choices[0].message.content.strip()
+
+        except Exception as e:
+            logging.error(f"clinic_voice_ws: Error processing query: {e}")
+            reply_text = CLINIC_QUERY_ERROR_REPLY
+
+        # Add assistant response to conversation
+        conversation.append({"type": "assistant", "content": reply_text})
+
+        if stream_audio:
+            await websocket.send_text(json.dumps({
+                "type": "assistant_text",
+                "content": reply_text,
+                "current_patient": current_patient,
+                "user_transcript": transcript
+            }))
+            with session.timed("tts"):
+                await speak_streamed(audio_streamer, reply_text)
+            return
+
+        # TTS
+        logging.debug("clinic_voice_ws: synthesizing TTS for reply")
+        try:
+            audio_reply = await session.run("tts", collect_audio, lambda: voice_helper.synthesize_stream(reply_text))
+            logging.info("clinic_voice_ws: TTS synthesis completed, got %d bytes", len(audio_reply))
+        except Exception as e:
+            logging.error("clinic_voice_ws: TTS synthesis failed: %s", e)
+            await websocket.send_json({"type": "error", "content": f"TTS failed: {e}"})
+            return
+
+        # Send response
+        response_json = json.dumps({
+            "type": "assistant_text",
+            "content": reply_text,
+            "current_patient": current_patient,
+            "user_transcript": transcript  # Add the user's transcript
+        })
+
+        await websocket.send_text(response_json)
+        await websocket.send_bytes(audio_reply)
+
+    async def submit_query(handler, supersede: bool = False) -> None:
+        try:
+            session.submit(handler, supersede=supersede)
+        except VoiceGatewayBusy as e:
+            logging.warning(f"clinic_voice_ws: {session.name} rejected query: {e}")
+            await websocket.send_json({"type": "error", "content": str(e)})
+
+    try:
+        while True:
+            msg = await websocket.receive()
+            
+            # Binary frame – append to buffer
+            if "bytes" in msg and msg["bytes"] is not None:
+                audio_data = msg["bytes"]
+                logging.debug("clinic_voice_ws: received %d audio bytes", len(audio_data))
+
+                # The doctor is speaking again: the reply in progress is no longer wanted
+                await barge_in(websocket, session, "audio")
                 
-                # Add assistant response to conversation
-                conversation.append({"type": "assistant", "content": reply_text})
+                if len(audio_data) > 1000:  # Substantial audio data
+                    audio_chunks = [audio_data]
+                    logging.debug("clinic_voice_ws: received substantial audio blob")
+                else:
+                    audio_chunks.append(audio_data)
+                continue
+            
+            # Text frame acts as control
+            if "text" in msg and msg["text"]:
+                text_msg = msg["text"].strip()
                 
-                # TTS
-                logging.debug("clinic_voice_ws: synthesizing TTS for reply")
+                # ---------------- Handle manual typed queries ----------------
                 try:
-                    audio_reply = voice_helper.synthesize(reply_text)
-                    logging.info("clinic_voice_ws: TTS synthesis completed, got %d bytes", len(audio_reply))
-                except Exception as e:
-                    logging.error("clinic_voice_ws: TTS synthesis failed: %s", e)
-                    await websocket.send_json({"type": "error", "content": f"TTS failed: {e}"})
+                    data_json = json.loads(text_msg)
+                except ValueError:
+                    data_json = None
+
+                if isinstance(data_json, dict) and data_json.get("type") == "text_query":
+                    transcript = str(data_json.get("transcript", "")).strip()
+                    if not transcript:
+                        await websocket.send_json({"type": "error", "content": "Empty query received"})
+                        continue
+
+                    await submit_query(lambda text=transcript: answer_typed(text))
+                    continue
+
+                if text_msg.startswith("TTS_STREAM:"):
+                    stream_audio = wants_stream(text_msg[11:])
+                    continue
+
+                if text_msg.upper() == "CANCEL":
+                    await barge_in(websocket, session, "client")
+                    continue
+
+                if text_msg.upper() != "END":
                     continue
                 
-                # Send response
-                response_json = json.dumps({
-                    "type": "assistant_text",
-                    "content": reply_text,
-                    "current_patient": current_patient,
-                    "user_transcript": transcript  # Add the user's transcript
-                })
+                # Process audio
+                if not audio_chunks:
+                    await websocket.send_json({"type": "error", "content": "No audio received"})
+                    continue
+                
+                logging.debug("clinic_voice_ws: END received – processing %d audio chunks", len(audio_chunks))
+                audio_bytes = b"".join(audio_chunks)
+                audio_chunks = []
                 
-                await websocket.send_text(response_json)
-                await websocket.send_bytes(audio_reply)
+                # Validate audio
+                if len(audio_bytes) < 1000:
+                    await websocket.send_json({"type": "error", "content": "Audio too short. Please speak clearly."})
+                    continue
                 
+                # A new recording supersedes the reply still being prepared (barge-in)
+                await submit_query(lambda audio=audio_bytes: transcribe_and_answer(audio), supersede=True)
+
     except WebSocketDisconnect:
         logging.info("clinic_voice_ws: WebSocket disconnected cleanly")
     except Exception as e:
@@ -2852,6 +3545,8 @@ RESPONSE:"""
                 await websocket.close()
         except:
             pass
+    finally:
+        await session.close()
 
 if __name__ == "__main__":
     # Create required directories
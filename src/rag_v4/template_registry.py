@@ -0,0 +1,296 @@
+"""
+Registry of form templates that have already been through schema extraction.
+
+Clinics upload the same blank forms over and over. A template is identified
+by two fingerprints:
+
+- the sha256 of the uploaded file, for byte-identical re-uploads, and
+- a layout hash per page (a difference hash of the downscaled page image),
+  for rescans and re-exports of the same form whose bytes differ.
+
+A hit returns the stored ExtractedFormData schema without OCR or an LLM call.
+A 16x16 layout hash alone can't tell similar blank forms apart, so a layout
+match must also be confirmed. Either the upload's text layer contains most
+of the template's field labels, or the page hashes are within the stricter
+STRICT_MATCH_FRACTION, or the filename is the same. Only a confirmed match
+remembers the upload's content hash, so the next upload is an exact hit.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - PIL ships with the OCR stack
+    Image = None
+
+try:
+    from PyPDF2 import PdfReader
+except ImportError:  # pragma: no cover - optional; scans fall back to the stricter hash check
+    PdfReader = None
+
+# Side of the difference-hash grid; each page hash has HASH_SIZE * HASH_SIZE bits
+HASH_SIZE = 16
+# Pages whose hashes differ in at most this fraction of bits are the same layout
+LAYOUT_MATCH_FRACTION = 0.12
+# Layout matches this close are accepted without further confirmation
+STRICT_MATCH_FRACTION = 0.04
+# Share of a template's label words the upload's text layer must contain
+TEXT_MATCH_FRACTION = 0.6
+# Rendering resolution for layout hashing; far cheaper than the 300 dpi OCR pass
+LAYOUT_DPI = 36
+
+_WORD = re.compile(r"[a-z0-9]{3,}")
+# Typed field keys of an extracted schema (text1, date2, boolean3, table1); they are not labels
+_TYPED_KEY = re.compile(r"^(?:text|boolean|date|table)\d+$")
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS form_templates (
+        template_id TEXT PRIMARY KEY,
+        filename TEXT,
+        page_count INTEGER NOT NULL,
+        layout_hash TEXT NOT NULL,
+        schema TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS template_hashes (
+        content_hash TEXT PRIMARY KEY,
+        template_id TEXT NOT NULL REFERENCES form_templates(template_id) ON DELETE CASCADE
+    )
+    """,
+]
+
+
+def content_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def dhash(image, hash_size: int = HASH_SIZE) -> int:
+    """Difference hash: one bit per horizontally adjacent pixel pair of the grayscale thumbnail."""
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return bits
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def layout_hash(images: List[Any]) -> List[int]:
+    """Per-page layout hashes of rendered page images."""
+    return [dhash(image) for image in images]
+
+
+def text_words(text: str) -> Set[str]:
+    return set(_WORD.findall(text.lower()))
+
+
+def pdf_text(path: str) -> Optional[str]:
+    """Text layer of a PDF, or None when there is none (a scan) or it can't be read."""
+    if PdfReader is None:
+        return None
+    try:
+        text = "\n".join(page.extract_text() or "" for page in PdfReader(path).pages)
+    except Exception as e:
+        logger.warning(f"Could not read text layer of {path}: {e}")
+        return None
+    return text if text.strip() else None
+
+
+def schema_labels(schema: Any) -> Set[str]:
+    """
+    Words of the section titles and field labels in an extracted schema. Schemas are nested
+    dicts keyed by the labels themselves ({"Patient": {"text1": {"Name": ""}}}); string values
+    (section content, prefilled answers) count too.
+    """
+    words: Set[str] = set()
+    if isinstance(schema, dict):
+        for key, value in schema.items():
+            if isinstance(key, str) and not _TYPED_KEY.match(key):
+                words.update(text_words(key))
+            words.update(schema_labels(value))
+    elif isinstance(schema, list):
+        for item in schema:
+            words.update(schema_labels(item))
+    elif isinstance(schema, str):
+        words.update(text_words(schema))
+    return words
+
+
+class FormTemplate:
+    def __init__(self, template_id: str, filename: Optional[str], page_count: int,
+                 layout: List[int], schema: Dict[str, Any], created_at: float, hits: int = 0):
+        self.template_id = template_id
+        self.filename = filename
+        self.page_count = page_count
+        self.layout = layout
+        self.schema = schema
+        self.created_at = created_at
+        self.hits = hits
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "templateId": self.template_id,
+            "filename": self.filename,
+            "pageCount": self.page_count,
+            "fields": len(self.schema),
+            "createdAt": self.created_at,
+            "hits": self.hits,
+        }
+
+
+class TemplateRegistry:
+    """SQLite-backed template schemas with an in-memory copy of the layout hashes."""
+
+    def __init__(self, db_path: str, match_fraction: float = LAYOUT_MATCH_FRACTION):
+        self.db_path = db_path
+        self.match_fraction = match_fraction
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        for statement in SCHEMA:
+            self._conn.execute(statement)
+        self._lock = threading.Lock()
+        self._templates: Dict[str, FormTemplate] = {}
+        self._content: Dict[str, str] = {}
+        self._load()
+
+    def _load(self) -> None:
+        rows = self._conn.execute(
+            "SELECT template_id, filename, page_count, layout_hash, schema, created_at, hits FROM form_templates"
+        ).fetchall()
+        for template_id, filename, page_count, layout, schema, created_at, hits in rows:
+            self._templates[template_id] = FormTemplate(
+                template_id, filename, page_count, [int(h, 16) for h in json.loads(layout)],
+                json.loads(schema), created_at, hits,
+            )
+        self._content = dict(self._conn.execute("SELECT content_hash, template_id FROM template_hashes").fetchall())
+        logger.info(f"Template registry: {len(self._templates)} templates, {len(self._content)} content hashes")
+
+    def _hit(self, template: FormTemplate, content: Optional[str] = None) -> FormTemplate:
+        template.hits += 1
+        self._conn.execute("UPDATE form_templates SET hits = hits + 1 WHERE template_id = ?", (template.template_id,))
+        if content and content not in self._content:
+            self._content[content] = template.template_id
+            self._conn.execute(
+                "INSERT OR REPLACE INTO template_hashes (content_hash, template_id) VALUES (?, ?)",
+                (content, template.template_id),
+            )
+        return template
+
+    def lookup_content(self, content: str) -> Optional[FormTemplate]:
+        """Template previously extracted from byte-identical content."""
+        with self._lock:
+            template = self._templates.get(self._content.get(content, ""))
+            return self._hit(template) if template else None
+
+    def lookup_layout(self, layout: List[int], content: Optional[str] = None, text: Optional[str] = None,
+                      filename: Optional[str] = None) -> Optional[FormTemplate]:
+        """
+        Closest template whose pages all match ``layout`` within the bit threshold, if the match is
+        confirmed by the upload's ``text`` layer, a strict hash distance or the same ``filename``.
+        """
+        if not layout:
+            return None
+        max_distance = int(HASH_SIZE * HASH_SIZE * self.match_fraction)
+        strict_distance = int(HASH_SIZE * HASH_SIZE * STRICT_MATCH_FRACTION)
+        words = text_words(text) if text else None
+        with self._lock:
+            candidates = []
+            for template in self._templates.values():
+                if template.page_count != len(layout):
+                    continue
+                distances = [hamming(a, b) for a, b in zip(template.layout, layout)]
+                if max(distances) <= max_distance:
+                    candidates.append((sum(distances), max(distances), template))
+            for total, worst, template in sorted(candidates, key=lambda c: c[0]):
+                confirmed_by = self._confirm(template, worst <= strict_distance, words, filename)
+                if confirmed_by:
+                    logger.info(f"Template layout match {template.template_id} (distance {total}, {confirmed_by})")
+                    # Remember this file's bytes so the next upload is an exact hit
+                    return self._hit(template, content)
+                logger.info(f"Template layout match {template.template_id} (distance {total}) not confirmed")
+            return None
+
+    @staticmethod
+    def _confirm(template: FormTemplate, strict: bool, words: Optional[Set[str]], filename: Optional[str]) -> Optional[str]:
+        """How a layout match is confirmed, or None when it isn't."""
+        labels = schema_labels(template.schema)
+        if words is not None and labels:
+            # A text layer is the strongest evidence either way
+            if len(labels & words) >= TEXT_MATCH_FRACTION * len(labels):
+                return "text"
+            return None
+        if strict:
+            return "strict"
+        if filename and template.filename and os.path.basename(filename).lower() == os.path.basename(template.filename).lower():
+            return "filename"
+        return None
+
+    def register(self, content: str, layout: List[int], schema: Dict[str, Any],
+                 filename: Optional[str] = None) -> FormTemplate:
+        template = FormTemplate(uuid.uuid4().hex[:12], filename, len(layout), layout, schema, time.time())
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO form_templates (template_id, filename, page_count, layout_hash, schema, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (template.template_id, filename, template.page_count,
+                     json.dumps([format(h, "x") for h in layout]), json.dumps(schema), template.created_at),
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO template_hashes (content_hash, template_id) VALUES (?, ?)",
+                    (content, template.template_id),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._templates[template.template_id] = template
+            self._content[content] = template.template_id
+        logger.info(f"Registered form template {template.template_id} ({filename}, {len(schema)} fields)")
+        return template
+
+    def templates(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [template.summary() for template in self._templates.values()]
+
+    def invalidate(self, template_id: str) -> bool:
+        """Forget one template so its next upload is extracted again."""
+        with self._lock:
+            if self._templates.pop(template_id, None) is None:
+                return False
+            self._content = {k: v for k, v in self._content.items() if v != template_id}
+            self._conn.execute("DELETE FROM form_templates WHERE template_id = ?", (template_id,))
+        logger.info(f"Invalidated form template {template_id}")
+        return True
+
+    def clear(self) -> int:
+        with self._lock:
+            count = len(self._templates)
+            self._templates.clear()
+            self._content.clear()
+            self._conn.execute("DELETE FROM form_templates")
+        logger.info(f"Cleared {count} form templates")
+        return count
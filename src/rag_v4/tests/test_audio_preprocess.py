@@ -0,0 +1,42 @@
+import math
+import os
+import sys
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from asr_stream import SAMPLE_RATE, EnergyVAD  # noqa: E402
+from audio_preprocess import trim_silence  # noqa: E402
+
+
+def tone(ms, amplitude=6000, frequency=220):
+    count = SAMPLE_RATE * ms // 1000
+    return array("h", (int(amplitude * math.sin(2 * math.pi * frequency * i / SAMPLE_RATE))
+                       for i in range(count))).tobytes()
+
+
+def silence(ms):
+    return bytes(SAMPLE_RATE * ms // 1000 * 2)
+
+
+def test_clip_starting_with_speech_keeps_its_speech():
+    _, speech_ms = trim_silence(tone(1500) + silence(500))
+    assert speech_ms >= 1400
+
+
+def test_clip_with_leading_silence():
+    trimmed, speech_ms = trim_silence(silence(300) + tone(1500) + silence(500))
+    assert speech_ms >= 1400
+    assert len(trimmed) < len(silence(2300))
+
+
+def test_silent_clip_has_no_speech():
+    assert trim_silence(silence(1000)) == (b"", 0)
+
+
+def test_vad_floor_adapts_to_background_noise():
+    vad = EnergyVAD()
+    hum = tone(30, amplitude=250, frequency=50)
+    for _ in range(100):
+        assert not vad.is_speech(hum)
+    assert vad.is_speech(tone(30))
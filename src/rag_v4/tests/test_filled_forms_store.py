@@ -0,0 +1,41 @@
+import json
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, os.path.join(HERE, "..", ".."))
+
+from filled_forms_store import FilledFormsStore  # noqa: E402
+
+
+def submission(form_id, answers):
+    return {"id": form_id, "templateName": "Intake", "formValues": answers}
+
+
+def test_patient_found_under_any_label():
+    store = FilledFormsStore()
+    store.add(submission("insured", {"Insured": "Maria Lopez", "Plan": "Gold PPO"}))
+    store.add(submission("patient", {"Patient": "Maria Lopez", "Reason for visit": "Knee pain"}))
+    store.add(submission("other", {"Full name": "John Smith"}))
+
+    assert {form["id"] for form in store.forms_for_patient("Maria Lopez")} == {"insured", "patient"}
+    assert [form["id"] for form in store.forms_for_patient("John Smith")] == ["other"]
+
+
+def test_long_free_text_is_not_indexed_as_a_name():
+    store = FilledFormsStore()
+    store.add(submission("notes", {"Notes": "Referred by doctor Lopez after a fall at work last winter"}))
+    assert store.forms_for_patient("Lopez") == []
+
+
+def test_old_manifest_reindexes_posted_forms(tmp_path):
+    manifest = tmp_path / "filled_forms.json"
+    form = {"id": "posted", "templateName": "Intake", "submittedAt": None, "answers": {"Subscriber": "Ann Lee"}}
+    manifest.write_text(json.dumps({"version": 1, "forms": [], "pinned": [{"form": form, "keys": []}]}))
+
+    store = FilledFormsStore(manifest_path=str(manifest))
+    try:
+        assert [f["id"] for f in store.forms_for_patient("Ann Lee")] == ["posted"]
+    finally:
+        store.stop()
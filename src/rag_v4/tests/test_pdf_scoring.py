@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "voice_agent"))
+
+pytest.importorskip("dotenv")
+import voice  # noqa: E402
+from document_index import DocumentIndex  # noqa: E402
+
+FEATURES = {
+    "insurance_card.pdf": {"keywords": ["insurance", "policy", "name"], "acroform": False},
+    "scan.pdf": {"keywords": ["date of birth", "ssn", "insurance", "policy", "phone", "address", "patient", "name",
+                              "signature", "provider", "emergency"], "acroform": True},
+    "lecture_notes.pdf": {"keywords": ["name"], "acroform": False},
+}
+
+
+@pytest.fixture
+def candidates(tmp_path, monkeypatch):
+    extracted = []
+
+    def extract(path):
+        extracted.append(os.path.basename(path))
+        positive, negative = voice._filename_tokens(path)
+        return {"filename_tokens": positive, "negative_tokens": negative, **FEATURES[os.path.basename(path)]}
+
+    monkeypatch.setattr(voice, "document_index", DocumentIndex(extract, manifest_path=None))
+    paths = []
+    for name in FEATURES:
+        (tmp_path / name).write_bytes(b"%PDF-1.4")
+        paths.append(str(tmp_path / name))
+    return paths, extracted
+
+
+def test_parallel_scoring_matches_a_full_scan(candidates):
+    paths, _ = candidates
+    full_scan = sorted(((voice.score_pdf_features(voice.document_index.extract(fp)), fp) for fp in paths), reverse=True)
+    assert voice.score_pdf_candidates(paths) == full_scan
+    # The file with the weaker name wins on its page 1
+    assert os.path.basename(full_scan[0][1]) == "scan.pdf"
+
+
+def test_indexed_files_are_not_parsed_again(candidates):
+    paths, extracted = candidates
+    first = voice.score_pdf_candidates(paths + [paths[0]])
+    assert sorted(extracted) == sorted(FEATURES)
+    assert voice.score_pdf_candidates(paths) == first
+    assert len(extracted) == len(FEATURES)
@@ -0,0 +1,57 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from template_registry import TemplateRegistry, schema_labels  # noqa: E402
+
+# The shape extract_template_key_value_info returns for /ingest-form-template
+SCHEMA = {
+    "Medical history form": {
+        "Patient": {
+            "text1": {"Name": ""},
+            "date1": {"Date of last update": ""},
+        },
+        "Physician": {
+            "text1": {"Current physician name": ""},
+            "text2": {"Phone": ""},
+        },
+        "Current and past medications": {
+            "table1": {
+                "text1": {"Medication name": ""},
+                "text2": {"Dosage": ""},
+            },
+        },
+    }
+}
+
+LAYOUT = [(1 << 200) - 1]
+# 20 bits away: inside LAYOUT_MATCH_FRACTION, outside STRICT_MATCH_FRACTION
+RESCAN_LAYOUT = [LAYOUT[0] ^ ((1 << 20) - 1)]
+
+
+def test_schema_labels_reads_nested_label_keys():
+    labels = schema_labels(SCHEMA)
+    assert {"medical", "history", "patient", "name", "physician", "phone", "medication", "dosage"} <= labels
+    assert not {"text1", "date1", "table1"} & labels
+
+
+def test_layout_match_confirmed_by_text_layer(tmp_path):
+    registry = TemplateRegistry(str(tmp_path / "templates.db"))
+    registry.register("original", LAYOUT, SCHEMA, filename="history.pdf")
+
+    text = ("Medical History Form  Patient  Name  Date of last update  Physician  Current physician name  "
+            "Phone  Current and past medications  Medication name  Dosage")
+    match = registry.lookup_layout(RESCAN_LAYOUT, content="rescan", text=text, filename="scan_0042.pdf")
+    assert match is not None and match.schema == SCHEMA
+    # The confirmed upload's bytes are remembered
+    assert registry.lookup_content("rescan") is match
+
+
+def test_layout_match_rejected_by_other_text(tmp_path):
+    registry = TemplateRegistry(str(tmp_path / "templates.db"))
+    registry.register("original", LAYOUT, SCHEMA, filename="history.pdf")
+
+    text = "Dental insurance claim  Subscriber ID  Group number  Procedure code  Tooth number  Fee"
+    assert registry.lookup_layout(RESCAN_LAYOUT, content="other", text=text, filename="history.pdf") is None
+    assert registry.lookup_content("other") is None
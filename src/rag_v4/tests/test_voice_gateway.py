@@ -0,0 +1,194 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from cancellation import OperationCancelled, wait_cancelled  # noqa: E402
+from voice_gateway import VoiceGateway, VoiceGatewayBusy  # noqa: E402
+
+
+async def until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        await asyncio.sleep(0.005)
+
+
+def blocking_until_cancelled(seconds=2.0):
+    """A pool job that stops like an LLM retry loop once its utterance is cancelled."""
+    if wait_cancelled(seconds):
+        raise OperationCancelled("cancelled")
+
+
+def test_utterances_run_one_at_a_time_in_order():
+    async def run():
+        session = VoiceGateway(workers=2).open("voice")
+        log = []
+
+        def handler(name):
+            async def utterance():
+                log.append(f"{name} start")
+                await asyncio.sleep(0.01)
+                log.append(f"{name} end")
+            return utterance
+
+        session.submit(handler("a"))
+        session.submit(handler("b"))
+        await until(lambda: len(log) == 4)
+        await session.close()
+        return log
+
+    assert asyncio.run(run()) == ["a start", "a end", "b start", "b end"]
+
+
+def test_queue_beyond_max_pending_is_rejected():
+    async def run():
+        session = VoiceGateway(workers=2, max_pending=2).open("voice")
+        release = asyncio.Event()
+        started = []
+
+        async def utterance():
+            started.append(1)
+            await release.wait()
+
+        session.submit(utterance)
+        await until(lambda: started)
+        session.submit(utterance)
+        session.submit(utterance)
+        with pytest.raises(VoiceGatewayBusy):
+            session.submit(utterance)
+        assert session.rejected == 1
+        release.set()
+        await until(lambda: not session.busy)
+        await session.close()
+        return len(started)
+
+    assert asyncio.run(run()) == 3
+
+
+def test_saturated_gateway_refuses_new_utterances():
+    async def run():
+        gateway = VoiceGateway(workers=1, max_backlog=1)
+        session = gateway.open("voice")
+        release = threading.Event()
+        job = asyncio.ensure_future(gateway.run(release.wait))
+        await until(gateway.saturated)
+
+        async def utterance():
+            pass
+
+        with pytest.raises(VoiceGatewayBusy):
+            session.submit(utterance)
+        release.set()
+        await job
+        assert not gateway.saturated()
+        session.submit(utterance)
+        await until(lambda: not session.busy)
+        await session.close()
+        return session.rejected
+
+    assert asyncio.run(run()) == 1
+
+
+def test_supersede_cancels_running_and_queued_utterances():
+    async def run():
+        session = VoiceGateway(workers=2).open("voice")
+        finished = []
+
+        def handler(name, seconds):
+            async def utterance():
+                with session.timed("llm"):
+                    await asyncio.sleep(seconds)
+                finished.append(name)
+            return utterance
+
+        session.submit(handler("slow", 5))
+        await until(lambda: session.busy and not session._queue)
+        session.submit(handler("queued", 0))
+        session.submit(handler("new", 0), supersede=True)
+        await until(lambda: finished)
+        await until(lambda: not session.busy)
+        await session.close()
+        return finished, session
+
+    finished, session = asyncio.run(run())
+    assert finished == ["new"]
+    # The queued utterance was dropped and the running one cancelled
+    assert session.cancelled == 2
+    assert [item["outcome"] for item in session.history] == ["cancelled", "completed"]
+
+
+def test_cancel_stops_blocking_job_through_its_token():
+    async def run():
+        session = VoiceGateway(workers=2).open("voice")
+        started = time.monotonic()
+
+        async def utterance():
+            await session.run("llm", blocking_until_cancelled)
+
+        session.submit(utterance)
+        await until(lambda: session._current is not None)
+        await asyncio.sleep(0.05)
+        assert session.cancel()
+        await until(lambda: not session.busy)
+        elapsed = time.monotonic() - started
+        await session.close()
+        return session, elapsed
+
+    session, elapsed = asyncio.run(run())
+    assert elapsed < 1.0
+    assert session.cancelled == 1
+    assert session.history[-1]["outcome"] == "cancelled"
+    assert session.gateway.metrics()["backlog"] == 0
+
+
+def test_operation_cancelled_counts_as_cancelled_and_errors_as_failed():
+    async def run():
+        session = VoiceGateway(workers=2).open("voice")
+
+        async def cancelled():
+            # Raised by a pool job that noticed its token, without the task itself being cancelled
+            with session.timed("llm"):
+                raise OperationCancelled("cancelled")
+
+        async def failed():
+            with session.timed("llm"):
+                raise ValueError("upstream broke")
+
+        session.submit(cancelled)
+        session.submit(failed)
+        await until(lambda: len(session.history) == 2)
+        await session.close()
+        return session
+
+    session = asyncio.run(run())
+    assert [item["outcome"] for item in session.history] == ["cancelled", "failed"]
+    assert session.cancelled == 1
+
+
+def test_stage_timings_are_recorded_per_utterance():
+    async def run():
+        session = VoiceGateway(workers=2).open("voice")
+
+        async def utterance():
+            await session.run("asr", time.sleep, 0.05)
+            with session.timed("tts"):
+                await asyncio.sleep(0.02)
+
+        session.submit(utterance, stages={"vad": 0.01})
+        await until(lambda: session.history)
+        await session.close()
+        return session
+
+    session = asyncio.run(run())
+    breakdown = session.history[-1]
+    assert breakdown["vad"] == 10
+    assert breakdown["asr"] >= 50 and breakdown["tts"] >= 20
+    # Each stage is rounded to whole milliseconds on its own
+    assert breakdown["total"] >= breakdown["asr"] + breakdown["tts"] - 2
+    assert session.metrics()["latencyMs"]["asr"]["p50"] == breakdown["asr"]
@@ -0,0 +1,194 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import voice_stream  # noqa: E402
+from cancellation import OperationCancelled  # noqa: E402
+from llm_client import LLMClient  # noqa: E402
+from voice_gateway import VoiceGateway, VoiceGatewayBusy  # noqa: E402
+from voice_stream import AudioStreamer, SpeechPipeline, SpeechSegmenter, collect_audio, speech_sentences  # noqa: E402
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.messages = []
+        self.audio = []
+
+    async def send_json(self, message):
+        self.messages.append(message)
+
+    async def send_bytes(self, data):
+        self.audio.append(data)
+
+
+def stream_chunks(pieces):
+    """A fake OpenAI client whose completions stream ``pieces`` as content deltas."""
+    def chunk(content):
+        delta = types.SimpleNamespace(content=content)
+        return types.SimpleNamespace(model="fake", usage=None,
+                                     choices=[types.SimpleNamespace(delta=delta, finish_reason=None)])
+
+    class Stream:
+        def __iter__(self):
+            return iter([chunk(piece) for piece in pieces])
+
+        def close(self):
+            pass
+
+    completions = types.SimpleNamespace(create=lambda messages, **kwargs: Stream())
+    return types.SimpleNamespace(chat=types.SimpleNamespace(completions=completions))
+
+
+def test_segmenter_drops_field_update_lead_ins():
+    text = ("Based on the information I have, I was able to fill out some of the form for you! "
+            "I added your phone number and date of birth. Here's the updated information: "
+            "{'field_updates': [{'id': 'phone', 'value': '555-123-4567'}]}")
+    assert speech_sentences(text) == ["I added your phone number and date of birth."]
+
+
+def test_segmenter_splits_streamed_deltas_into_sentences():
+    segmenter = SpeechSegmenter(min_chars=10)
+    text = "Your appointment is on Monday at nine. Please bring your insurance card. Thanks!"
+    sentences = []
+    for i in range(0, len(text), 7):
+        sentences += segmenter.feed(text[i:i + 7])
+    sentences += segmenter.flush()
+    assert sentences == ["Your appointment is on Monday at nine.", "Please bring your insurance card.", "Thanks!"]
+
+
+def test_llm_deltas_are_spoken_while_the_reply_streams():
+    pieces = ["Your appointment is on ", "Monday at nine. ", "Please bring your ", "insurance card."]
+    spoken = []
+
+    def synthesize_stream(sentence):
+        spoken.append(sentence)
+        yield sentence.encode()
+
+    async def run():
+        pipeline = SpeechPipeline(AudioStreamer(FakeWebSocket(), "mp3"), synthesize_stream, min_chars=10)
+        await pipeline.start()
+        client = LLMClient(stream_chunks(pieces), model="fake")
+        response = await asyncio.to_thread(client.chat, [{"role": "user", "content": "When?"}],
+                                           on_delta=pipeline.feeder())
+        # Only the deltas were fed; the final text never was
+        assert pipeline.sentences[:1] == ["Your appointment is on Monday at nine."]
+        await pipeline.finish()
+        return response
+
+    response = asyncio.run(run())
+    assert response.choices[0].message.content == "".join(pieces)
+    assert spoken == ["Your appointment is on Monday at nine.", "Please bring your insurance card."]
+
+
+class FakeTTS:
+    """synthesize_stream stand-in that yields a chunk every few ms and records what happened."""
+
+    def __init__(self, chunks=200, interval=0.005):
+        self.chunks = chunks
+        self.interval = interval
+        self.started = []
+        self.closed = []
+        self.lock = threading.Lock()
+
+    def synthesize_stream(self, sentence):
+        with self.lock:
+            self.started.append(sentence)
+        try:
+            for _ in range(self.chunks):
+                time.sleep(self.interval)
+                yield b"x"
+        finally:
+            with self.lock:
+                self.closed.append(sentence)
+
+
+async def until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        await asyncio.sleep(0.005)
+
+
+FIRST = "The first sentence is long enough to be spoken."
+SECOND = "The second sentence waits for a free TTS slot."
+
+
+def test_collect_audio_closes_the_engine_stream_when_stopped():
+    tts = FakeTTS()
+    stop = threading.Event()
+    threading.Timer(0.03, stop.set).start()
+    with pytest.raises(OperationCancelled):
+        collect_audio(lambda: tts.synthesize_stream(FIRST), stop=stop)
+    assert tts.closed == [FIRST]
+
+
+def test_cancel_stops_running_synthesis_and_skips_waiting_sentences():
+    tts = FakeTTS()
+
+    async def run():
+        pipeline = SpeechPipeline(AudioStreamer(FakeWebSocket(), "mp3"), tts.synthesize_stream, max_parallel=1)
+        await pipeline.start()
+        pipeline.feed(f"{FIRST} {SECOND} ")
+        await until(lambda: tts.started)
+        # The second sentence is parked on the semaphore behind the first
+        assert pipeline._semaphore.locked()
+        pipeline.cancel()
+        await until(lambda: tts.closed)
+        await until(lambda: not pipeline._semaphore.locked())
+        # Text arriving after the cancel is ignored
+        pipeline.feed("A late sentence that should never be synthesized. ")
+        await asyncio.sleep(0.05)
+        return pipeline
+
+    pipeline = asyncio.run(run())
+    assert tts.started == [FIRST]
+    assert tts.closed == [FIRST]
+    assert pipeline.sentences == [FIRST, SECOND]
+
+
+def test_job_cancelled_before_it_starts_releases_its_slot():
+    tts = FakeTTS(chunks=1)
+
+    async def run():
+        # A single worker, kept busy, so the sentence's job waits in the pool queue
+        gateway = VoiceGateway(workers=1)
+        release = threading.Event()
+        blocker = asyncio.ensure_future(gateway.run(release.wait))
+        try:
+            pipeline = SpeechPipeline(AudioStreamer(FakeWebSocket(), "mp3", run_blocking=gateway.run),
+                                      tts.synthesize_stream, max_parallel=1)
+            await pipeline.start()
+            pipeline.feed(f"{FIRST} ")
+            await until(lambda: pipeline._semaphore.locked() and voice_stream._jobs)
+            for job in list(voice_stream._jobs):
+                job.cancel()
+            await until(lambda: not pipeline._semaphore.locked())
+        finally:
+            release.set()
+            await blocker
+
+    asyncio.run(run())
+    assert tts.started == []
+
+
+def test_job_refused_by_the_pool_ends_its_queue():
+    finished = []
+
+    async def refuse(func):
+        raise VoiceGatewayBusy("busy")
+
+    async def run():
+        queue = voice_stream.iterate_in_thread(lambda: iter([b"x"]), on_finish=lambda: finished.append(1),
+                                               run_blocking=refuse)
+        return await asyncio.wait_for(queue.get(), 1.0)
+
+    item = asyncio.run(run())
+    assert isinstance(item, VoiceGatewayBusy)
+    assert finished == [1]
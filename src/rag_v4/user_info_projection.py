@@ -0,0 +1,187 @@
+"""
+Relevant-field projection of user_info before it enters prompts.
+
+user_info accumulates hundreds of flattened keys plus internal bookkeeping
+(vector DB collection paths). A key index is precomputed once per key set:
+every key is split into word tokens (camelCase, snake_case, digits), expanded
+with a few synonyms and weighted by inverse document frequency across keys.
+Each prompt then keeps only the keys whose informative tokens appear in the
+current form fields or question.
+"""
+
+import json
+import logging
+import math
+import re
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+VECTOR_DB_DIR = "vector_db"
+# Below this many keys projection is not worth the risk of dropping context
+MIN_KEYS_TO_PROJECT = 25
+MAX_PROJECTED_KEYS = 60
+MIN_KEY_SCORE = 0.5
+# Keys kept when nothing matches, so generic questions still get identity data
+FALLBACK_KEYS = 10
+# The patient's own name keys are always kept so answers can address them
+IDENTITY_TOKENS = {"patient", "name", "first", "last", "full", "middle"}
+MAX_CACHED_INDEXES = 32
+
+TOKEN_SYNONYMS = {
+    "phone": {"telephone", "mobile", "cell", "tel"},
+    "telephone": {"phone"},
+    "mobile": {"phone"},
+    "cell": {"phone"},
+    "dob": {"birth", "date"},
+    "birth": {"dob"},
+    "ssn": {"social", "security"},
+    "zip": {"postal"},
+    "postal": {"zip"},
+    "meds": {"medications"},
+    "medication": {"medications"},
+    "medications": {"medication"},
+    "allergy": {"allergies"},
+    "allergies": {"allergy"},
+    "insurer": {"insurance"},
+    "surname": {"last"},
+    "given": {"first"},
+}
+
+# Tokens that occur in almost every key carry no signal on their own
+STOP_TOKENS = {"the", "of", "and", "or", "a", "an", "to", "for", "is", "my", "your", "number", "info", "information"}
+
+_CAMEL_BOUNDARY = re.compile(r'(?<=[a-z])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])|(?<=[A-Za-z])(?=\d)|(?<=\d)(?=[A-Za-z])')
+_NON_WORD = re.compile(r'[^A-Za-z0-9]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """Split a key or label into lower-cased word tokens."""
+    words = []
+    for part in _NON_WORD.split(_CAMEL_BOUNDARY.sub(" ", str(text))):
+        if part:
+            words.extend(w.lower() for w in part.split())
+    return [w for w in words if w not in STOP_TOKENS and not w.isdigit()]
+
+
+def is_bookkeeping_key(key: str, value: Any) -> bool:
+    """True for internal entries that never belong in a prompt."""
+    if key.startswith("_"):
+        return True
+    if isinstance(value, str) and (value.startswith(VECTOR_DB_DIR + "/") or value.startswith(VECTOR_DB_DIR + "\\")):
+        return True
+    return False
+
+
+def patient_fields(user_info: Dict[str, Any]) -> Dict[str, Any]:
+    """user_info without bookkeeping entries."""
+    return {k: v for k, v in user_info.items() if not is_bookkeeping_key(k, v)}
+
+
+class UserInfoKeyIndex:
+    """Token/IDF index over a fixed set of user_info keys."""
+
+    def __init__(self, keys: Iterable[str]):
+        self.keys = list(keys)
+        self.key_tokens: Dict[str, Set[str]] = {k: set(tokenize(k)) for k in self.keys}
+
+        doc_freq: Dict[str, int] = {}
+        for tokens in self.key_tokens.values():
+            for token in tokens:
+                doc_freq[token] = doc_freq.get(token, 0) + 1
+        n = max(len(self.keys), 1)
+        self.idf = {token: math.log(1 + n / df) for token, df in doc_freq.items()}
+        self.key_weight = {k: sum(self.idf[t] for t in tokens) for k, tokens in self.key_tokens.items()}
+
+    def score(self, key: str, query_tokens: Set[str]) -> float:
+        """Share of the key's informative weight present in the query."""
+        tokens = self.key_tokens.get(key)
+        if not tokens or not self.key_weight[key]:
+            return 0.0
+        matched = 0.0
+        for token in tokens:
+            if token in query_tokens or (TOKEN_SYNONYMS.get(token, set()) & query_tokens):
+                matched += self.idf[token]
+        return matched / self.key_weight[key]
+
+    def select(self, query_tokens: Set[str], limit: int = MAX_PROJECTED_KEYS, min_score: float = MIN_KEY_SCORE) -> List[str]:
+        scored = [(self.score(k, query_tokens), k) for k in self.keys]
+        scored.sort(key=lambda item: item[0], reverse=True)
+        selected = [k for s, k in scored[:limit] if s >= min_score]
+        selected += [
+            k for k in self.keys
+            if k not in selected and "name" in self.key_tokens[k] and self.key_tokens[k] <= IDENTITY_TOKENS
+        ]
+        if not selected:
+            # Nothing matched: keep the keys in their original order (earliest extracted first)
+            selected = self.keys[:FALLBACK_KEYS]
+        return selected
+
+
+_index_cache: "OrderedDict[frozenset, UserInfoKeyIndex]" = OrderedDict()
+
+
+def get_key_index(keys: Iterable[str]) -> UserInfoKeyIndex:
+    """Return the cached index for this key set, building it on first use."""
+    keys = list(keys)
+    cache_key = frozenset(keys)
+    index = _index_cache.get(cache_key)
+    if index is None:
+        index = UserInfoKeyIndex(keys)
+        _index_cache[cache_key] = index
+        while len(_index_cache) > MAX_CACHED_INDEXES:
+            _index_cache.popitem(last=False)
+    else:
+        _index_cache.move_to_end(cache_key)
+    return index
+
+
+def form_field_labels(form_fields: Optional[str]) -> List[str]:
+    """Ids and labels from the serialized form fields sent by the frontend."""
+    if not form_fields:
+        return []
+    try:
+        fields = json.loads(form_fields) if isinstance(form_fields, str) else form_fields
+    except (TypeError, ValueError):
+        return [str(form_fields)]
+    labels = []
+    if isinstance(fields, list):
+        for field in fields:
+            if isinstance(field, dict):
+                labels.append(str(field.get("label", "")))
+                labels.append(str(field.get("id", "")))
+    return labels
+
+
+def query_tokens(form_fields: Optional[str] = None, question: str = "", extra_text: str = "") -> Set[str]:
+    tokens: Set[str] = set()
+    for label in form_field_labels(form_fields):
+        tokens.update(tokenize(label))
+    tokens.update(tokenize(question or ""))
+    tokens.update(tokenize(extra_text or ""))
+    expanded = set(tokens)
+    for token in tokens:
+        expanded |= TOKEN_SYNONYMS.get(token, set())
+    return expanded
+
+
+def project_user_info(
+    user_info: Dict[str, Any],
+    form_fields: Optional[str] = None,
+    question: str = "",
+    extra_text: str = "",
+    limit: int = MAX_PROJECTED_KEYS,
+) -> Dict[str, Any]:
+    """Return the subset of user_info relevant to the form fields and question."""
+    if not isinstance(user_info, dict) or not user_info:
+        return user_info
+    fields = patient_fields(user_info)
+    if len(fields) <= MIN_KEYS_TO_PROJECT:
+        return fields
+
+    index = get_key_index(fields.keys())
+    selected = index.select(query_tokens(form_fields, question, extra_text), limit=limit)
+    projected = {k: fields[k] for k in selected}
+    logger.info(f"Projected user_info from {len(user_info)} to {len(projected)} keys")
+    return projected
@@ -0,0 +1,261 @@
+"""
+Gateway for concurrent voice sessions.
+
+The voice websockets used to run STT, LLM and TTS calls inline in the
+handler. Those calls block, so one slow session stalled every other session
+sharing the event loop. The gateway separates the two:
+
+- ``VoiceGateway`` owns one bounded worker pool shared by all sessions, and
+  blocking stages run there. Once the pool's backlog reaches ``max_backlog``,
+  new utterances are refused with a busy error instead of queueing without
+  bound.
+- ``VoiceSession`` is one connection. Its utterances run as asyncio tasks, one
+  at a time and in order, while the websocket keeps receiving. At most
+  ``max_pending`` utterances wait behind the running one. A newly spoken
+  utterance supersedes the queued and in-flight ones (barge-in).
+- Cancelling an utterance cancels its task and sets its cancellation token.
+  Blocking jobs it already started on the pool see the token through their
+  cancel scope and stop at their next check (LLM retries and hedges, TTS
+  chunks), so their pool and upstream slots are freed early.
+- Each utterance records how long each stage took (asr, llm, tts, ...).
+  Sessions keep recent breakdowns, and ``metrics`` reports per-session
+  percentiles.
+"""
+
+import asyncio
+import functools
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+from cancellation import OperationCancelled, cancel_scope, run_in_scope
+
+logger = logging.getLogger(__name__)
+
+VOICE_WORKERS = 16
+MAX_PENDING_UTTERANCES = 2
+# Blocking jobs waiting for or running on the pool, per worker, before new utterances are refused
+BACKLOG_PER_WORKER = 4
+TIMINGS_WINDOW = 50
+
+
+class VoiceGatewayBusy(Exception):
+    """The worker pool or the session's queue is full; the utterance was not accepted."""
+
+
+class UtteranceTimings:
+    """Seconds spent per pipeline stage for one utterance."""
+
+    def __init__(self, stages: Optional[Dict[str, float]] = None):
+        self.started = time.monotonic()
+        self.finished = self.started
+        self.stages: Dict[str, float] = dict(stages or {})
+        self.outcome = "completed"
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        self.finished = time.monotonic()
+
+    def as_dict(self) -> Dict[str, Any]:
+        result: Dict[str, Any] = {stage: round(seconds * 1000) for stage, seconds in self.stages.items()}
+        # Until the end of the last stage, so idle time after a reply isn't counted
+        result["total"] = round((self.finished - self.started) * 1000)
+        result["outcome"] = self.outcome
+        return result
+
+
+def _percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+class VoiceSession:
+    """Sequential, cancellable utterance processing for one voice connection."""
+
+    def __init__(self, gateway: "VoiceGateway", name: str, max_pending: int = MAX_PENDING_UTTERANCES):
+        self.gateway = gateway
+        self.name = name
+        self.max_pending = max_pending
+        self.history: "deque[Dict[str, Any]]" = deque(maxlen=TIMINGS_WINDOW)
+        self.cancelled = 0
+        self.rejected = 0
+        self._queue: "deque[tuple]" = deque()
+        self._wakeup = asyncio.Event()
+        self._current: Optional[asyncio.Task] = None
+        self._token: Optional[threading.Event] = None
+        self._timings: Optional[UtteranceTimings] = None
+        self._worker = asyncio.create_task(self._work())
+
+    @property
+    def busy(self) -> bool:
+        return self._current is not None or bool(self._queue)
+
+    def submit(self, handler: Callable[[], Awaitable[None]], supersede: bool = False,
+               stages: Optional[Dict[str, float]] = None) -> None:
+        """
+        Queue ``handler`` to run after the session's earlier utterances.
+        With ``supersede`` the queued and running utterances are cancelled first.
+        Raises VoiceGatewayBusy when the gateway or this session is full.
+        """
+        if self.gateway.saturated():
+            self.rejected += 1
+            raise VoiceGatewayBusy("The voice service is busy. Please try again in a moment.")
+        if supersede:
+            self.cancel()
+        elif len(self._queue) >= self.max_pending:
+            self.rejected += 1
+            raise VoiceGatewayBusy("Still working on your previous requests. Please wait a moment.")
+        self._queue.append((handler, stages))
+        self._wakeup.set()
+
+    def cancel(self) -> bool:
+        """Drop queued utterances and cancel the running one; True if anything was cancelled."""
+        dropped = len(self._queue)
+        self._queue.clear()
+        self.cancelled += dropped
+        if self._current is not None and not self._current.done():
+            self._token.set()
+            self._current.cancel()
+            return True
+        return dropped > 0
+
+    async def run(self, stage: str, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run a blocking call on the gateway's pool, timed as ``stage`` of the current utterance."""
+        with self.timed(stage):
+            return await self.gateway.run(func, *args, **kwargs)
+
+    def _begin_utterance(self, stages: Optional[Dict[str, float]] = None) -> None:
+        self._record()
+        self._timings = UtteranceTimings(stages)
+
+    def _record(self) -> None:
+        timings, self._timings = self._timings, None
+        if timings is None or not timings.stages:
+            return
+        breakdown = timings.as_dict()
+        self.history.append(breakdown)
+        logger.info(f"Voice session {self.name}: {breakdown}")
+
+    @contextmanager
+    def timed(self, stage: str) -> Iterator[None]:
+        timings = self._timings
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            if timings is not None:
+                timings.add(stage, time.monotonic() - started)
+
+    async def _work(self) -> None:
+        while True:
+            while not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            handler, stages = self._queue.popleft()
+            self._begin_utterance(stages)
+            timings = self._timings
+            self._token = threading.Event()
+            self._current = asyncio.create_task(self._run_utterance(handler, self._token))
+            try:
+                # wait() instead of awaiting the task: its cancellation must not end this loop
+                await asyncio.wait({self._current})
+            except asyncio.CancelledError:
+                timings.outcome = "cancelled"
+                self._token.set()
+                self._current.cancel()
+                raise
+            if self._current.cancelled() or isinstance(self._current.exception(), OperationCancelled):
+                timings.outcome = "cancelled"
+                self.cancelled += 1
+            elif self._current.exception() is not None:
+                timings.outcome = "failed"
+                logger.error(f"Voice session {self.name}: utterance failed: {self._current.exception()}")
+            self._current = None
+            self._record()
+
+    @staticmethod
+    async def _run_utterance(handler: Callable[[], Awaitable[None]], token: threading.Event) -> None:
+        # The scope is set inside the task, so only this utterance's jobs see the token
+        with cancel_scope(token):
+            await handler()
+
+    async def close(self) -> None:
+        self.cancel()
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._record()
+        self.gateway.unregister(self)
+
+    def metrics(self) -> Dict[str, Any]:
+        history = list(self.history)
+        stages = sorted({stage for item in history for stage in item if stage != "outcome"})
+        summary = {}
+        for stage in stages:
+            values = [item[stage] for item in history if stage in item]
+            summary[stage] = {"p50": _percentile(values, 50), "p95": _percentile(values, 95)}
+        return {
+            "utterances": len(history),
+            "queued": len(self._queue),
+            "running": self._current is not None,
+            "cancelled": self.cancelled,
+            "rejected": self.rejected,
+            "latencyMs": summary,
+            "last": history[-1] if history else None,
+        }
+
+
+class VoiceGateway:
+    """Worker pool and registry shared by all voice sessions of the process."""
+
+    def __init__(self, workers: int = VOICE_WORKERS, max_backlog: Optional[int] = None,
+                 max_pending: int = MAX_PENDING_UTTERANCES):
+        self.workers = workers
+        self.max_backlog = max_backlog or workers * BACKLOG_PER_WORKER
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="voice-worker")
+        self._backlog = 0
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, VoiceSession] = {}
+        self._ids = itertools.count(1)
+
+    def open(self, kind: str) -> VoiceSession:
+        session = VoiceSession(self, f"{kind}-{next(self._ids)}", self.max_pending)
+        self._sessions[session.name] = session
+        return session
+
+    def unregister(self, session: VoiceSession) -> None:
+        self._sessions.pop(session.name, None)
+
+    def saturated(self) -> bool:
+        with self._lock:
+            return self._backlog >= self.max_backlog
+
+    def _finished(self, _future) -> None:
+        with self._lock:
+            self._backlog -= 1
+
+    async def run(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        with self._lock:
+            self._backlog += 1
+        future = self.executor.submit(run_in_scope(functools.partial(func, *args, **kwargs)))
+        future.add_done_callback(self._finished)
+        # Cancelling the awaiting task cancels the job if it hasn't started yet
+        return await asyncio.wrap_future(future)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            backlog = self._backlog
+        return {
+            "workers": self.workers,
+            "backlog": backlog,
+            "maxBacklog": self.max_backlog,
+            "sessions": {name: session.metrics() for name, session in list(self._sessions.items())},
+        }
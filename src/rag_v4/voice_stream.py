@@ -0,0 +1,388 @@
+"""
+Streaming delivery of synthesized speech over a websocket.
+
+The original protocol sends the assistant text as JSON and then the whole
+TTS reply as one binary frame, so playback cannot start before the last byte
+is synthesized. In streaming mode each utterance is framed as
+
+    {"type": "audio_start", "streamId": 3, "format": "mp3_44100_128"}
+    <binary chunk> <binary chunk> ...
+    {"type": "audio_end", "streamId": 3, "bytes": 48213}
+
+and chunks are forwarded as soon as the TTS engine yields them. On a TTS
+failure the client receives {"type": "audio_end", ..., "error": "..."} so it
+can stop waiting. Clients opt in with ``?ttsStream=1`` on the websocket URL
+or a ``TTS_STREAM:1`` control message; everyone else keeps the single binary
+frame.
+
+``SpeechPipeline`` goes one step further for long replies: text is fed in as
+it becomes available, split into sentences (with the ``field_updates`` JSON
+block held back and stripped as it arrives), and up to ``max_parallel``
+sentences are synthesized at once. Audio is still sent strictly in sentence
+order, so playback starts after roughly one sentence of TTS latency.
+
+When the task sending a reply is cancelled (the user barged in), synthesis
+threads stop pulling from the TTS engine at the next chunk and close its
+stream. This releases their TTS slots instead of synthesizing audio nobody
+will hear.
+"""
+
+import asyncio
+import logging
+import re
+import threading
+from typing import Any, Awaitable, Callable, Iterator, List, Optional, Set
+
+from cancellation import OperationCancelled, current_token
+
+logger = logging.getLogger(__name__)
+
+# Sentences shorter than this are merged with the next one to save TTS round trips
+MIN_SENTENCE_CHARS = 40
+TTS_PARALLELISM = 3
+
+# End-of-stream marker passed from the producer thread to the event loop
+_DONE = object()
+
+FIELD_UPDATES_MARKER = '{"field_updates"'
+FIELD_UPDATES_END = re.compile(r"\]\s*\}")
+# Sentence end: terminal punctuation (plus closing quotes/brackets) before whitespace, or a line break
+SENTENCE_END = re.compile(r"(?<=[.!?])[\"')\]]*\s+|\n+")
+# Lead-ins the model writes before a field_updates block; they are not read aloud
+BOILERPLATE = re.compile(
+    r"\s*(?:Based on the information I have, I was able to fill out some of the form for you!"
+    r"|Here's the updated information:)\s*"
+)
+
+
+class TTSStreamError(Exception):
+    """The TTS engine failed after ``bytes_sent`` bytes of this utterance were sent."""
+
+    def __init__(self, message: str, bytes_sent: int = 0):
+        super().__init__(message)
+        self.bytes_sent = bytes_sent
+
+
+def strip_boilerplate(text: str) -> str:
+    """``text`` without the field-update lead-ins (see BOILERPLATE)."""
+    return BOILERPLATE.sub(" ", text).strip()
+
+
+def wants_stream(value: Optional[str]) -> bool:
+    """Parse an opt-in flag from a query parameter or control message."""
+    return str(value or "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def _chunks(make_iterator: Callable[[], Iterator[bytes]], stop: Optional[threading.Event]) -> Iterator[bytes]:
+    """Chunks of ``make_iterator()``; OperationCancelled once ``stop`` is set."""
+    if stop is not None and stop.is_set():
+        raise OperationCancelled("speech synthesis cancelled")
+    iterator = make_iterator()
+    try:
+        for chunk in iterator:
+            if stop is not None and stop.is_set():
+                raise OperationCancelled("speech synthesis cancelled")
+            yield chunk
+    finally:
+        # Closing a generator closes the HTTP stream or engine call behind it
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            close()
+
+
+def collect_audio(make_iterator: Callable[[], Iterator[bytes]], stop: Optional[threading.Event] = None) -> bytes:
+    """
+    Join a chunk iterator into one clip on the calling thread. Stops with
+    OperationCancelled once ``stop`` (default: the caller's cancellation
+    token) is set.
+    """
+    return b"".join(_chunks(make_iterator, stop or current_token()))
+
+
+def iterate_in_thread(
+    make_iterator: Callable[[], Iterator[bytes]],
+    queue: Optional[asyncio.Queue] = None,
+    on_finish: Optional[Callable[[], None]] = None,
+    stop: Optional[threading.Event] = None,
+    run_blocking: Optional[Callable[..., Awaitable[Any]]] = None,
+) -> asyncio.Queue:
+    """
+    Run a blocking chunk iterator on a worker thread and hand its items to the
+    event loop through a queue. The queue ends with _DONE or the exception raised;
+    ``on_finish`` is then called on the event loop. Setting ``stop`` ends the
+    iteration at the next chunk with OperationCancelled.
+
+    With ``run_blocking`` (e.g. ``VoiceGateway.run``) the iterator runs as a job
+    of that pool, so it counts towards its backlog; otherwise on its own thread.
+    """
+    loop = asyncio.get_running_loop()
+    queue = queue if queue is not None else asyncio.Queue()
+    started = threading.Event()
+
+    def produce() -> None:
+        started.set()
+        try:
+            for chunk in _chunks(make_iterator, stop):
+                loop.call_soon_threadsafe(queue.put_nowait, chunk)
+        except Exception as e:
+            last = e
+        else:
+            last = _DONE
+        loop.call_soon_threadsafe(queue.put_nowait, last)
+        if on_finish is not None:
+            loop.call_soon_threadsafe(on_finish)
+
+    if run_blocking is None:
+        threading.Thread(target=produce, name="tts-stream", daemon=True).start()
+        return queue
+
+    def never_started(job: asyncio.Future) -> None:
+        # A job cancelled or refused before it ran must still end the queue and release its slot
+        if started.is_set():
+            return
+        error = OperationCancelled("speech synthesis cancelled") if job.cancelled() else job.exception()
+        queue.put_nowait(error or OperationCancelled("speech synthesis did not run"))
+        if on_finish is not None:
+            on_finish()
+
+    job = asyncio.ensure_future(run_blocking(produce))
+    _jobs.add(job)
+    job.add_done_callback(_jobs.discard)
+    job.add_done_callback(never_started)
+    return queue
+
+
+# Pool jobs started by iterate_in_thread, referenced until they finish
+_jobs: Set[asyncio.Future] = set()
+
+
+class AudioStreamer:
+    """Frames TTS audio for one websocket connection."""
+
+    def __init__(self, websocket, audio_format: str, run_blocking: Optional[Callable[..., Awaitable[Any]]] = None):
+        self.websocket = websocket
+        self.audio_format = audio_format
+        # Where blocking synthesis runs (e.g. VoiceGateway.run); a dedicated thread when None
+        self.run_blocking = run_blocking
+        self._next_id = 0
+
+    async def begin(self) -> int:
+        self._next_id += 1
+        await self.websocket.send_json({"type": "audio_start", "streamId": self._next_id, "format": self.audio_format})
+        return self._next_id
+
+    async def end(self, stream_id: int, total: int, error: Optional[BaseException] = None) -> None:
+        message = {"type": "audio_end", "streamId": stream_id, "bytes": total}
+        if error is not None:
+            message["error"] = str(error)
+        await self.websocket.send_json(message)
+
+    async def forward(self, queue: asyncio.Queue) -> int:
+        """Send chunks from ``queue`` until it ends; TTSStreamError if the producer failed."""
+        total = 0
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                return total
+            if isinstance(item, Exception):
+                raise TTSStreamError(str(item), total) from item
+            total += len(item)
+            await self.websocket.send_bytes(item)
+
+    async def send(self, make_iterator: Callable[[], Iterator[bytes]]) -> int:
+        """Stream one utterance and return the number of audio bytes sent."""
+        stream_id = await self.begin()
+        started = asyncio.get_running_loop().time()
+        stop = current_token() or threading.Event()
+        try:
+            total = await self.forward(iterate_in_thread(make_iterator, stop=stop, run_blocking=self.run_blocking))
+        except asyncio.CancelledError:
+            stop.set()
+            raise
+        except TTSStreamError as e:
+            logger.error(f"TTS stream {stream_id} failed: {e}")
+            await self.end(stream_id, e.bytes_sent, e)
+            raise
+        await self.end(stream_id, total)
+        logger.info(f"TTS stream {stream_id}: {total} bytes in {asyncio.get_running_loop().time() - started:.2f}s")
+        return total
+
+
+class SpeechSegmenter:
+    """
+    Incrementally turns assistant text into speakable sentences.
+
+    ``feed`` returns the sentences completed so far; ``flush`` returns the rest.
+    ``{"field_updates": [...]}`` blocks (single or double quoted) are removed
+    and kept in ``field_updates``; text that might still become such a block
+    is held back until it can be decided. The lead-ins announcing such a block
+    are dropped as well, as ``clean_response_for_voice`` does for whole replies.
+    """
+
+    def __init__(self, min_chars: int = MIN_SENTENCE_CHARS):
+        self.min_chars = min_chars
+        self.field_updates: List[str] = []
+        self._pending = ""  # raw text not yet classified as speech or JSON
+        self._speech = ""   # speech not yet cut into sentences
+
+    def feed(self, text: str) -> List[str]:
+        self._pending += text
+        self._strip_field_updates(final=False)
+        return self._sentences(final=False)
+
+    def flush(self) -> List[str]:
+        self._strip_field_updates(final=True)
+        return self._sentences(final=True)
+
+    def _strip_field_updates(self, final: bool) -> None:
+        while self._pending:
+            start = self._pending.find("{")
+            if start < 0:
+                self._speech, self._pending = self._speech + self._pending, ""
+                return
+            self._speech += self._pending[:start]
+            self._pending = self._pending[start:]
+
+            probe = re.sub(r"\s+", "", self._pending[:len(FIELD_UPDATES_MARKER) * 2]).replace("'", '"')
+            if probe.startswith(FIELD_UPDATES_MARKER):
+                end = FIELD_UPDATES_END.search(self._pending)
+                if end is None:
+                    if final:
+                        # Truncated block: never read JSON aloud
+                        logger.warning("Dropping unterminated field_updates block from speech")
+                        self._pending = ""
+                    return
+                self.field_updates.append(self._pending[:end.end()])
+                self._pending = self._pending[end.end():]
+            elif FIELD_UPDATES_MARKER.startswith(probe) and not final:
+                return  # could still become a block
+            else:
+                self._speech += "{"
+                self._pending = self._pending[1:]
+
+    def _sentences(self, final: bool) -> List[str]:
+        sentences = []
+        start = 0
+        for match in SENTENCE_END.finditer(self._speech):
+            sentence = self._speech[start:match.end()]
+            if len(sentence.strip()) >= self.min_chars:
+                sentences.append(" ".join(sentence.split()))
+                start = match.end()
+        # Unterminated or short text waits for more input, unless this is the end
+        self._speech = self._speech[start:]
+        if final:
+            sentences.append(" ".join(self._speech.split()))
+            self._speech = ""
+        # A lead-in ends in "!" or sits inside a sentence, so it is whole by the time its sentence is cut
+        return [sentence for sentence in map(strip_boilerplate, sentences) if sentence]
+
+
+def speech_sentences(text: str, min_chars: int = MIN_SENTENCE_CHARS) -> List[str]:
+    """The sentences ``SpeechPipeline`` synthesizes for ``text``, e.g. to pre-warm a TTS cache."""
+    segmenter = SpeechSegmenter(min_chars)
+    return segmenter.feed(text) + segmenter.flush()
+
+
+class SpeechPipeline:
+    """
+    Sentence-level TTS for one reply: synthesize ahead in parallel, send in order.
+
+        pipeline = SpeechPipeline(streamer, voice.synthesize_stream)
+        await pipeline.start()
+        pipeline.feed(text)            # as often as text arrives
+        await pipeline.finish(fallback="...")
+
+    ``feeder()`` gives a ``feed`` that worker threads can call, e.g. as the
+    ``on_delta`` callback of an LLM call, so speech starts while the reply is
+    still being generated.
+    """
+
+    def __init__(self, streamer: AudioStreamer, synthesize_stream: Callable[[str], Iterator[bytes]],
+                 max_parallel: int = TTS_PARALLELISM, min_chars: int = MIN_SENTENCE_CHARS):
+        self.streamer = streamer
+        self.synthesize_stream = synthesize_stream
+        self.segmenter = SpeechSegmenter(min_chars)
+        self.sentences: List[str] = []
+        # Whether any text was fed, even if it is not a whole sentence yet
+        self.fed = False
+        self.error: Optional[BaseException] = None
+        self._semaphore = asyncio.Semaphore(max(1, max_parallel))
+        self._jobs: asyncio.Queue = asyncio.Queue()
+        self._tasks: Set[asyncio.Task] = set()
+        self._sender: Optional[asyncio.Task] = None
+        self._stream_id = 0
+        # Shared by this reply's synthesis threads; the utterance's token when there is one
+        self._stop = current_token() or threading.Event()
+
+    @property
+    def field_updates(self) -> List[str]:
+        return self.segmenter.field_updates
+
+    async def start(self) -> None:
+        self._stream_id = await self.streamer.begin()
+        self._sender = asyncio.create_task(self._send())
+
+    def feed(self, text: str) -> None:
+        if self._stop.is_set():
+            return
+        self.fed = self.fed or bool(text)
+        for sentence in self.segmenter.feed(text):
+            self._speak(sentence)
+
+    def feeder(self) -> Callable[[str], None]:
+        """``feed`` for use from other threads; the text is handed to the event loop."""
+        loop = asyncio.get_running_loop()
+        return lambda text: loop.call_soon_threadsafe(self.feed, text)
+
+    async def finish(self, fallback: Optional[str] = None) -> int:
+        """Flush the last sentence, wait for all audio to be sent and close the stream."""
+        for sentence in self.segmenter.flush():
+            self._speak(sentence)
+        if not self.sentences and fallback:
+            self._speak(fallback)
+        self._jobs.put_nowait(None)
+        try:
+            total = await self._sender
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
+        await self.streamer.end(self._stream_id, total, self.error)
+        logger.info(f"TTS stream {self._stream_id}: {len(self.sentences)} sentences, {total} bytes")
+        return total
+
+    def cancel(self) -> None:
+        """Abandon the reply: running syntheses stop at their next chunk, waiting ones never start."""
+        self._stop.set()
+        for task in list(self._tasks):
+            task.cancel()
+        if self._sender is not None:
+            self._sender.cancel()
+
+    def _speak(self, sentence: str) -> None:
+        chunks: asyncio.Queue = asyncio.Queue()
+        # Queued before synthesis starts so sending order is sentence order
+        self._jobs.put_nowait(chunks)
+        self.sentences.append(sentence)
+        task = asyncio.create_task(self._synthesize(sentence, chunks))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _synthesize(self, sentence: str, chunks: asyncio.Queue) -> None:
+        # FIFO semaphore: earlier sentences get TTS slots first
+        await self._semaphore.acquire()
+        iterate_in_thread(lambda: self.synthesize_stream(sentence), queue=chunks, on_finish=self._semaphore.release,
+                          stop=self._stop, run_blocking=self.streamer.run_blocking)
+
+    async def _send(self) -> int:
+        total = 0
+        while True:
+            chunks = await self._jobs.get()
+            if chunks is None:
+                return total
+            try:
+                total += await self.streamer.forward(chunks)
+            except TTSStreamError as e:
+                # Later sentences are still sent; the client hears a gap rather than nothing
+                total += e.bytes_sent
+                logger.error(f"TTS stream {self._stream_id}: sentence failed: {e}")
+                self.error = self.error or e
@@ -0,0 +1,209 @@
+"""
+Speech backends behind voice.transcribe / voice.synthesize.
+
+- ``ElevenLabsBackend``: hosted STT (scribe_v1) and TTS, needs ELEVENLABS_API_KEY.
+- ``LocalBackend``: in-process CPU engines, no network: faster-whisper
+  (CTranslate2 port of Whisper) for STT and Piper for TTS.
+
+``VOICE_BACKEND`` picks one ("elevenlabs" or "local"); by default ElevenLabs is
+used when its key is set and the local engines otherwise. Nothing is loaded or
+checked at import time, so the API server starts without a key; a backend that
+cannot work raises VoiceBackendUnavailable on first use.
+"""
+
+import io
+import os
+import threading
+import wave
+from typing import Iterator, Optional, Tuple
+
+try:
+    from elevenlabs.client import ElevenLabs
+except ImportError:
+    ElevenLabs = None
+
+try:
+    from faster_whisper import WhisperModel
+except ImportError:
+    WhisperModel = None
+
+try:
+    from piper.voice import PiperVoice
+except ImportError:
+    PiperVoice = None
+
+# Sensible defaults configurable via env so ops can tune without code changes.
+DEFAULT_VOICE_ID = os.getenv("ELEVENLABS_VOICE_ID", "JBFqnCBsd6RMkjVDRZzb")
+DEFAULT_TTS_MODEL = os.getenv("ELEVENLABS_TTS_MODEL", "eleven_turbo_v2_5")
+DEFAULT_TTS_FORMAT = os.getenv("ELEVENLABS_TTS_FORMAT", "mp3_44100_128")
+
+LOCAL_STT_MODEL = os.getenv("LOCAL_STT_MODEL", "base.en")
+LOCAL_STT_COMPUTE_TYPE = os.getenv("LOCAL_STT_COMPUTE_TYPE", "int8")
+LOCAL_TTS_VOICE = os.getenv("LOCAL_TTS_VOICE")  # path to a Piper .onnx voice
+
+
+class VoiceBackendUnavailable(RuntimeError):
+    """The selected speech backend is missing its package, model or key."""
+
+
+class VoiceBackend:
+    """Base class: speech-to-text and text-to-speech for one engine."""
+
+    name = "base"
+    # Encoding of synthesized audio, sent to clients in audio_start frames
+    audio_format = ""
+
+    def transcribe(self, audio_bytes: bytes, filename: str = "audio.webm") -> str:
+        raise NotImplementedError
+
+    def synthesize_stream(self, text: str, voice_id: Optional[str] = None, model_id: Optional[str] = None,
+                          output_format: Optional[str] = None) -> Iterator[bytes]:
+        raise NotImplementedError
+
+    def cache_identity(self, voice_id: Optional[str] = None, model_id: Optional[str] = None,
+                       output_format: Optional[str] = None) -> Tuple[str, ...]:
+        """Everything besides the text that determines the synthesized audio."""
+        raise NotImplementedError
+
+
+class ElevenLabsBackend(VoiceBackend):
+    name = "elevenlabs"
+
+    def __init__(self, api_key: Optional[str]):
+        self.api_key = api_key
+        self.audio_format = DEFAULT_TTS_FORMAT
+        # Lazily-initialised client to avoid repeated hand-shakes
+        self._client = None
+
+    def client(self):
+        if self._client is None:
+            if ElevenLabs is None:
+                raise VoiceBackendUnavailable("The elevenlabs package is not installed.")
+            if not self.api_key:
+                raise VoiceBackendUnavailable(
+                    "ELEVENLABS_API_KEY not set. Please add it to your environment or .env file."
+                )
+            self._client = ElevenLabs(api_key=self.api_key)
+        return self._client
+
+    def transcribe(self, audio_bytes: bytes, filename: str = "audio.webm") -> str:
+        # Create a file-like object with proper filename and content type (ElevenLabs expects audio files with proper metadata)
+        audio_file = io.BytesIO(audio_bytes)
+        audio_file.name = filename
+        result = self.client().speech_to_text.convert(
+            file=audio_file,
+            model_id="scribe_v1",
+        )
+        # Extract text from result - the API returns an object with text property
+        transcript = getattr(result, 'text', '') or getattr(result, 'transcript', '')
+        return transcript.strip() if transcript else ""
+
+    def synthesize_stream(self, text: str, voice_id: Optional[str] = None, model_id: Optional[str] = None,
+                          output_format: Optional[str] = None) -> Iterator[bytes]:
+        audio_generator = self.client().text_to_speech.stream(
+            text=text,
+            voice_id=voice_id or DEFAULT_VOICE_ID,
+            model_id=model_id or DEFAULT_TTS_MODEL,
+            output_format=output_format or self.audio_format,
+        )
+        try:
+            for chunk in audio_generator:
+                if chunk:
+                    yield chunk
+        finally:
+            # Abandoned early (barge-in): release the HTTP stream now rather than at garbage collection
+            close = getattr(audio_generator, "close", None)
+            if close is not None:
+                close()
+
+    def cache_identity(self, voice_id: Optional[str] = None, model_id: Optional[str] = None,
+                       output_format: Optional[str] = None) -> Tuple[str, ...]:
+        return (self.name, voice_id or DEFAULT_VOICE_ID, model_id or DEFAULT_TTS_MODEL, output_format or self.audio_format)
+
+
+class LocalBackend(VoiceBackend):
+    """
+    faster-whisper STT and Piper TTS on the CPU. Models load on first use and
+    are shared by all sessions; each engine call is serialized by its own lock.
+    Synthesized audio is one WAV per call (voice/model/format arguments are ignored).
+    """
+
+    name = "local"
+    audio_format = "wav"
+
+    def __init__(self, stt_model: str = LOCAL_STT_MODEL, tts_voice: Optional[str] = LOCAL_TTS_VOICE,
+                 compute_type: str = LOCAL_STT_COMPUTE_TYPE):
+        self.stt_model = stt_model
+        self.tts_voice = tts_voice
+        self.compute_type = compute_type
+        self._whisper = None
+        self._piper = None
+        self._stt_lock = threading.Lock()
+        self._tts_lock = threading.Lock()
+
+    def whisper(self):
+        if self._whisper is None:
+            if WhisperModel is None:
+                raise VoiceBackendUnavailable("Local STT needs the faster-whisper package.")
+            self._whisper = WhisperModel(self.stt_model, device="cpu", compute_type=self.compute_type)
+        return self._whisper
+
+    def piper(self):
+        if self._piper is None:
+            if PiperVoice is None:
+                raise VoiceBackendUnavailable("Local TTS needs the piper-tts package.")
+            if not self.tts_voice or not os.path.exists(self.tts_voice):
+                raise VoiceBackendUnavailable("Set LOCAL_TTS_VOICE to a Piper .onnx voice model.")
+            self._piper = PiperVoice.load(self.tts_voice)
+        return self._piper
+
+    def transcribe(self, audio_bytes: bytes, filename: str = "audio.webm") -> str:
+        # faster-whisper decodes webm/ogg/wav itself (PyAV) and resamples to 16 kHz
+        with self._stt_lock:
+            segments, _ = self.whisper().transcribe(io.BytesIO(audio_bytes), beam_size=1, vad_filter=True)
+            return " ".join(segment.text.strip() for segment in segments).strip()
+
+    def synthesize_stream(self, text: str, voice_id: Optional[str] = None, model_id: Optional[str] = None,
+                          output_format: Optional[str] = None) -> Iterator[bytes]:
+        buffer = io.BytesIO()
+        with self._tts_lock:
+            voice = self.piper()
+            # piper-tts >= 1.3 renamed synthesize(text, wav_file) to synthesize_wav
+            synthesize_wav = getattr(voice, "synthesize_wav", None) or voice.synthesize
+            with wave.open(buffer, "wb") as wav_file:
+                synthesize_wav(text, wav_file)
+        yield buffer.getvalue()
+
+    def cache_identity(self, voice_id: Optional[str] = None, model_id: Optional[str] = None,
+                       output_format: Optional[str] = None) -> Tuple[str, ...]:
+        return (self.name, os.path.basename(self.tts_voice or ""), self.audio_format)
+
+
+_backend: Optional[VoiceBackend] = None
+_backend_lock = threading.Lock()
+
+
+def create_backend(name: Optional[str] = None) -> VoiceBackend:
+    api_key = os.getenv("ELEVENLABS_API_KEY")
+    name = (name or os.getenv("VOICE_BACKEND") or ("elevenlabs" if api_key else "local")).strip().lower()
+    if name == "elevenlabs":
+        return ElevenLabsBackend(api_key)
+    if name == "local":
+        return LocalBackend()
+    raise ValueError(f"Unknown VOICE_BACKEND '{name}' (expected 'elevenlabs' or 'local')")
+
+
+def get_backend() -> VoiceBackend:
+    """The process-wide backend chosen from the environment."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_backend()
+        return _backend
+
+
+def set_backend(backend: VoiceBackend) -> None:
+    """Replace the process-wide backend (tests, or switching engines at runtime)."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
@@ -0,0 +1,220 @@
+"""
+Index of local PDFs for voice-driven uploads.
+
+"Upload my W-2 from Downloads" used to glob every search location and open
+every candidate PDF to score it, on each request. The index keeps the
+features scoring needs for each file: filename tokens, the form keywords on
+page 1 and whether the PDF has an AcroForm. Entries are keyed by path and
+stay valid while the file's mtime and size are unchanged.
+
+Directories are registered with ``watch``. A background thread re-scans them
+every ``refresh_interval`` seconds and extracts features only for new or
+changed files. A lookup lists the directory with a single scandir, so a file
+saved a moment ago is still found. Only files the background scan hasn't
+reached yet are parsed inline. The features are kept in a small JSON manifest,
+so a restart doesn't parse every PDF again.
+"""
+
+import json
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+REFRESH_INTERVAL = 60.0
+MANIFEST_VERSION = 1
+DEFAULT_MANIFEST_PATH = os.getenv(
+    "DOCUMENT_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "uploads", "document_index.json"),
+)
+
+
+def list_pdfs(directory: str) -> List[Tuple[str, float, int]]:
+    """(path, mtime, size) of the PDFs directly inside ``directory``, like glob('*.pdf')."""
+    files = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or not entry.name.endswith(".pdf"):
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((entry.path, stat.st_mtime, stat.st_size))
+    except OSError:
+        return []
+    return files
+
+
+class DocumentIndex:
+    """Per-file PDF features, cached by (path, mtime, size) and refreshed in the background."""
+
+    def __init__(
+        self,
+        extract: Callable[[str], Dict[str, Any]],
+        manifest_path: Optional[str] = DEFAULT_MANIFEST_PATH,
+        refresh_interval: float = REFRESH_INTERVAL,
+        features_version: int = 1,
+    ):
+        self.extract = extract
+        # Bumped by the caller whenever ``extract`` changes, so stale manifests are discarded
+        self.features_version = features_version
+        self.manifest_path = manifest_path
+        self.refresh_interval = refresh_interval
+        # path -> (mtime, size, features)
+        self._entries: Dict[str, Tuple[float, int, Dict[str, Any]]] = {}
+        self._directories: List[str] = []
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._refreshed = False
+        self.hits = 0
+        self.extracted = 0
+        self._load_manifest()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def watch(self, directories: Iterable[str]) -> None:
+        """Keep the PDFs in ``directories`` (``~`` allowed) indexed by the background refresh."""
+        with self._lock:
+            for directory in directories:
+                path = os.path.abspath(os.path.expanduser(directory))
+                if path not in self._directories:
+                    self._directories.append(path)
+
+    def start(self) -> None:
+        """Index the watched directories now and then every ``refresh_interval`` seconds, off-thread."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="document-index", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Document index refresh failed: {e}")
+            if self._stop.wait(self.refresh_interval):
+                return
+
+    def files(self, directory: str) -> List[str]:
+        """PDF paths in ``directory``, listed now (features are not extracted)."""
+        return [path for path, _, _ in list_pdfs(os.path.expanduser(directory))]
+
+    def cached(self, path: str) -> Optional[Dict[str, Any]]:
+        """Indexed features of ``path`` if they are still current; never extracts."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._entries.get(os.path.abspath(path))
+            if entry is None or entry[0] != stat.st_mtime or entry[1] != stat.st_size:
+                return None
+            self.hits += 1
+            return entry[2]
+
+    def features(self, path: str) -> Optional[Dict[str, Any]]:
+        """Features of ``path``, extracted only if the file is new or changed; None if it is gone."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return self._features(os.path.abspath(path), stat.st_mtime, stat.st_size)
+
+    def _features(self, path: str, mtime: float, size: int) -> Dict[str, Any]:
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == mtime and entry[1] == size:
+                self.hits += 1
+                return entry[2]
+        features = self.extract(path)
+        with self._lock:
+            self._entries[path] = (mtime, size, features)
+            self.extracted += 1
+            self._dirty = True
+        return features
+
+    def refresh(self) -> None:
+        """Index new and changed PDFs in the watched directories and forget deleted ones."""
+        with self._lock:
+            directories = list(self._directories)
+        extracted_before = self.extracted
+        seen = set()
+        for directory in directories:
+            for path, mtime, size in list_pdfs(directory):
+                path = os.path.abspath(path)
+                seen.add(path)
+                try:
+                    self._features(path, mtime, size)
+                except Exception as e:
+                    logger.warning(f"Could not index {path}: {e}")
+
+        with self._lock:
+            removed = [
+                path for path in self._entries
+                if path not in seen and (os.path.dirname(path) in directories or not os.path.exists(path))
+            ]
+            for path in removed:
+                del self._entries[path]
+            if removed:
+                self._dirty = True
+            dirty, self._dirty = self._dirty, False
+        if dirty:
+            self._save_manifest()
+        if dirty or not self._refreshed:
+            self._refreshed = True
+            logger.info(f"Document index: {self.extracted - extracted_before} indexed, {len(removed)} removed, "
+                        f"{len(self._entries)} total")
+
+    def _load_manifest(self) -> None:
+        if not self.manifest_path or not os.path.exists(self.manifest_path):
+            return
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except Exception as e:
+            logger.error(f"Failed to read document index, rebuilding it: {e}")
+            return
+        if manifest.get("version") != MANIFEST_VERSION or manifest.get("features") != self.features_version:
+            return
+        for entry in manifest.get("files", []):
+            self._entries[entry["path"]] = (entry["mtime"], entry["size"], entry["features"])
+        logger.info(f"Loaded document index with {len(self._entries)} files")
+
+    def _save_manifest(self) -> None:
+        if not self.manifest_path:
+            return
+        with self._lock:
+            files = [
+                {"path": path, "mtime": mtime, "size": size, "features": features}
+                for path, (mtime, size, features) in self._entries.items()
+            ]
+        try:
+            os.makedirs(os.path.dirname(self.manifest_path) or ".", exist_ok=True)
+            tmp_path = f"{self.manifest_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": MANIFEST_VERSION, "features": self.features_version, "files": files}, f, separators=(",", ":"))
+            os.replace(tmp_path, self.manifest_path)
+        except Exception as e:
+            logger.error(f"Failed to write document index: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "files": len(self._entries),
+                "directories": list(self._directories),
+                "hits": self.hits,
+                "extracted": self.extracted,
+            }
@@ -0,0 +1,153 @@
+"""
+Content-addressed cache of synthesized speech.
+
+Entries are keyed by the sha256 of the normalized text together with the
+backend, voice, model and output format, so a cached clip is only ever
+returned for exactly the audio the engine would have produced.
+
+Two tiers:
+
+- memory: an LRU bounded by total audio bytes; every synthesized reply or
+  sentence goes here, so repeats within a process are free.
+- disk: only phrases registered through ``warm`` (fixed assistant replies
+  and prompts). Free-form replies can contain patient details and are never
+  written to disk.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+MAX_MEMORY_BYTES = int(float(os.getenv("TTS_CACHE_MEMORY_MB", "32")) * 1024 * 1024)
+DEFAULT_CACHE_DIR = os.getenv(
+    "TTS_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "uploads", "tts_cache"),
+)
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+def cache_key(text: str, *identity: str) -> str:
+    """Key for ``text`` spoken by the engine described by ``identity`` (backend, voice, model, format)."""
+    return hashlib.sha256(json.dumps([normalize_text(text), *identity]).encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    def __init__(self, directory: Optional[str] = DEFAULT_CACHE_DIR, max_memory_bytes: int = MAX_MEMORY_BYTES):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._persistent = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> Optional[str]:
+        return os.path.join(self.directory, key[:2], f"{key}.audio") if self.directory else None
+
+    def _remember(self, key: str, audio: bytes) -> None:
+        if len(audio) > self.max_memory_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+        self._memory[key] = audio
+        self._memory_bytes += len(audio)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError as e:
+            logger.warning(f"Could not read cached TTS audio {path}: {e}")
+            return None
+
+    def _write_disk(self, key: str, audio: bytes) -> None:
+        path = self._path(key)
+        if not path:
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(audio)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write cached TTS audio {path}: {e}")
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return audio
+        audio = self._read_disk(key)
+        with self._lock:
+            if audio is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, audio)
+            return audio
+
+    def put(self, key: str, audio: bytes) -> None:
+        if not audio:
+            return
+        with self._lock:
+            self._remember(key, audio)
+            persist = key in self._persistent
+        if persist:
+            self._write_disk(key, audio)
+
+    def warm(self, phrases: Iterable[str], key_for: Callable[[str], str], synthesize: Callable[[str], bytes]) -> int:
+        """
+        Mark ``phrases`` as persistent and synthesize the ones not on disk yet.
+        Returns the number synthesized; stops at the first synthesis failure.
+        """
+        synthesized = 0
+        for phrase in phrases:
+            key = key_for(phrase)
+            with self._lock:
+                self._persistent.add(key)
+            audio = self._read_disk(key)
+            if audio is not None:
+                with self._lock:
+                    self._remember(key, audio)
+                continue
+            try:
+                self.put(key, synthesize(phrase))
+                synthesized += 1
+            except Exception as e:
+                # Usually the engine itself is unavailable; the rest would fail the same way
+                logger.warning(f"Stopped pre-synthesizing at '{phrase[:40]}': {e}")
+                break
+        logger.info(f"TTS cache warmed: {synthesized} phrases synthesized, {len(self._memory)} clips in memory")
+        return synthesized
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._memory),
+                "bytes": self._memory_bytes,
+                "persistent": len(self._persistent),
+                "hits": self.hits,
+                "diskHits": self.disk_hits,
+                "misses": self.misses,
+            }
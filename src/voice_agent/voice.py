@@ -1,9 +1,9 @@
 import os
-from io import BytesIO
-from typing import Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List, Optional, Tuple
 
 from dotenv import load_dotenv
-from elevenlabs.client import ElevenLabs
 
 # Load .env file from the voice_agent directory
 import pathlib
@@ -11,25 +11,25 @@ current_dir = pathlib.Path(__file__).parent.parent.parent
 dotenv_path = current_dir / ".env"
 load_dotenv(dotenv_path)
 
-API_KEY = os.getenv("ELEVENLABS_API_KEY")
-if not API_KEY:
-    # pass # for now (TODO: UNDO)
-    raise RuntimeError(
-        "ELEVENLABS_API_KEY not set. Please add it to your environment or .env file."
+# STT/TTS engines live in backends.py (imported after .env so it sees its settings);
+# ELEVENLABS_API_KEY is only needed when the ElevenLabs backend is used
+try:
+    from .backends import (
+        DEFAULT_TTS_FORMAT, DEFAULT_TTS_MODEL, DEFAULT_VOICE_ID,
+        VoiceBackendUnavailable, get_backend, set_backend,
     )
-
-# Lazily-initialised singleton client to avoid repeated hand-shakes
-_client: Optional[ElevenLabs] = None
-
-
-def _get_client() -> ElevenLabs:
-    global _client
-    if _client is None:
-        _client = ElevenLabs(api_key=API_KEY)
-    return _client
+    from .tts_cache import TTSCache, cache_key
+    from .document_index import DocumentIndex
+except ImportError:
+    from backends import (
+        DEFAULT_TTS_FORMAT, DEFAULT_TTS_MODEL, DEFAULT_VOICE_ID,
+        VoiceBackendUnavailable, get_backend, set_backend,
+    )
+    from tts_cache import TTSCache, cache_key
+    from document_index import DocumentIndex
 
 
-def transcribe(audio_bytes: bytes) -> str:
+def transcribe(audio_bytes: bytes, filename: str = "audio.webm") -> str:
     if not audio_bytes:
         return "[No speech detected]"
     
@@ -37,23 +37,12 @@ def transcribe(audio_bytes: bytes) -> str:
     if len(audio_bytes) < 1000: 
         return "[No speech detected]"
     
-    # Create a file-like object with proper filename and content type (ElevenLabs expects audio files with proper metadata)
-    audio_file = BytesIO(audio_bytes)
-    audio_file.name = "audio.webm"
-    
     try:
-        client = _get_client()
-        result = client.speech_to_text.convert(
-            file=audio_file,
-            model_id="scribe_v1",
-        )
-        
-        # Extract text from result - the API returns an object with text property
-        transcript = getattr(result, 'text', '') or getattr(result, 'transcript', '')
-        transcript = transcript.strip() if transcript else ""
-
+        transcript = get_backend().transcribe(audio_bytes, filename=filename)
         return transcript if transcript else "[No speech detected]"
         
+    except VoiceBackendUnavailable:
+        raise
     except Exception as e:
         # Log the full error for debugging but return a clean message
         print(f"STT Error: {e}")
@@ -67,35 +56,59 @@ def transcribe(audio_bytes: bytes) -> str:
 
 # ------------------------------ Text-to-Speech -----------------------------
 
-# Sensible defaults configurable via env so ops can tune without code changes.
-DEFAULT_VOICE_ID = os.getenv("ELEVENLABS_VOICE_ID", "JBFqnCBsd6RMkjVDRZzb")
-DEFAULT_TTS_MODEL = os.getenv("ELEVENLABS_TTS_MODEL", "eleven_turbo_v2_5")
-DEFAULT_TTS_FORMAT = os.getenv("ELEVENLABS_TTS_FORMAT", "mp3_44100_128")
+def tts_format() -> str:
+    """Encoding of the audio synthesize/synthesize_stream return (e.g. mp3_44100_128, wav)."""
+    return get_backend().audio_format
+
+
+# Recurring replies are served from here instead of being synthesized again
+tts_cache = TTSCache()
+
+
+def _tts_cache_key(text: str, voice_id: Optional[str] = None, model_id: Optional[str] = None,
+                   output_format: Optional[str] = None) -> str:
+    return cache_key(text, *get_backend().cache_identity(voice_id, model_id, output_format))
+
+
+def _recorded(chunks: Iterator[bytes], key: str) -> Iterator[bytes]:
+    # Only a fully consumed stream is cached; an abandoned one would be truncated audio
+    collected = []
+    for chunk in chunks:
+        collected.append(chunk)
+        yield chunk
+    tts_cache.put(key, b''.join(collected))
+
+
+def synthesize_stream(
+    text: str,
+    *,
+    voice_id: Optional[str] = None,
+    model_id: Optional[str] = None,
+    output_format: Optional[str] = None,
+) -> Iterator[bytes]:
+    """Yield encoded audio chunks as the TTS engine produces them (one chunk on a cache hit)."""
+    key = _tts_cache_key(text, voice_id, model_id, output_format)
+    cached = tts_cache.get(key)
+    if cached is not None:
+        return iter([cached])
+    chunks = get_backend().synthesize_stream(text, voice_id=voice_id, model_id=model_id, output_format=output_format)
+    return _recorded(chunks, key)
 
 
 def synthesize(
     text: str,
     *,
-    voice_id: str = DEFAULT_VOICE_ID,
-    model_id: str = DEFAULT_TTS_MODEL,
-    output_format: str = DEFAULT_TTS_FORMAT,
+    voice_id: Optional[str] = None,
+    model_id: Optional[str] = None,
+    output_format: Optional[str] = None,
 ) -> bytes:
-    client = _get_client()
-    audio_generator = client.text_to_speech.convert(
-        text=text,
-        voice_id=voice_id,
-        model_id=model_id,
-        output_format=output_format,
-    )
-    
-    # ElevenLabs returns a generator, we need to consume it to get bytes
-    audio_chunks = []
-    for chunk in audio_generator:
-        audio_chunks.append(chunk)
-    
-    # Combine all chunks into a single bytes object
-    audio_bytes = b''.join(audio_chunks)
-    return audio_bytes
+    # Backends yield chunks; callers of this function want the whole reply at once
+    return b''.join(synthesize_stream(text, voice_id=voice_id, model_id=model_id, output_format=output_format))
+
+
+def warm_tts_cache(phrases: Iterable[str]) -> int:
+    """Pre-synthesize fixed replies so they play instantly, and keep them on disk across restarts."""
+    return tts_cache.warm(phrases, _tts_cache_key, lambda text: b''.join(get_backend().synthesize_stream(text)))
 
 
 # ------------------------------ File Upload Detection -----------------------------
@@ -208,9 +221,6 @@ def detect_file_upload_request(transcript: str) -> dict:
 
 
 def find_pdf_files(directory: str, doc_type: str = None) -> list:
-    import os
-    import glob
-    
     # Expand user path
     directory = os.path.expanduser(directory)
     
@@ -218,8 +228,7 @@ def find_pdf_files(directory: str, doc_type: str = None) -> list:
         return []
     
     # Get all PDF files
-    pdf_pattern = os.path.join(directory, "*.pdf")
-    pdf_files = glob.glob(pdf_pattern)
+    pdf_files = document_index.files(directory)
     
     # If doc_type is specified, filter by filename patterns
     if doc_type and pdf_files:
@@ -267,54 +276,116 @@ except ImportError:
     PdfReader = None
 
 
-def _extract_first_page_text(path: str) -> str:
+def _read_pdf(path: str) -> Tuple[str, bool]:
+    """First-page text and AcroForm presence, from a single parse of the file."""
     if PdfReader is None:
-        return ""
+        return "", False
     try:
         reader = PdfReader(path)
-        if not reader.pages:
-            return ""
-        return reader.pages[0].extract_text() or ""
     except Exception:
-        return ""
-
-
-def _pdf_has_acroform(path: str) -> bool:
-    if PdfReader is None:
-        return False
+        return "", False
     try:
-        reader = PdfReader(path)
-        return bool(reader.trailer["/Root"].get("/AcroForm"))
+        text = (reader.pages[0].extract_text() or "") if reader.pages else ""
+    except Exception:
+        text = ""
+    try:
+        has_acroform = bool(reader.trailer["/Root"].get("/AcroForm"))
     except Exception:
-        return False
+        has_acroform = False
+    return text, has_acroform
 
 
-def compute_pdf_score(path: str) -> float:
+# Negative tokens common in academic material that should be avoided
+NEGATIVE_TOKENS = [
+    "homework", "assignment", "solution", "solutions", "lecture", "slides",
+    "notes", "problem set", "problemset", "pset", "syllabus", "exam",
+]
+
+# Bump when pdf_features or the keyword pools change, so indexed features are recomputed
+PDF_FEATURES_VERSION = 1
+
+
+def _filename_tokens(path: str) -> Tuple[List[str], List[str]]:
     filename = os.path.basename(path).lower()
-    # Count positive tokens in filename
-    token_hits = sum(1 for token in POSITIVE_FILENAME_TOKENS if token in filename)
-
-    # Extract first page text and count keywords
-    page1_text = _extract_first_page_text(path).lower()
-    keyword_hits = 0
-    if page1_text:
-        keyword_hits = sum(1 for kw in FORM_KEYWORDS_PAGE1 if kw in page1_text)
-
-    # AcroForm presence
-    acro = 1 if _pdf_has_acroform(path) else 0
-
-    # Negative tokens common in academic material that should be avoided
-    NEGATIVE_TOKENS = [
-        "homework", "assignment", "solution", "solutions", "lecture", "slides",
-        "notes", "problem set", "problemset", "pset", "syllabus", "exam",
-    ]
+    return ([token for token in POSITIVE_FILENAME_TOKENS if token in filename],
+            [tok for tok in NEGATIVE_TOKENS if tok in filename])
+
+
+def pdf_features(path: str) -> dict:
+    """Everything compute_pdf_score needs from one PDF (cached by the document index)."""
+    positive, negative = _filename_tokens(path)
+    page1_text, has_acroform = _read_pdf(path)
+    page1_text = page1_text.lower()
+    return {
+        "filename_tokens": positive,
+        "negative_tokens": negative,
+        "keywords": [kw for kw in FORM_KEYWORDS_PAGE1 if kw in page1_text] if page1_text else [],
+        "acroform": has_acroform,
+    }
 
-    negative_hits = sum(1 for tok in NEGATIVE_TOKENS if tok in filename)
 
+def score_pdf_features(features: dict) -> float:
+    token_hits = len(features["filename_tokens"])
+    keyword_hits = len(features["keywords"])
+    acro = 1 if features["acroform"] else 0
+    negative_hits = len(features["negative_tokens"])
     score = 10 * token_hits + 7 * keyword_hits + 1.1 * acro - 12 * negative_hits
     return score
 
 
+def compute_pdf_score(path: str) -> float:
+    return score_pdf_features(pdf_features(path))
+
+
+# Features of the PDFs in the upload search locations, kept current in the background
+document_index = DocumentIndex(pdf_features, features_version=PDF_FEATURES_VERSION)
+
+# Threads parsing PDFs the index hasn't seen yet (PyPDF2 releases the GIL on file I/O only,
+# so this mostly overlaps reads; the index keeps repeat requests from parsing at all)
+PDF_SCORING_WORKERS = int(os.getenv("PDF_SCORING_WORKERS", "4"))
+
+_scoring_pool: Optional[ThreadPoolExecutor] = None
+_scoring_pool_lock = threading.Lock()
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _scoring_pool
+    with _scoring_pool_lock:
+        if _scoring_pool is None:
+            _scoring_pool = ThreadPoolExecutor(max_workers=PDF_SCORING_WORKERS, thread_name_prefix="pdf-score")
+        return _scoring_pool
+
+
+def score_pdf_candidates(pdf_files: list) -> List[Tuple[float, str]]:
+    """
+    (score, path) for every candidate, best first. Indexed files are scored
+    from their cached features; the rest are parsed once each, in parallel,
+    and land in the index for the next request.
+    """
+    # The same file can be found through two search locations
+    unique = {}
+    for fp in pdf_files:
+        unique.setdefault(os.path.realpath(fp), fp)
+
+    scored = []
+    unscored = []
+    for fp in unique.values():
+        features = document_index.cached(fp)
+        if features is not None:
+            scored.append((score_pdf_features(features), fp))
+        else:
+            unscored.append(fp)
+
+    # Page-1 keywords alone can add 7 * 17 points, so no file can be skipped before it is parsed
+    if unscored:
+        for fp, features in zip(unscored, _pool().map(document_index.features, unscored)):
+            if features is not None:
+                scored.append((score_pdf_features(features), fp))
+
+    scored.sort(reverse=True)
+    return scored
+
+
 def select_best_pdf_match(pdf_files: list, upload_request: dict) -> str:
     if not pdf_files:
         return None
@@ -329,13 +400,8 @@ def select_best_pdf_match(pdf_files: list, upload_request: dict) -> str:
                 return fp
 
     # Score each candidate (ignore ones below soft threshold)
-    scored = []
-    for fp in pdf_files:
-        s = compute_pdf_score(fp)
-        if s >= 15:  # soft cut-off to drop clearly irrelevant docs
-            scored.append((s, fp))
-
-    scored.sort(reverse=True)
+    scored = [(s, fp) for s, fp in score_pdf_candidates(pdf_files)
+              if s >= 15]  # soft cut-off to drop clearly irrelevant docs
 
     # Return highest-scoring file
     return scored[0][1] if scored else None